@@ -1,28 +1,132 @@
-from flask import Flask
+import logging
+import os
+import threading
+
+from flask import Flask, jsonify
 from flask_cors import CORS
 from routes.auth import auth_bp
 from routes.post import post_bp
 from routes.advertisement import ad_bp
 from routes.feed import feed_bp
+from routes.health import health_bp
+from routes.uploads import upload_bp
+from routes.media import media_bp
+from utils.db import init_app as init_db
+from utils.metrics import init_app as init_metrics, METRICS_ENABLED
+from utils.logs import configure as configure_logging
+from utils.uploads import UploadRequest, UPLOAD_MAX_BYTES
+from utils.serializers import FastJSONProvider
+from utils.availability import availability
+from utils.storage import storage, upload_secret
+from utils.auth import auth_secret
+
+logger = logging.getLogger("app")
+
+# Run the startup warm-up (bucket check, availability filters) when the
+# server hands the module-level app its first request; never at import
+WARM_ON_STARTUP = os.getenv("WARM_ON_STARTUP", "1") != "0"
+
+
+def warm_up():
+    """Slow startup work, run off the boot path: it needs the network"""
+    # Load the email/username availability filters in the background
+    availability.warm()
+
+    def check_bucket():
+        try:
+            status = storage.ensure_bucket()
+            logger.info("Storage ready: %s bucket %s", status['backend'], status['bucket'])
+        except Exception as e:
+            logger.warning("Storage check failed (see /api/health/storage): %s", e)
+
+    threading.Thread(target=check_bucket, name="storage-check", daemon=True).start()
+
+
+def warm_on_first_request(app):
+    """Run warm_up() when a server delivers the app's first request.
+
+    The wrapper swaps itself out on that request, so later ones go straight
+    to the app. Importing or creating the app therefore does no remote
+    work, and neither does a reloader parent that never serves.
+    """
+    wsgi_app = app.wsgi_app
+    lock = threading.Lock()
+
+    def first_request(environ, start_response):
+        with lock:
+            if app.wsgi_app is first_request:
+                app.wsgi_app = wsgi_app
+                warm_up()
+        return wsgi_app(environ, start_response)
+
+    app.wsgi_app = first_request
+
 
-app = Flask(__name__)
+def create_app(warm=False, metrics=METRICS_ENABLED):
+    """Build the Flask app. Creating it does no network or database I/O;
+    that happens on first use, or on the first request when `warm` is set."""
+    configure_logging()
 
-# Configure CORS with explicit settings
-CORS(app, resources={
-    r"/*": {
-        "origins": ["http://localhost:3000", "http://localhost:5173"],
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
-        "allow_headers": ["Content-Type", "Authorization"],
-        "supports_credentials": True
-    }
-})
+    # Refuse to start without the signing secrets rather than issue
+    # tokens anyone could forge
+    upload_secret()
+    auth_secret()
 
-# Register Blueprints
-app.register_blueprint(auth_bp, url_prefix='/auth')
-app.register_blueprint(post_bp)
-app.register_blueprint(ad_bp)
-app.register_blueprint(feed_bp)
+    app = Flask(__name__)
+
+    # Request latency, status and in-flight metrics for /metrics; the timing
+    # covers the before/after_request hooks as well as the view
+    if metrics:
+        init_metrics(app)
+
+    # jsonify through orjson (or the stdlib encoder if JSON_ENCODER=json)
+    app.json = FastJSONProvider(app)
+
+    # Spool multipart files to disk past a small threshold and refuse bodies
+    # over the upload limit before reading them
+    app.request_class = UploadRequest
+    app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES
+
+    # Configure CORS with explicit settings
+    CORS(app, resources={
+        r"/*": {
+            "origins": ["http://localhost:3000", "http://localhost:5173"],
+            "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
+            "allow_headers": ["Content-Type", "Authorization", "Upload-Checksum"],
+            "expose_headers": ["Upload-Offset", "Upload-Length", "Location"],
+            "supports_credentials": True
+        }
+    })
+
+    # Register Blueprints
+    app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.register_blueprint(post_bp)
+    app.register_blueprint(ad_bp)
+    app.register_blueprint(feed_bp)
+    app.register_blueprint(health_bp)
+    app.register_blueprint(upload_bp)
+    app.register_blueprint(media_bp)
+
+    # Hand each request's pooled connection back at teardown
+    init_db(app)
+
+    @app.errorhandler(413)
+    def request_too_large(e):
+        return jsonify({"error": f"Upload too large: {e.description}"}), 413
+
+    @app.cli.command("init-storage")
+    def init_storage():
+        """Check the storage bucket and create it if it is missing"""
+        print(storage.ensure_bucket())
+
+    if warm:
+        warm_on_first_request(app)
+    return app
+
+
+# The entrypoint for `python app.py` and WSGI servers (app:app); tests and
+# scripts should build their own with create_app()
+app = create_app(warm=WARM_ON_STARTUP)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
-
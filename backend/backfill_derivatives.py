@@ -0,0 +1,21 @@
+"""
+Generate resized image derivatives for posts uploaded before the pipeline existed
+
+Usage: python backfill_derivatives.py [limit]
+"""
+import sys
+from dotenv import load_dotenv
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+load_dotenv()
+
+from utils.derivatives import backfill
+from utils.logs import configure as configure_logging
+
+if __name__ == "__main__":
+    configure_logging()
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    total = backfill(limit=limit)
+    print(f"Done: {total} posts processed")
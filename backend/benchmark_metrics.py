@@ -0,0 +1,143 @@
+"""
+Measure what the metrics instrumentation costs per request and per query
+
+Requests: the instrumentation's own cost is timed around a dispatch that
+does nothing, and set against a full request to GET /api/health/passwords
+through the WSGI stack (a route that does almost no work, so this is the
+worst case). An end-to-end comparison of the app built with and without
+instrumentation is printed too, next to the same comparison between two
+identical uninstrumented apps: on a shared machine that noise floor is
+larger than the effect, so these lines are informational only. Rounds are short and many,
+and the fastest round of each is used.
+
+Queries: with --db, `SELECT 1` round trips on a plain connection are
+compared with the instrumented connection the pool uses (query metrics
+plus the per-fingerprint tracing in utils/query_trace.py). Without a
+database only the wrapper's own cost is timed.
+
+Exits non-zero if the request overhead is over METRICS_OVERHEAD_TARGET percent.
+
+Usage: python benchmark_metrics.py [requests_per_round] [--db]
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("WARM_ON_STARTUP", "0")
+# create_app() refuses to start without its signing secrets; nothing
+# signed here leaves the process
+os.environ.setdefault("UPLOAD_SECRET_KEY", "benchmark-only")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-auth")
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import psycopg2
+from flask import Flask, Response
+
+from app import create_app
+from utils.db import connect, timed_cursor_class
+from utils.metrics import init_app as init_metrics
+
+# Largest acceptable request overhead, in percent
+METRICS_OVERHEAD_TARGET = float(os.getenv("METRICS_OVERHEAD_TARGET", 2))
+ROUNDS = 40
+PATH = "/api/health/passwords"
+
+
+def per_call_us(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def fastest(fn, count):
+    fn()
+    return min(per_call_us(fn, count) for _ in range(ROUNDS))
+
+
+def compare(label, baseline, instrumented, count):
+    """Fastest round of each, alternating so both see the same conditions"""
+    baseline(), instrumented()
+    best_base = best_inst = float("inf")
+    for _ in range(ROUNDS):
+        best_base = min(best_base, per_call_us(baseline, count))
+        best_inst = min(best_inst, per_call_us(instrumented, count))
+    overhead = (best_inst - best_base) / best_base * 100
+    print(f"{label:28} {best_base:9.2f}us -> {best_inst:9.2f}us  "
+          f"({best_inst - best_base:+.2f}us, {overhead:+.2f}%)")
+    return overhead
+
+
+def instrumentation_cost_us(count):
+    """Time the request instrumentation wraps around a dispatch that does nothing"""
+    app = Flask(__name__)
+    app.add_url_rule("/noop", "noop", lambda: "")
+    response = Response()
+    app.full_dispatch_request = lambda: response
+    bare = app.full_dispatch_request
+    init_metrics(app)
+    with app.test_request_context("/noop"):
+        app.preprocess_request()  # nothing registered; matches the URL rule
+        return fastest(app.full_dispatch_request, count * 50) - fastest(bare, count * 50)
+
+
+class _NullCursor:
+    name = None
+    rowcount = 1
+
+    def execute(self, query, vars=None):
+        return None
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    count = int(args[0]) if args else 200
+
+    bare = create_app(warm=False, metrics=False).test_client()
+    timed = create_app(warm=False, metrics=True).test_client()
+    request_us = fastest(lambda: bare.get(PATH), count)
+    cost_us = instrumentation_cost_us(count)
+    request_overhead = cost_us / request_us * 100
+    print(f"{'request instrumentation':28} {cost_us:9.2f}us per request, "
+          f"{request_overhead:.2f}% of GET {PATH} ({request_us:.1f}us)")
+    control = create_app(warm=False, metrics=False).test_client()
+    compare("end to end, noise floor", lambda: bare.get(PATH), lambda: control.get(PATH), count)
+    compare("end to end, instrumented", lambda: bare.get(PATH), lambda: timed.get(PATH), count)
+
+    plain, wrapped = _NullCursor(), timed_cursor_class(_NullCursor)()
+    query_cost_us = fastest(lambda: wrapped.execute("SELECT 1"), count * 50) - \
+        fastest(lambda: plain.execute("SELECT 1"), count * 50)
+    print(f"{'query instrumentation':28} {query_cost_us:9.2f}us per statement (metrics and tracing)")
+
+    if "--db" in sys.argv:
+        direct = psycopg2.connect(
+            host=os.getenv("DB_HOST"),
+            database=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASS"),
+            port=os.getenv("DB_PORT", 5432)
+        )
+        instrumented = connect()
+        plain_cur, timed_cur = direct.cursor(), instrumented.cursor()
+
+        def query(cur):
+            def run():
+                cur.execute("SELECT 1")
+                cur.fetchone()
+            return run
+
+        compare("SELECT 1 round trip", query(plain_cur), query(timed_cur), max(1, count // 10))
+        direct.close()
+        instrumented.close()
+
+    print(f"\nTarget: request overhead under {METRICS_OVERHEAD_TARGET:.1f}%")
+    if request_overhead > METRICS_OVERHEAD_TARGET:
+        print("Instrumentation overhead is over target")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark post search against a synthetic table of millions of posts
+
+Builds bench_posts as a copy of the posts schema (including search_vector
+and its indexes), fills it with random titles and content, then runs the
+queries /api/posts/search issues under EXPLAIN (ANALYZE, BUFFERS) and
+prints the plan nodes, indexes used and timings. Each query is also run
+with index scans disabled to show what a sequential scan would cost.
+
+Usage: python benchmark_search.py [rows] [--keep]
+"""
+import os
+import sys
+from dotenv import load_dotenv
+import psycopg2
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+load_dotenv()
+
+from utils.search import fulltext_query, fuzzy_query, fuzzy_threshold_sql
+
+TABLE = "bench_posts"
+BATCH = 250000
+COLUMNS = "id, title, created_at"
+
+VOCABULARY = [
+    "football", "match", "highlights", "goal", "training", "coach", "season",
+    "transfer", "stadium", "fans", "interview", "league", "final", "derby",
+    "keeper", "striker", "defence", "midfield", "penalty", "victory", "draw",
+    "academy", "youth", "women", "summer", "winter", "preview", "review",
+    "analysis", "tactics", "injury", "comeback", "record", "trophy", "cup",
+    "champions", "weekend", "morning", "session", "behind", "scenes", "video",
+]
+
+QUERIES = [
+    ("full-text, one word", fulltext_query, "highlights"),
+    ("full-text, two words", fulltext_query, "derby penalty"),
+    ("full-text, prefix", fulltext_query, "tact"),
+    ("fuzzy, misspelt", fuzzy_query, "higlights stadum"),
+]
+
+
+def connect():
+    return psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        port=os.getenv("DB_PORT", 5432)
+    )
+
+
+def populate(cur, rows):
+    cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    cur.execute(f"CREATE TABLE {TABLE} (LIKE posts INCLUDING ALL)")
+    words = "(%(vocab)s)[1 + floor(random() * %(size)s)::int]"
+    for start in range(0, rows, BATCH):
+        count = min(BATCH, rows - start)
+        # Referencing g in the subqueries makes them run once per row
+        cur.execute(f"""
+            INSERT INTO {TABLE} (title, content, media_type, media_url, is_published, created_at)
+            SELECT
+                (SELECT string_agg({words}, ' ') FROM generate_series(1, 3 + g %% 4)),
+                (SELECT string_agg({words}, ' ') FROM generate_series(1, 20 + g %% 30)),
+                CASE WHEN g %% 3 = 0 THEN 'video' ELSE 'image' END,
+                'https://example.invalid/' || g,
+                g %% 5 <> 0,
+                NOW() - (g || ' seconds')::interval
+            FROM generate_series(%(start)s, %(end)s) AS g
+        """, {"vocab": VOCABULARY, "size": len(VOCABULARY), "start": start, "end": start + count - 1})
+        print(f"Inserted {start + count} rows")
+    cur.execute(f"ANALYZE {TABLE}")
+
+
+def plan_summary(plan, found=None):
+    """Node types and index names appearing anywhere in a JSON plan"""
+    found = found if found is not None else {"nodes": [], "indexes": []}
+    found["nodes"].append(plan["Node Type"])
+    if "Index Name" in plan:
+        found["indexes"].append(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        plan_summary(child, found)
+    return found
+
+
+def explain(cur, sql, params):
+    cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params)
+    result = cur.fetchone()[0][0]
+    summary = plan_summary(result["Plan"])
+    return result["Execution Time"], summary
+
+
+def run(cur):
+    for label, build, text in QUERIES:
+        sql, params = build(COLUMNS, text, limit=21, table=TABLE)
+        if build is fuzzy_query:
+            cur.execute(*fuzzy_threshold_sql())
+
+        elapsed, summary = explain(cur, sql, params)
+        print(f"\n{label} ({text!r})")
+        print(f"  indexed:    {elapsed:9.1f} ms  indexes={summary['indexes'] or '-'}")
+        print(f"              nodes={' > '.join(summary['nodes'])}")
+
+        cur.execute("SET LOCAL enable_bitmapscan = off")
+        cur.execute("SET LOCAL enable_indexscan = off")
+        elapsed, summary = explain(cur, sql, params)
+        print(f"  seq scan:   {elapsed:9.1f} ms  nodes={' > '.join(summary['nodes'])}")
+        cur.execute("RESET enable_bitmapscan")
+        cur.execute("RESET enable_indexscan")
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    rows = int(args[0]) if args else 2000000
+    keep = "--keep" in sys.argv
+
+    conn = connect()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT to_regclass(%s)", (TABLE,))
+        if cur.fetchone()[0] is None or not keep:
+            populate(cur, rows)
+            conn.commit()
+        run(cur)
+        conn.rollback()
+        if not keep:
+            cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+            conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Measure the cold start of the API: a fresh interpreter importing app.py and
+calling create_app(), as every worker boot does.
+
+Each run is a new process, so nothing is cached between runs except the OS
+file cache and .pyc files. The environment is left as the server sees it:
+the warm-up waits for the first request, so importing app.py must not start
+any remote work. Prints the import and factory times per run, and with
+--imports the slowest modules from `python -X importtime`.
+
+Exits non-zero when the median exceeds STARTUP_TARGET_MS or the import
+leaves a thread running, so it can gate CI.
+
+Usage: python benchmark_startup.py [runs] [--imports]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+# Median cold start (import + create_app) the app must stay under
+STARTUP_TARGET_MS = float(os.getenv("STARTUP_TARGET_MS", 1000))
+
+# create_app() refuses to start without its signing secrets; nothing
+# signed here leaves the process
+os.environ.setdefault("UPLOAD_SECRET_KEY", "benchmark-only")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-auth")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PROBE = """
+import threading
+import time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+# Any thread running now was started by the import (e.g. a warm-up)
+print(",".join(t.name for t in threading.enumerate() if t is not threading.main_thread()) or "-")
+print((imported - started) * 1000, (created - imported) * 1000)
+"""
+
+
+def run_once():
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=HERE,
+        capture_output=True, text=True, check=True
+    )
+    threads, timings = result.stdout.strip().splitlines()[-2:]
+    import_ms, factory_ms = map(float, timings.split())
+    return import_ms, factory_ms, [] if threads == "-" else threads.split(",")
+
+
+def slowest_imports(limit=15):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"], cwd=HERE,
+        capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented under their importer; keep the
+        # modules app.py's own imports pulled in, so nothing counts twice
+        if len(name) - len(name.lstrip()) == 3:
+            rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    runs = int(args[0]) if args else 5
+
+    # One untimed run compiles the .pyc files
+    run_once()
+    samples = []
+    background = set()
+    for i in range(runs):
+        import_ms, factory_ms, threads = run_once()
+        background.update(threads)
+        samples.append(import_ms + factory_ms)
+        print(f"run {i + 1}: import {import_ms:7.1f}ms  create_app {factory_ms:6.1f}ms  total {import_ms + factory_ms:7.1f}ms")
+
+    median = statistics.median(samples)
+    print(f"\nmedian {median:.1f}ms, max {max(samples):.1f}ms, target {STARTUP_TARGET_MS:.0f}ms")
+
+    if "--imports" in sys.argv:
+        print("\nSlowest top-level imports (cumulative):")
+        for cumulative_us, name in slowest_imports():
+            print(f"  {cumulative_us / 1000:8.1f}ms  {name}")
+
+    failed = False
+    if background:
+        print(f"Importing the app started background work: {', '.join(sorted(background))}")
+        failed = True
+    if median > STARTUP_TARGET_MS:
+        print("Cold start is over target")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
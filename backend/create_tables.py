@@ -13,6 +13,74 @@ if sys.platform == 'win32':
 
 load_dotenv()
 
+SEARCH_VECTOR_SQL = """
+    setweight(to_tsvector('english', coalesce({row}title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce({row}content, '')), 'B')
+"""
+# Rows per UPDATE when filling search_vector for existing posts
+BACKFILL_BATCH = 1000
+
+def create_index_concurrently(cur, name, definition):
+    """CREATE INDEX CONCURRENTLY, which needs autocommit and only blocks schema changes.
+
+    A concurrent build that failed leaves an INVALID index behind that
+    IF NOT EXISTS would skip, so one is dropped and built again.
+    """
+    cur.execute("""
+        SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = %s
+    """, (name,))
+    row = cur.fetchone()
+    if row and not row[0]:
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+
+def add_search_vector(cur):
+    """Add posts.search_vector without rewriting the table.
+
+    A GENERATED ... STORED column would rewrite every row under an ACCESS
+    EXCLUSIVE lock, blocking reads and writes for the whole rewrite. Instead
+    the column is added empty (a catalog-only change), kept up to date by a
+    trigger, and existing rows are filled in small batches, each its own
+    short transaction. Databases that already have the generated column
+    from an earlier run keep it.
+    """
+    cur.execute("""
+        SELECT attgenerated FROM pg_attribute
+        WHERE attrelid = 'posts'::regclass AND attname = 'search_vector' AND NOT attisdropped
+    """)
+    row = cur.fetchone()
+    if row and row[0] == 's':
+        return
+
+    cur.execute("ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector")
+    cur.execute(f"""
+        CREATE OR REPLACE FUNCTION posts_search_vector() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {SEARCH_VECTOR_SQL.format(row="NEW.")};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS posts_search_vector ON posts")
+    cur.execute("""
+        CREATE TRIGGER posts_search_vector
+        BEFORE INSERT OR UPDATE OF title, content ON posts
+        FOR EACH ROW EXECUTE FUNCTION posts_search_vector()
+    """)
+
+    filled = 0
+    while True:
+        cur.execute(f"""
+            UPDATE posts SET search_vector = {SEARCH_VECTOR_SQL.format(row="")}
+            WHERE id IN (SELECT id FROM posts WHERE search_vector IS NULL LIMIT %s)
+        """, (BACKFILL_BATCH,))
+        if cur.rowcount == 0:
+            break
+        filled += cur.rowcount
+    if filled:
+        print(f"✅ Search vectors filled for {filled} posts")
+
 def create_tables():
     """Create all necessary tables in the database"""
 
@@ -67,12 +135,117 @@ def create_tables():
         """)
         print("✅ Advertisements table created/verified")
 
+        # Resumable upload sessions and the chunks received for each
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+                filename VARCHAR(255) NOT NULL,
+                content_type VARCHAR(100),
+                media_type VARCHAR(50) NOT NULL,
+                title VARCHAR(255) NOT NULL,
+                content TEXT,
+                created_by UUID,
+                total_size BIGINT NOT NULL,
+                chunk_size INTEGER NOT NULL,
+                total_chunks INTEGER NOT NULL,
+                sha256 CHAR(64),
+                status VARCHAR(20) NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'finalizing', 'complete')),
+                post_id UUID,
+                created_at TIMESTAMP DEFAULT NOW(),
+                expires_at TIMESTAMP NOT NULL
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS upload_chunks (
+                session_id UUID NOT NULL REFERENCES upload_sessions(id) ON DELETE CASCADE,
+                chunk_index INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                sha256 CHAR(64) NOT NULL,
+                received_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (session_id, chunk_index)
+            )
+        """)
+        print("✅ Upload session tables created/verified")
+
+        # Resized image derivatives per post, keyed by width and format
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS media_derivatives (
+                post_id UUID NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+                width INTEGER NOT NULL,
+                format VARCHAR(10) NOT NULL,
+                path TEXT NOT NULL,
+                url TEXT NOT NULL,
+                bytes INTEGER,
+                created_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (post_id, width, format)
+            )
+        """)
+        print("✅ Media derivatives table created/verified")
+
+        # One row per distinct stored file, shared by every post/ad that uses it
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS media_objects (
+                sha256 CHAR(64) PRIMARY KEY,
+                path TEXT NOT NULL,
+                url TEXT NOT NULL UNIQUE,
+                size BIGINT NOT NULL,
+                content_type VARCHAR(100),
+                refcount INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        print("✅ Media objects table created/verified")
+
+        # Direct-upload tickets already finalized, kept until they expire so
+        # each ticket creates at most one post or ad
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS used_upload_tickets (
+                jti UUID PRIMARY KEY,
+                expires_at TIMESTAMP NOT NULL
+            )
+        """)
+        print("✅ Used upload tickets table created/verified")
+
         # Create indexes for better performance
         cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_created_at ON posts(created_at DESC)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_media_type ON posts(media_type)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_created_by ON posts(created_by)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_ads_active ON advertisements(is_active)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_ads_dates ON advertisements(start_date, end_date)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_upload_sessions_expires ON upload_sessions(expires_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_used_upload_tickets_expires ON used_upload_tickets(expires_at)")
+
+        # Keyset pagination of /api/posts: one (sort key, id) index per sort
+        # order, plus composite and partial indexes for the common filters.
+        # These (and the search and users indexes below) are built
+        # CONCURRENTLY, so the tables stay writable while they build
+        create_index_concurrently(cur, "idx_posts_created_id", "posts(created_at DESC, id DESC)")
+        create_index_concurrently(cur, "idx_posts_type_created", "posts(media_type, created_at DESC, id DESC)")
+        create_index_concurrently(cur, "idx_posts_creator_created", "posts(created_by, created_at DESC, id DESC)")
+        create_index_concurrently(cur, "idx_posts_published_created",
+                                  "posts(created_at DESC, id DESC) WHERE is_published = true")
+        create_index_concurrently(cur, "idx_posts_drafts_created",
+                                  "posts(created_at DESC, id DESC) WHERE is_published IS NOT TRUE")
+        create_index_concurrently(cur, "idx_posts_views", "posts((COALESCE(views_count, 0)) DESC, id DESC)")
+        create_index_concurrently(cur, "idx_posts_likes", "posts((COALESCE(likes_count, 0)) DESC, id DESC)")
+
+        # Search: a tsvector (title weighted above content) for ranked
+        # full-text matching and a trigram index for fuzzy titles
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        add_search_vector(cur)
+        create_index_concurrently(cur, "idx_posts_search", "posts USING gin(search_vector)")
+        create_index_concurrently(cur, "idx_posts_title_trgm", "posts USING gin(title gin_trgm_ops)")
+
+        # Admin user list: keyset order per role, and lower(...) LIKE 'prefix%'
+        # search on name, username and email. users is managed outside this
+        # script, so only index it when it exists
+        cur.execute("SELECT to_regclass('users')")
+        if cur.fetchone()[0]:
+            create_index_concurrently(cur, "idx_users_created_id", "users(created_at DESC, id DESC)")
+            create_index_concurrently(cur, "idx_users_role_created", "users(role, created_at DESC, id DESC)")
+            for column in ("full_name", "username", "email"):
+                create_index_concurrently(cur, f"idx_users_{column}_prefix",
+                                          f"users(lower({column}) text_pattern_ops)")
         print("✅ Indexes created/verified")
 
         # Check if table exists and has data
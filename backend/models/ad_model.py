@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from utils.db import get_db_connection, return_db_connection
+from utils.ad_inventory import ad_inventory
+from utils.cache import invalidate
+
+def create_advertisement(title, media_type, media_url, ad_type, start_date=None, end_date=None):
+    """Insert an advertisements row and return (ad_id, created_at isoformat)"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO advertisements (title, media_type, media_url, ad_type, start_date, end_date)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            RETURNING id, created_at;
+        """, (title, media_type, media_url, ad_type, start_date, end_date))
+        result = cur.fetchone()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        return_db_connection(conn)
+
+    ad_inventory.invalidate()
+    invalidate("ads")
+    created_at = result[1].isoformat() if result[1] else datetime.now().isoformat()
+    return str(result[0]), created_at
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from utils.db import get_db_connection, return_db_connection
+from utils.cache import invalidate
+
+def create_post(title, content, media_type, media_url, thumbnail_url, created_by, is_published=True):
+    """Insert a posts row and return (post_id, created_at isoformat)"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO posts (title, content, media_type, media_url, thumbnail_url, created_by, is_published)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            RETURNING id, created_at;
+        """, (title, content, media_type, media_url, thumbnail_url, created_by, is_published))
+        result = cur.fetchone()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        return_db_connection(conn)
+
+    invalidate("posts")
+    created_at = result[1].isoformat() if result[1] else datetime.now().isoformat()
+    return str(result[0]), created_at
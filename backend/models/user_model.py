@@ -1,5 +1,7 @@
-from utils.db import get_db_connection
+from utils.db import get_db_connection, return_db_connection
 from psycopg2.extras import RealDictCursor
+from utils.availability import availability
+from utils.helpers import seek_clause
 
 def create_user(full_name, email, username, password_hash, role='customer'):
     conn = get_db_connection()
@@ -9,14 +11,14 @@ def create_user(full_name, email, username, password_hash, role='customer'):
     cur.execute("SELECT id FROM users WHERE email=%s", (email,))
     if cur.fetchone():
         cur.close()
-        conn.close()
+        return_db_connection(conn)
         return None, "Email already exists"
 
     # Check if username exists
     cur.execute("SELECT id FROM users WHERE username=%s", (username,))
     if cur.fetchone():
         cur.close()
-        conn.close()
+        return_db_connection(conn)
         return None, "Username already exists"
 
     # Insert new user
@@ -29,7 +31,8 @@ def create_user(full_name, email, username, password_hash, role='customer'):
     user_id = cur.fetchone()[0]
     conn.commit()
     cur.close()
-    conn.close()
+    return_db_connection(conn)
+    availability.add(email, username)
     return user_id, None
 
 
@@ -40,7 +43,7 @@ def get_user_by_email(email):
     cur.execute("SELECT * FROM users WHERE email = %s", (email,))
     user = cur.fetchone()
     cur.close()
-    conn.close()
+    return_db_connection(conn)
     return user
 
 def get_user_by_username(username):
@@ -49,19 +52,86 @@ def get_user_by_username(username):
     cur.execute("SELECT * FROM users WHERE username = %s", (username,))
     user = cur.fetchone()
     cur.close()
-    conn.close()
+    return_db_connection(conn)
     return user
 
-def get_all_users():
+def update_password_hash(user_id, old_hash, new_hash):
+    """Replace a user's hash, unless the password was changed in the meantime"""
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT id, full_name, username, email, role, created_at, is_active
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+        (new_hash, user_id, old_hash)
+    )
+    conn.commit()
+    cur.close()
+    return_db_connection(conn)
+
+def set_user_active(user_id, is_active):
+    """Set a user's active flag; returns False if there is no such user"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("UPDATE users SET is_active = %s WHERE id = %s RETURNING id", (is_active, user_id))
+    updated = cur.fetchone() is not None
+    conn.commit()
+    cur.close()
+    return_db_connection(conn)
+    return updated
+
+# Customer accounts for the admin user list (admin accounts are excluded)
+ALL_USERS_QUERY = """
+    SELECT id, full_name, username, email, role, created_at, is_active
+    FROM users
+    WHERE role = 'customer'
+    ORDER BY created_at DESC
+"""
+
+# Columns of a user listing page, in ALL_USERS_QUERY order
+USER_PAGE_COLUMNS = "id, full_name, username, email, role, created_at, is_active"
+
+def user_filters(q=None, role="customer", is_active=None):
+    """SQL conditions and params for the admin user list filters.
+
+    `q` matches a prefix of the full name, username or email, case-insensitively;
+    each lower(...) LIKE 'prefix%' is served by a text_pattern_ops index.
+    """
+    clauses, params = [], []
+    if role != "all":
+        clauses.append("role = %s")
+        params.append(role)
+    if is_active is not None:
+        # Users without a flag count as active, as at login
+        clauses.append("is_active IS NOT FALSE" if is_active else "is_active = false")
+    if q:
+        prefix = q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        clauses.append("(lower(full_name) LIKE %s OR lower(username) LIKE %s OR lower(email) LIKE %s)")
+        params += [prefix, prefix, prefix]
+    return clauses, params
+
+def get_users_page(cur, clauses, params, after=None, limit=20):
+    """One keyset page (newest first) of users matching the conditions; `after` is (created_at, id)"""
+    conditions = list(clauses)
+    args = list(params)
+    if after is not None:
+        # created_at may be NULL; those users sort first
+        seek, seek_params = seek_clause("created_at", "DESC", True, *after)
+        conditions.append(seek)
+        args += seek_params
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    cur.execute(f"""
+        SELECT {USER_PAGE_COLUMNS}
         FROM users
-        WHERE role = 'customer'
-        ORDER BY created_at DESC
-    """)
+        {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """, (*args, limit))
+    return cur.fetchall()
+
+def get_all_users():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(ALL_USERS_QUERY)
     users = cur.fetchall()
     cur.close()
-    conn.close()
+    return_db_connection(conn)
     return users
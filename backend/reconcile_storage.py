@@ -0,0 +1,56 @@
+"""
+Find storage objects no post or advertisement references and delete them
+
+Dry run by default: prints a report per prefix and the orphaned keys.
+Pass --delete to remove orphans older than the grace period.
+
+Usage: python reconcile_storage.py [--delete] [--grace-hours N] [--prefix video/ ...]
+"""
+import argparse
+import json
+import sys
+from dotenv import load_dotenv
+
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')
+
+load_dotenv()
+
+from utils.reconcile import reconcile, RECONCILE_PREFIXES, RECONCILE_GRACE_HOURS
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--delete", action="store_true", help="delete orphans instead of only reporting them")
+    parser.add_argument("--grace-hours", type=float, default=RECONCILE_GRACE_HOURS)
+    parser.add_argument("--prefix", action="append", dest="prefixes", help="bucket folder, repeatable")
+    parser.add_argument("--json", action="store_true", help="print the final report as JSON")
+    args = parser.parse_args()
+
+    report = None
+    for event in reconcile(args.prefixes or RECONCILE_PREFIXES, args.grace_hours, dry_run=not args.delete):
+        if event.get("done"):
+            report = event
+        elif event["phase"] == "list":
+            print(f"Listed {event['objects']} objects under {event['prefix']}")
+        elif event["phase"] == "references":
+            print(f"{event['referenced']} keys referenced by the database")
+        else:
+            print(f"Deleted {event['deleted']}/{event['orphans']} ({event['failed']} failed)")
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        sys.exit(0)
+
+    print()
+    for prefix, counts in report["prefixes"].items():
+        print(f"{prefix:8} {counts['objects']:7} objects  {counts['referenced']:7} referenced  "
+              f"{counts['in_grace_period']:5} in grace period  {counts['orphans']:6} orphans "
+              f"({counts['orphan_bytes'] / 1024 / 1024:.1f} MB)")
+    for orphan in report["orphans"]:
+        print(f"  orphan: {orphan['path']} ({orphan['size']} bytes)")
+    if report["orphans_total"] > len(report["orphans"]):
+        print(f"  ... and {report['orphans_total'] - len(report['orphans'])} more")
+    if args.delete:
+        print(f"\nDeleted {report['deleted']} objects, {report['failed']} failed, in {report['seconds']}s")
+    else:
+        print(f"\nDry run: {report['orphans_total']} orphans would be deleted. Re-run with --delete.")
@@ -1,21 +1,47 @@
 from flask import Blueprint, request, jsonify
+import logging
 from werkzeug.utils import secure_filename
 import time
 from uuid import uuid4
 import os
 from datetime import datetime
 
-from utils.db import get_db_connection, return_db_connection, supabase
+from utils.db import get_db_connection, return_db_connection
+from utils.ad_inventory import ad_inventory
+from utils.media_objects import store, release, remove_objects, discard
+from utils.versions import conditional
+from utils.cache import invalidate
+from utils.serializers import RowMapper, Field
+from utils.auth import admin_required
+from utils.batch import parse_batch, update_where_ids, delete_where_ids, chunked_delete, progress_response, BatchBusy
+from models.ad_model import create_advertisement
 
 ad_bp = Blueprint("advertisements", __name__)
 
+logger = logging.getLogger("ads")
+
 ALLOWED_EXTENSIONS = {"mp4", "mov", "jpg", "jpeg", "png", "gif"}
-bucket_name = "bigteam-video"
+# Admins toggle ads and expect to see it at once, so always revalidate
+ADS_CACHE_CONTROL = "public, no-cache"
+
+AD_MAPPER = RowMapper(
+    "ads",
+    Field("id", "id"),
+    Field("title", "title"),
+    Field("media_type", "media_type"),
+    Field("media_url", "media_url"),
+    Field("ad_type", "ad_type"),
+    Field("is_active", "is_active"),
+    Field("start_date", "start_date"),
+    Field("end_date", "end_date"),
+    Field("created_at", "created_at")
+)
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 @ad_bp.route("/api/ads", methods=["POST"])
+@admin_required
 def create_ad():
     """Create new advertisement with file upload"""
 
@@ -46,37 +72,15 @@ def create_ad():
 
     # Upload to Supabase Storage
     try:
-        file.seek(0)
-        file_content = file.read()
-
-        response = supabase.storage.from_(bucket_name).upload(
-            path=filename,
-            file=file_content,
-            file_options={"content-type": file.content_type}
-        )
-
-        media_url = supabase.storage.from_(bucket_name).get_public_url(filename)
+        media_url = store(filename, file.stream, file.content_type)
 
     except Exception as e:
-        return jsonify({"error": f"Upload failed: {str(e)}"}), 500
+        logger.warning("Ad upload failed: %s", e)
+        return jsonify({"error": "Upload failed"}), 500
 
     # Save to database
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        cur.execute("""
-            INSERT INTO advertisements (title, media_type, media_url, ad_type, start_date, end_date)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            RETURNING id, created_at;
-        """, (title, media_type, media_url, ad_type, start_date, end_date))
-
-        result = cur.fetchone()
-        ad_id = str(result[0])
-        created_at = result[1].isoformat() if result[1] else datetime.now().isoformat()
-
-        conn.commit()
+        ad_id, created_at = create_advertisement(title, media_type, media_url, ad_type, start_date, end_date)
 
         return jsonify({
             "message": "Advertisement created successfully",
@@ -94,75 +98,34 @@ def create_ad():
         }), 201
 
     except Exception as e:
-        if conn:
-            conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
-    finally:
-        if conn:
-            if 'cur' in locals():
-                cur.close()
-            return_db_connection(conn)
+        logger.warning("Creating ad failed: %s", e)
+        discard([media_url])
+        return jsonify({"error": "Failed to create advertisement"}), 500
 
 @ad_bp.route("/api/ads", methods=["GET"])
+@conditional("ads", cache_control=ADS_CACHE_CONTROL)
 def get_ads():
     """Get all advertisements"""
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
         # Get filter parameters
         is_active = request.args.get('active')
         ad_type = request.args.get('type')
 
-        # Build query
-        query = """
-            SELECT id, title, media_type, media_url, ad_type,
-                   is_active, start_date, end_date, created_at
-            FROM advertisements
-            WHERE 1=1
-        """
-        params = []
-
-        if is_active is not None:
-            query += " AND is_active = %s"
-            params.append(is_active == 'true')
-
-        if ad_type:
-            query += " AND ad_type = %s"
-            params.append(ad_type)
-
-        query += " ORDER BY created_at DESC"
-
-        cur.execute(query, params)
-        ads = cur.fetchall()
-
-        # Format response
-        formatted_ads = []
-        for ad in ads:
-            formatted_ads.append({
-                "id": str(ad[0]),
-                "title": ad[1],
-                "media_type": ad[2],
-                "media_url": ad[3],
-                "ad_type": ad[4],
-                "is_active": ad[5],
-                "start_date": ad[6].isoformat() if ad[6] else None,
-                "end_date": ad[7].isoformat() if ad[7] else None,
-                "created_at": ad[8].isoformat() if ad[8] else None
-            })
+        ads = ad_inventory.list_ads(
+            is_active=(is_active == 'true') if is_active is not None else None,
+            ad_type=ad_type
+        )
+
+        formatted_ads = AD_MAPPER.many(ads)
 
         return jsonify(formatted_ads), 200
 
     except Exception as e:
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
-    finally:
-        if conn:
-            if 'cur' in locals():
-                cur.close()
-            return_db_connection(conn)
+        logger.warning("Listing ads failed: %s", e)
+        return jsonify({"error": "Failed to fetch advertisements"}), 500
 
 @ad_bp.route("/api/ads/<ad_id>", methods=["DELETE"])
+@admin_required
 def delete_ad(ad_id):
     """Delete advertisement"""
     conn = None
@@ -170,33 +133,26 @@ def delete_ad(ad_id):
         conn = get_db_connection()
         cur = conn.cursor()
 
-        # Get ad info first to delete file from storage
-        cur.execute("SELECT media_url FROM advertisements WHERE id = %s", (ad_id,))
+        cur.execute("DELETE FROM advertisements WHERE id = %s RETURNING media_url", (ad_id,))
         result = cur.fetchone()
 
         if not result:
             return jsonify({"error": "Advertisement not found"}), 404
 
-        # Delete from database
-        cur.execute("DELETE FROM advertisements WHERE id = %s", (ad_id,))
+        # The file is removed from storage only once nothing else uses it
+        freed = release(cur, [result[0]])
         conn.commit()
-
-        # Try to delete from storage (optional, ignore errors)
-        try:
-            media_url = result[0]
-            # Extract filename from URL
-            if media_url and 'ad/' in media_url:
-                filename = media_url.split('ad/')[-1].split('?')[0]
-                supabase.storage.from_(bucket_name).remove([f"ad/{filename}"])
-        except:
-            pass  # Ignore storage deletion errors
+        ad_inventory.invalidate()
+        invalidate("ads")
+        remove_objects(freed)
 
         return jsonify({"message": "Advertisement deleted successfully"}), 200
 
     except Exception as e:
+        logger.warning("Deleting ad %s failed: %s", ad_id, e)
         if conn:
             conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
+        return jsonify({"error": "Failed to delete advertisement"}), 500
     finally:
         if conn:
             if 'cur' in locals():
@@ -204,6 +160,7 @@ def delete_ad(ad_id):
             return_db_connection(conn)
 
 @ad_bp.route("/api/ads/<ad_id>/toggle", methods=["PATCH"])
+@admin_required
 def toggle_ad(ad_id):
     """Toggle advertisement active status"""
     conn = None
@@ -224,6 +181,8 @@ def toggle_ad(ad_id):
             return jsonify({"error": "Advertisement not found"}), 404
 
         conn.commit()
+        ad_inventory.invalidate()
+        invalidate("ads")
 
         return jsonify({
             "message": "Status updated successfully",
@@ -231,11 +190,68 @@ def toggle_ad(ad_id):
         }), 200
 
     except Exception as e:
+        logger.warning("Toggling ad %s failed: %s", ad_id, e)
         if conn:
             conn.rollback()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
+        return jsonify({"error": "Failed to update advertisement"}), 500
     finally:
         if conn:
             if 'cur' in locals():
                 cur.close()
-            return_db_connection(conn)
\ No newline at end of file
+            return_db_connection(conn)
+
+@ad_bp.route("/api/ads/batch", methods=["POST"])
+@admin_required
+def batch_ads():
+    """Activate, deactivate or delete many advertisements: {"action", "ids"}"""
+    try:
+        action, ids = parse_batch(request.get_json(silent=True), ("activate", "deactivate", "delete"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if action == "delete":
+        remaining, not_found = list(ids), []
+
+        def delete_chunk(cur, limit):
+            chunk = remaining[:limit]
+            del remaining[:limit]
+            if not chunk:
+                return None
+            rows, missing = delete_where_ids(cur, "advertisements", "media_url", chunk)
+            not_found.extend(missing)
+            return rows
+
+        try:
+            return progress_response(
+                chunked_delete(delete_chunk, "ads", on_commit=ad_inventory.invalidate,
+                               summary=lambda: {"not_found": not_found}),
+                lambda done: {"action": action, "requested": len(ids), "deleted": done["deleted"],
+                              "not_found": done["not_found"]}
+            )
+        except BatchBusy as e:
+            return jsonify({"error": str(e)}), 409
+        except Exception as e:
+            logger.warning("Batch delete of ads failed: %s", e)
+            return jsonify({"error": "Failed to delete advertisements"}), 500
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        updated, missing = update_where_ids(
+            cur, "advertisements", "is_active = %s", (action == "activate",), ids
+        )
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        logger.warning("Batch %s of ads failed: %s", action, e)
+        if conn:
+            conn.rollback()
+        return jsonify({"error": f"Failed to {action} advertisements"}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+    ad_inventory.invalidate()
+    invalidate("ads")
+    return jsonify({"action": action, "updated": len(updated), "not_found": missing}), 200
@@ -1,23 +1,63 @@
-from flask import Blueprint, request, jsonify
-from flask_bcrypt import Bcrypt
-from models.user_model import create_user, get_user_by_email, get_all_users
+from flask import Blueprint, request, jsonify, Response
+import logging
+import os
+from models.user_model import (
+    create_user, get_user_by_email, get_all_users, update_password_hash, set_user_active,
+    user_filters, get_users_page, ALL_USERS_QUERY
+)
+from utils.db import get_db_connection, return_db_connection
+from utils.helpers import (
+    encode_cursor, decode_cursor, parse_limit, count_rows, exact_count_requested, cursor_id, cursor_timestamp
+)
+from utils.serializers import RowMapper, Field, stream_json_array, dumps
+from utils.passwords import password_hasher, HashPoolFull
+from utils.auth import admin_required, issue_tokens, load_claims, invalidate_user, verify_token
+from utils.availability import availability
+from utils.user_import import run_import, ImportRejected, ImportBusy, ROLES
+
+logger = logging.getLogger("auth")
 
 auth_bp = Blueprint('auth', __name__)
-bcrypt = Bcrypt()
 
-# --------------------------
-# Register Endpoint
-# --------------------------
-@auth_bp.route('/register', methods=['POST'])
-def register():
-    data = request.get_json()
+# Seconds clients are told to wait when password hashing is saturated
+HASH_RETRY_AFTER = 2
+# Most values /check-availability accepts per field
+MAX_AVAILABILITY_BATCH = 100
+
+def busy_response():
+    response = jsonify({'error': 'Server is busy, please try again shortly'})
+    response.headers['Retry-After'] = str(HASH_RETRY_AFTER)
+    return response, 503
+
+USER_PAGE_PARAMS = {'cursor', 'limit', 'q', 'role', 'is_active', 'count'}
+MAX_USERS_LIMIT = 100
+# Totals are planner estimates; with count=exact, filtered totals up to this
+# many rows are counted exactly
+USERS_EXACT_COUNT_LIMIT = int(os.getenv("USERS_EXACT_COUNT_LIMIT", 20000))
 
+# Columns of ALL_USERS_QUERY (and USER_PAGE_COLUMNS)
+USER_MAPPER = RowMapper(
+    "users",
+    Field("id", 0),
+    Field("full_name", 1),
+    Field("username", 2),
+    Field("email", 3),
+    Field("role", 4),
+    Field("created_at", 5),
+    Field("is_active", 6)
+)
+
+def register_user(data, role):
+    """Validate a signup body and create the account with `role`"""
     # Validate required fields
     if not all(k in data for k in ('full_name', 'email', 'username', 'password')):
         return jsonify({'error': 'Missing required fields'}), 400
 
-    # Hash the password
-    hashed_pw = bcrypt.generate_password_hash(data['password']).decode('utf-8')
+    # Hash the password on the hashing pool
+    try:
+        hashed_pw = password_hasher.hash(data['password'])
+    except HashPoolFull:
+        return busy_response()
 
     # Create the user
     user_id, error = create_user(
@@ -25,7 +65,7 @@ def register():
         email=data['email'],
         username=data['username'],
         password_hash=hashed_pw,
-        role=data.get('role', 'customer')
+        role=role
     )
 
     # Handle duplicate email/username
@@ -34,6 +74,27 @@ def register():
 
     return jsonify({'message': 'User registered successfully', 'user_id': user_id}), 201
 
+# --------------------------
+# Register Endpoint
+# --------------------------
+@auth_bp.route('/register', methods=['POST'])
+def register():
+    # Public signups are always customers; any "role" in the body is ignored
+    return register_user(request.get_json(silent=True) or {}, 'customer')
+
+# --------------------------
+# Create User Endpoint (Admin)
+# --------------------------
+@auth_bp.route('/admin/users', methods=['POST'])
+@admin_required
+def create_user_as_admin():
+    """Create an account with any role in ROLES (default customer)"""
+    data = request.get_json(silent=True) or {}
+    role = data.get('role', 'customer')
+    if role not in ROLES:
+        return jsonify({'error': f"role must be one of {', '.join(ROLES)}"}), 400
+    return register_user(data, role)
+
 # --------------------------
 # Login Endpoint
 # --------------------------
@@ -48,8 +109,22 @@ def login():
     # Fetch user by email
     user = get_user_by_email(data['email'])
 
-    # Check password
-    if user and bcrypt.check_password_hash(user['password_hash'], data['password']):
+    # Check password on the hashing pool
+    try:
+        valid = user is not None and password_hasher.check(user['password_hash'], data['password'])
+    except HashPoolFull:
+        return busy_response()
+
+    if valid and user.get('is_active') is False:
+        return jsonify({"error": "Account is deactivated"}), 403
+
+    if valid:
+        # Upgrade hashes made with a different cost factor
+        if password_hasher.needs_rehash(user['password_hash']):
+            user_id, old_hash = user['id'], user['password_hash']
+            password_hasher.rehash_later(
+                data['password'], lambda new_hash: update_password_hash(user_id, old_hash, new_hash)
+            )
         return jsonify({
             "message": "Login successful",
             "user": {
@@ -57,11 +132,33 @@ def login():
                 "full_name": user["full_name"],
                 "email": user["email"],
                 "role": user["role"]
-            }
+            },
+            **issue_tokens(user)
         }), 200
 
     return jsonify({"error": "Invalid email or password"}), 401
 
+# --------------------------
+# Refresh Token Endpoint
+# --------------------------
+@auth_bp.route('/refresh', methods=['POST'])
+def refresh():
+    data = request.get_json(silent=True) or {}
+    claims = verify_token(data.get('refresh_token') or '', 'refresh')
+    if claims is None:
+        return jsonify({'error': 'Invalid or expired refresh token'}), 401
+
+    # Refreshing is rare enough to always check the account itself
+    try:
+        account = load_claims(claims['sub'])
+    except Exception as e:
+        logger.warning("Database error in refresh: %s", e)
+        return jsonify({'error': 'Could not verify credentials'}), 503
+    if account is None or not account[1]:
+        return jsonify({'error': 'Account is not active'}), 401
+
+    return jsonify(issue_tokens({'id': claims['sub'], 'role': account[0]})), 200
+
 # --------------------------
 # Check if Email Exists Endpoint
 # --------------------------
@@ -73,8 +170,10 @@ def check_email():
     if not email:
         return jsonify({'error': 'Email is required'}), 400
 
-    user = get_user_by_email(email)
-    exists = user is not None
+    try:
+        exists = availability.exists('email', email)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
     return jsonify({'exists': exists}), 200
 
@@ -89,35 +188,173 @@ def check_username():
     if not username:
         return jsonify({'error': 'Username is required'}), 400
 
-    from models.user_model import get_user_by_username
-    user = get_user_by_username(username)
-    exists = user is not None
+    try:
+        exists = availability.exists('username', username)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
     return jsonify({'exists': exists}), 200
 
+# --------------------------
+# Batch Availability Endpoint
+# --------------------------
+@auth_bp.route('/check-availability', methods=['POST'])
+def check_availability():
+    """Check many candidates at once: {"emails": [...], "usernames": [...]}
+    -> {"emails": {value: exists}, "usernames": {value: exists}}"""
+    data = request.get_json(silent=True) or {}
+    batches = {}
+    for key, field in (('emails', 'email'), ('usernames', 'username')):
+        values = data.get(key) or []
+        if not isinstance(values, list) or not all(isinstance(v, str) and v for v in values):
+            return jsonify({'error': f'{key} must be a list of non-empty strings'}), 400
+        if len(values) > MAX_AVAILABILITY_BATCH:
+            return jsonify({'error': f'At most {MAX_AVAILABILITY_BATCH} {key} per request'}), 400
+        batches[key] = (field, values)
+
+    try:
+        result = {key: availability.check(field, values) for key, (field, values) in batches.items()}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify(result), 200
+
 # --------------------------
 # Get All Users Endpoint (Admin)
 # --------------------------
 @auth_bp.route('/admin/users', methods=['GET'])
+@admin_required
 def get_users():
+    """All customer users (admin accounts are excluded).
+
+    Passing any of q, role, is_active, limit or cursor returns one keyset
+    page instead: {"users", "next_cursor", "has_more", and on the first
+    page "total"}. `q` is a prefix of the name, username or email; role is
+    customer (the default), admin or all. The total is the planner's
+    estimate unless count=exact is passed.
+    """
+    if USER_PAGE_PARAMS.intersection(request.args):
+        return get_users_page_response(request.args)
+
     try:
-        # Returns only customer users (excludes admin accounts)
-        # In production, you would also verify the requesting user is an admin
+        if request.args.get('stream') == 'true':
+            # Large user tables: stream straight from a server-side cursor
+            return stream_json_array(ALL_USERS_QUERY, (), USER_MAPPER)
+
         users = get_all_users()
+        return jsonify(USER_MAPPER.many(users)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        # Format the response
-        formatted_users = []
-        for user in users:
-            formatted_users.append({
-                "id": user["id"],
-                "full_name": user["full_name"],
-                "username": user["username"],
-                "email": user["email"],
-                "role": user["role"],
-                "created_at": user["created_at"].isoformat() if user.get("created_at") else None,
-                "is_active": user.get("is_active", True)
-            })
+def get_users_page_response(args):
+    try:
+        limit = parse_limit(args.get('limit'), default=20, maximum=MAX_USERS_LIMIT)
+        role = args.get('role', 'customer')
+        if role not in ('customer', 'admin', 'all'):
+            raise ValueError('role must be customer, admin or all')
+        is_active = args.get('is_active')
+        if is_active not in (None, 'true', 'false'):
+            raise ValueError('is_active must be true or false')
+        q = (args.get('q') or '').strip()
+        clauses, params = user_filters(q, role, None if is_active is None else is_active == 'true')
+        exact = exact_count_requested(args)
+        cursor = decode_cursor(args['cursor']) if args.get('cursor') else None
+        after = None
+        if cursor is not None:
+            if 'c' not in cursor or 'i' not in cursor:
+                raise ValueError('Invalid cursor')
+            # "c" is null after a user without created_at
+            after = (cursor_timestamp(cursor['c']), cursor_id(cursor['i']))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query parameters: {str(e)}'}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        rows = get_users_page(cur, clauses, params, after, limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
 
-        return jsonify(formatted_users), 200
+        response = {'limit': limit, 'has_more': has_more, 'next_cursor': None}
+        if has_more:
+            response['next_cursor'] = encode_cursor({'c': rows[-1][5], 'i': rows[-1][0]})
+        if cursor is None:
+            # Totals are only worked out for the first page
+            where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+            response['total'], response['total_is_estimate'] = count_rows(
+                cur, f'FROM users {where}', params, exact_limit=USERS_EXACT_COUNT_LIMIT if exact else None
+            )
+        cur.close()
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        logger.warning("Database error in get_users: %s", e)
+        return jsonify({'error': 'Failed to fetch users'}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+    response['users'] = USER_MAPPER.many(rows)
+    return jsonify(response), 200
+
+# --------------------------
+# Activate / Deactivate User Endpoint (Admin)
+# --------------------------
+@auth_bp.route('/admin/users/<user_id>/status', methods=['PATCH'])
+@admin_required
+def set_user_status(user_id):
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get('is_active'), bool):
+        return jsonify({'error': 'is_active must be true or false'}), 400
+
+    try:
+        updated = set_user_active(user_id, data['is_active'])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if not updated:
+        return jsonify({'error': 'User not found'}), 404
+
+    # Outstanding access tokens stop working on the next request
+    invalidate_user(user_id)
+    return jsonify({'message': 'Status updated successfully', 'is_active': data['is_active']}), 200
+
+# --------------------------
+# Bulk Import Users Endpoint (Admin)
+# --------------------------
+IMPORT_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+@auth_bp.route('/admin/users/import', methods=['POST'])
+@admin_required
+def import_users():
+    """Import users from a CSV or NDJSON body (or a multipart `file`).
+
+    Columns/keys: full_name, email, username, password (or a bcrypt
+    password_hash) and optionally role. The response is NDJSON streamed as
+    the import runs: one {"line", "email", "status", "id" | "error"} object
+    per row, then {"summary": {...}} with counts and throughput.
+    """
+    upload = request.files.get('file')
+    if upload is not None:
+        upload.stream.seek(0)
+        lines = upload.stream
+        extension = (upload.filename or '').rsplit('.', 1)[-1].lower()
+        fmt = request.args.get('format') or {'csv': 'csv', 'ndjson': 'ndjson', 'jsonl': 'ndjson'}.get(extension)
+    else:
+        lines = request.stream
+        fmt = request.args.get('format') or IMPORT_FORMATS.get(request.mimetype)
+
+    try:
+        reports, release = run_import(lines, fmt)
+    except ImportBusy as e:
+        return jsonify({'error': str(e)}), 409
+    except ImportRejected as e:
+        return jsonify({'error': str(e)}), 400
+
+    response = Response((dumps(report) + b"\n" for report in reports), mimetype='application/x-ndjson')
+    # Stop the import (and free its connection) if the client goes away
+    response.call_on_close(reports.close)
+    response.call_on_close(release)
+    return response
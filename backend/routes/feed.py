@@ -1,160 +1,279 @@
-from flask import Blueprint, request, jsonify
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Blueprint, request, jsonify, g
 from utils.db import get_db_connection, return_db_connection
-from datetime import datetime
+from utils.helpers import encode_cursor, decode_cursor, parse_limit, cursor_id, cursor_timestamp, seek_clause
+from utils.ad_inventory import ad_inventory
+from utils.counters import post_counters
+from utils.derivatives import attach_srcsets
+from utils.serializers import RowMapper, Field, Const, now
+from utils.versions import conditional
+from utils.logs import sampled
 
 feed_bp = Blueprint("feed", __name__)
 
+logger = logging.getLogger("feed")
+
+# Insert one ad after every AD_INTERVAL posts
+AD_INTERVAL = 5
+MAX_FEED_LIMIT = 50
+# Pages are stable for a given cursor; let the browser reuse one briefly
+# and revalidate after that
+FEED_CACHE_CONTROL = "private, max-age=5"
+# Share of feed requests that log their page composition at DEBUG level
+FEED_DEBUG_SAMPLE = float(os.getenv("FEED_DEBUG_SAMPLE", 0.01))
+# Feed pages (by ETag) whose post ids this worker remembers, so a 304 still
+# counts a view of each post on the page
+FEED_PAGE_MEMORY = int(os.getenv("FEED_PAGE_MEMORY", 10000))
+
+FEED_POST_COLUMNS = """
+    id, title, content, media_type, media_url,
+    thumbnail_url, created_by, created_at,
+    likes_count, shares_count, views_count,
+    'post' as content_type
+"""
+FEED_POST_FILTER = "(is_published = true OR is_published IS NULL)"
+
+FEED_POST_MAPPER = RowMapper(
+    "feed_post",
+    Field("id", 0),
+    Field("title", 1, default=""),
+    Field("content", 2, default=""),
+    Field("media_type", 3),
+    Field("media_url", 4),
+    Field("thumbnail_url", 5),
+    Field("created_by", 6, default="BigTeam"),
+    Field("created_at", 7, fallback=now),
+    Field("likes_count", 8, default=0),
+    Field("shares_count", 9, default=0),
+    Field("views_count", 10, default=0),
+    Field("content_type", 11)
+)
+
+FEED_AD_MAPPER = RowMapper(
+    "feed_ad",
+    Field("id", "id"),
+    Field("title", "title", default="Advertisement"),
+    Const("content", ""),
+    Field("media_type", "media_type"),
+    Field("media_url", "media_url"),
+    Field("thumbnail_url", "media_url"),
+    Const("created_by", "Sponsored"),
+    Field("created_at", "created_at", fallback=now),
+    Const("likes_count", 0),
+    Const("shares_count", 0),
+    Const("views_count", 0),
+    Const("content_type", "ad"),
+    Field("ad_type", "ad_type", default="banner")
+)
+
+def mix_feed_page(posts, ads, posts_seen, ads_seen, limit):
+    """Lay out one page of the mixed feed starting after posts_seen posts and ads_seen ads.
+
+    An ad is owed after every AD_INTERVAL posts for as long as ads last; ads
+    left over once the posts run out are appended at the end. Because the slot
+    only depends on how many posts and ads precede it, any page can be built
+    from its starting position without materialising the earlier pages.
+    `posts` must hold up to limit + 1 rows so running out means the table is
+    exhausted rather than the page being short.
+    """
+    items = []
+    last_post = None
+    post_index = 0
+
+    while len(items) < limit:
+        ads_owed = min(len(ads), posts_seen // AD_INTERVAL)
+        if ads_seen < ads_owed:
+            items.append(FEED_AD_MAPPER(ads[ads_seen]))
+            ads_seen += 1
+        elif post_index < len(posts):
+            last_post = posts[post_index]
+            items.append(FEED_POST_MAPPER(last_post))
+            post_index += 1
+            posts_seen += 1
+        elif ads_seen < len(ads):
+            items.append(FEED_AD_MAPPER(ads[ads_seen]))
+            ads_seen += 1
+        else:
+            break
+
+    has_more = post_index < len(posts) or ads_seen < len(ads)
+    return items, last_post, posts_seen, ads_seen, has_more
+
+def feed_position_counts(position, total_posts, total_ads):
+    """Return (posts, ads) that precede a global feed position in the mixed layout"""
+    interleaved_ads = min(total_ads, total_posts // AD_INTERVAL)
+    ads_before = max(min(interleaved_ads, position // (AD_INTERVAL + 1)), position - total_posts)
+    ads_before = max(0, min(ads_before, total_ads))
+    return position - ads_before, ads_before
+
+def live_ad_ids():
+    """Ads served right now; they change with start/end dates as well as writes"""
+    return [ad["id"] for ad in ad_inventory.active_ads()]
+
+_page_posts = OrderedDict()  # ETag -> ids of the posts on that page
+_page_posts_lock = threading.Lock()
+
+def remember_page(etag, post_ids):
+    if not etag:
+        return
+    with _page_posts_lock:
+        _page_posts[etag] = post_ids
+        _page_posts.move_to_end(etag)
+        while len(_page_posts) > FEED_PAGE_MEMORY:
+            _page_posts.popitem(last=False)
+
+def count_revalidated_views(etag):
+    """Count a view of each post on a page answered with 304.
+
+    Returns False for a page this worker did not serve, so it is rendered
+    (and its views counted) in full instead.
+    """
+    with _page_posts_lock:
+        post_ids = _page_posts.get(etag)
+        if post_ids is None:
+            return False
+        _page_posts.move_to_end(etag)
+    for post_id in post_ids:
+        post_counters.increment(post_id, 'views_count')
+    return True
+
 @feed_bp.route("/api/feed", methods=["GET"])
+@conditional("posts", "ads", "counters", cache_control=FEED_CACHE_CONTROL, extra=live_ad_ids,
+             not_modified=count_revalidated_views)
 def get_feed():
-    """Get mixed feed of posts and advertisements"""
+    """Get mixed feed of posts and advertisements.
+
+    Pass `cursor` (empty for the first page) for keyset pagination; the
+    legacy `page` parameter is still honoured for older clients. Pages are
+    revalidated by ETag, which changes whenever counters are flushed; a 304
+    still counts a view of each post on the page.
+    """
     conn = None
     try:
+        try:
+            limit = parse_limit(request.args.get('limit'), default=10, maximum=MAX_FEED_LIMIT)
+            cursor_param = request.args.get('cursor')
+            if cursor_param is not None:
+                cursor = decode_cursor(cursor_param) if cursor_param else {}
+                position, ads_seen = cursor.get('p', 0), cursor.get('a', 0)
+                if type(position) is not int or type(ads_seen) is not int:
+                    raise ValueError("Invalid cursor")
+                if position < 0 or ads_seen < 0 or ads_seen > position:
+                    raise ValueError("Invalid cursor")
+                # No "i" until a post has been served; "t" is null for a
+                # post without created_at
+                after_id = cursor_id(cursor['i']) if cursor.get('i') is not None else None
+                after_created_at = cursor_timestamp(cursor.get('t'))
+                if after_id is None and after_created_at is not None:
+                    raise ValueError("Invalid cursor")
+            else:
+                page = max(1, int(request.args.get('page', 1)))
+        except ValueError as e:
+            return jsonify({"error": f"Invalid pagination parameters: {str(e)}"}), 400
+
+        # Ads come from the in-memory inventory, already filtered on is_active
+        # and on their start/end schedule window
+        ads = ad_inventory.active_ads()
+
         conn = get_db_connection()
         cur = conn.cursor()
 
-        # Get page and limit from query params
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 10))
-        offset = (page - 1) * limit
-
-        # Get all posts (published or all if no published flag)
-        cur.execute("""
-            SELECT
-                id, title, content, media_type, media_url,
-                thumbnail_url, created_by, created_at,
-                likes_count, shares_count, views_count,
-                'post' as content_type
-            FROM posts
-            WHERE is_published = true OR is_published IS NULL
-            ORDER BY created_at DESC
-        """)
+        total = None
+        if cursor_param is not None:
+            posts_seen = position - ads_seen
+            if after_id is not None:
+                # Seek past the last post served, NULL created_at included
+                # (those sort first); the plain created_at bound lets Postgres
+                # walk idx_posts_created_at instead of sorting the table
+                seek, seek_params = seek_clause("created_at", "DESC", True, after_created_at, after_id)
+                if after_created_at is not None:
+                    seek, seek_params = f"created_at <= %s AND {seek}", [after_created_at, *seek_params]
+                cur.execute(f"""
+                    SELECT {FEED_POST_COLUMNS}
+                    FROM posts
+                    WHERE {FEED_POST_FILTER}
+                      AND {seek}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, (*seek_params, limit + 1))
+            else:
+                cur.execute(f"""
+                    SELECT {FEED_POST_COLUMNS}
+                    FROM posts
+                    WHERE {FEED_POST_FILTER}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, (limit + 1,))
+        else:
+            # Legacy page numbers: work out which posts and ads precede the
+            # page from the counts, then read just that window of posts
+            cur.execute(f"SELECT COUNT(*) FROM posts WHERE {FEED_POST_FILTER}")
+            total_posts = cur.fetchone()[0]
+            total = total_posts + len(ads)
+            position = (page - 1) * limit
+            posts_seen, ads_seen = feed_position_counts(position, total_posts, len(ads))
+            cur.execute(f"""
+                SELECT {FEED_POST_COLUMNS}
+                FROM posts
+                WHERE {FEED_POST_FILTER}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s OFFSET %s
+            """, (limit + 1, posts_seen))
         posts = cur.fetchall()
 
-        # First, check all ads without date filtering for debugging
-        try:
-            cur.execute("""
-                SELECT id, title, is_active, start_date, end_date
-                FROM advertisements
-            """)
-            all_ads_debug = cur.fetchall()
-            print(f"DEBUG: Total ads in database: {len(all_ads_debug)}")
-            for ad in all_ads_debug:
-                print(f"  Ad: {ad[1]}, Active: {ad[2]}, Start: {ad[3]}, End: {ad[4]}")
-        except Exception as e:
-            print(f"DEBUG ERROR checking all ads: {e}")
-
-        # Get all active advertisements (simplified query - only check is_active)
-        try:
-            cur.execute("""
-                SELECT
-                    id, title, '' as content, media_type, media_url,
-                    media_url as thumbnail_url, NULL as created_by, created_at,
-                    0 as likes_count, 0 as shares_count, 0 as views_count,
-                    'ad' as content_type, ad_type
-                FROM advertisements
-                WHERE is_active = true OR is_active IS NULL
-                ORDER BY created_at DESC
-            """)
-            ads = cur.fetchall()
-        except Exception as e:
-            print(f"DEBUG ERROR fetching ads: {e}")
-            ads = []
-
-        # Debug: Print ad query results
-        print(f"DEBUG: Found {len(ads)} active advertisements (ignoring dates)")
-        for ad in ads[:3]:  # Print first 3 ads for debugging
-            print(f"  Ad: {ad[1]} - Type: {ad[3]} - Active check passed")
-
-        # Format posts
-        formatted_content = []
-
-        for post in posts:
-            formatted_content.append({
-                "id": str(post[0]),
-                "title": post[1] or "",
-                "content": post[2] or "",
-                "media_type": post[3],
-                "media_url": post[4],
-                "thumbnail_url": post[5] or post[4],
-                "created_by": str(post[6]) if post[6] else "BigTeam",
-                "created_at": post[7].isoformat() if post[7] else datetime.now().isoformat(),
-                "likes_count": post[8] if post[8] is not None else 0,
-                "shares_count": post[9] if post[9] is not None else 0,
-                "views_count": post[10] if post[10] is not None else 0,
-                "content_type": post[11]
-            })
-
-        # Format ads
-        formatted_ads = []
-        print(f"DEBUG: Processing {len(ads)} ads for formatting")
-        for ad in ads:
-            formatted_ads.append({
-                "id": str(ad[0]),
-                "title": ad[1] or "Advertisement",
-                "content": ad[2] or "",
-                "media_type": ad[3],
-                "media_url": ad[4],
-                "thumbnail_url": ad[5],
-                "created_by": "Sponsored",
-                "created_at": ad[7].isoformat() if ad[7] else datetime.now().isoformat(),
-                "likes_count": 0,
-                "shares_count": 0,
-                "views_count": 0,
-                "content_type": "ad",
-                "ad_type": ad[12] if len(ad) > 12 else "banner"
-            })
-
-        # Mix ads into posts (1 ad every 5 posts)
-        mixed_feed = []
-        ad_index = 0
-        print(f"DEBUG: Mixing {len(formatted_ads)} ads into {len(formatted_content)} posts")
-
-        for i, post in enumerate(formatted_content):
-            mixed_feed.append(post)
-
-            # Insert ad every 5 posts if ads available
-            if (i + 1) % 5 == 0 and ad_index < len(formatted_ads):
-                print(f"DEBUG: Inserting ad at position {len(mixed_feed)} after post {i+1}")
-                mixed_feed.append(formatted_ads[ad_index])
-                ad_index += 1
-
-        # Add remaining ads at the end if any
-        while ad_index < len(formatted_ads):
-            mixed_feed.append(formatted_ads[ad_index])
-            ad_index += 1
-
-        # Paginate the mixed feed
-        start = offset
-        end = offset + limit
-        paginated_feed = mixed_feed[start:end]
-
-        # Debug: Check content types in paginated feed
-        content_types = [item['content_type'] for item in paginated_feed]
-        print(f"DEBUG: Page {page} content types: {content_types}")
-        print(f"DEBUG: Returning {len(paginated_feed)} items (offset: {start}, limit: {limit})")
-
-        # Update view counts for returned content
+        paginated_feed, last_post, posts_seen, ads_seen, has_more = mix_feed_page(
+            posts, ads, posts_seen, ads_seen, limit
+        )
+
+        next_cursor = None
+        if has_more:
+            if last_post is not None:
+                after_created_at, after_id = last_post[7], last_post[0]
+            if cursor_param is not None or last_post is not None:
+                next_cursor = encode_cursor({
+                    "p": position + len(paginated_feed),
+                    "a": ads_seen,
+                    "t": after_created_at,
+                    "i": after_id
+                })
+
+        if sampled(logger, logging.DEBUG, FEED_DEBUG_SAMPLE):
+            logger.debug(
+                "Feed position %s: %s items (limit %s), content types %s",
+                position, len(paginated_feed), limit, [item['content_type'] for item in paginated_feed]
+            )
+
+        attach_srcsets(cur, [item for item in paginated_feed if item['content_type'] == 'post'])
+
+        cur.close()
+        return_db_connection(conn)
+        conn = None
+
+        # Views are aggregated in memory and written back in bulk; show the
+        # stored counts plus whatever has not been flushed yet
+        post_ids = []
         for content in paginated_feed:
             if content['content_type'] == 'post':
-                try:
-                    cur.execute("""
-                        UPDATE posts
-                        SET views_count = views_count + 1
-                        WHERE id = %s
-                    """, (content['id'],))
-                    content['views_count'] += 1
-                except:
-                    pass  # Ignore view count update errors
-
-        conn.commit()
-
-        return jsonify({
+                post_ids.append(content['id'])
+                post_counters.increment(content['id'], 'views_count')
+                for field, delta in post_counters.pending(content['id']).items():
+                    content[field] += delta
+        remember_page(g.get('etag'), tuple(post_ids))
+
+        response = {
             "feed": paginated_feed,
-            "page": page,
             "limit": limit,
-            "total": len(mixed_feed),
-            "has_more": end < len(mixed_feed)
-        }), 200
+            "has_more": has_more,
+            "next_cursor": next_cursor
+        }
+        if cursor_param is None:
+            response["page"] = page
+            response["total"] = total
+        return jsonify(response), 200
 
     except Exception as e:
         return jsonify({"error": f"Failed to fetch feed: {str(e)}"}), 500
@@ -174,32 +293,21 @@ def interact_with_content(content_id):
         if interaction_type not in ['like', 'share']:
             return jsonify({"error": "Invalid interaction type"}), 400
 
+        field = 'likes_count' if interaction_type == 'like' else 'shares_count'
+
         conn = get_db_connection()
         cur = conn.cursor()
 
-        # Update the appropriate counter
-        if interaction_type == 'like':
-            cur.execute("""
-                UPDATE posts
-                SET likes_count = likes_count + 1
-                WHERE id = %s
-                RETURNING likes_count
-            """, (content_id,))
-        else:  # share
-            cur.execute("""
-                UPDATE posts
-                SET shares_count = shares_count + 1
-                WHERE id = %s
-                RETURNING shares_count
-            """, (content_id,))
-
+        # Plain read instead of a row-locking UPDATE; the increment itself is
+        # batched by the counter aggregator
+        cur.execute(f"SELECT {field} FROM posts WHERE id = %s", (content_id,))
         result = cur.fetchone()
-        conn.commit()
 
         if result:
+            pending = post_counters.increment(content_id, field)
             return jsonify({
                 "success": True,
-                "new_count": result[0]
+                "new_count": (result[0] or 0) + pending
             }), 200
         else:
             return jsonify({"error": "Content not found"}), 404
@@ -0,0 +1,91 @@
+import hmac
+import os
+
+from flask import Blueprint, Response, jsonify, request
+
+from utils.db import pool_stats
+from utils.passwords import password_hasher
+from utils.availability import availability
+from utils.storage import storage
+from utils.media_cache import media_cache
+from utils.metrics import render as render_metrics
+from utils.query_trace import query_stats
+from utils.auth import admin_required
+
+health_bp = Blueprint("health", __name__)
+
+# If set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+QUERY_SORTS = ("total_ms", "mean_ms", "max_ms", "calls", "rows", "errors", "slow")
+MAX_QUERIES_LIMIT = 500
+
+@health_bp.route("/api/health/db", methods=["GET"])
+def db_health():
+    """Connection pool statistics: in-use/idle counts, wait histogram, checkout rate and leaks"""
+    stats = pool_stats()
+    if stats is None:
+        return jsonify({"error": "Connection pool not initialized"}), 503
+    return jsonify(stats), 200
+
+@health_bp.route("/api/health/passwords", methods=["GET"])
+def password_health():
+    """Password hashing pool: pending jobs, rejections, hash latency and queue wait histograms"""
+    return jsonify(password_hasher.stats()), 200
+
+@health_bp.route("/api/health/availability", methods=["GET"])
+def availability_health():
+    """Email/username availability filters: readiness, checks and how many needed the database"""
+    return jsonify(availability.stats()), 200
+
+@health_bp.route("/api/health/storage", methods=["GET"])
+def storage_health():
+    """Storage backend and whether its bucket exists; the first call also creates the client"""
+    try:
+        status = storage.check()
+    except Exception as e:
+        return jsonify({"backend": storage.name, "error": str(e)}), 503
+    return jsonify(status), 200 if status["bucket_exists"] else 503
+
+@health_bp.route("/api/health/media-cache", methods=["GET"])
+def media_cache_health():
+    """On-disk media cache: hits, misses, evictions, bytes used and fetch time histogram"""
+    return jsonify(media_cache.stats()), 200
+
+@health_bp.route("/metrics", methods=["GET"])
+def metrics():
+    """Request, database and storage metrics in the Prometheus text format"""
+    if METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+    ):
+        return jsonify({"error": "Authentication required"}), 401
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@health_bp.route("/api/admin/queries", methods=["GET"])
+@admin_required
+def query_aggregates():
+    """Per-fingerprint statement aggregates for this worker, with captured plans.
+
+    ?sort= one of QUERY_SORTS (default total_ms), ?limit= (default 50).
+    """
+    sort = request.args.get("sort", "total_ms")
+    if sort not in QUERY_SORTS:
+        return jsonify({"error": f"sort must be one of {', '.join(QUERY_SORTS)}"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), MAX_QUERIES_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    return jsonify({**query_stats.summary(), "queries": query_stats.top(sort, limit)}), 200
+
+@health_bp.route("/api/admin/queries/slow", methods=["GET"])
+@admin_required
+def slow_queries():
+    """Most recent slow statements in this worker, newest first"""
+    return jsonify({**query_stats.summary(), "slow": query_stats.slow_log()}), 200
+
+@health_bp.route("/api/admin/queries", methods=["DELETE"])
+@admin_required
+def reset_query_aggregates():
+    """Start the aggregates and slow log over, e.g. before measuring a change"""
+    query_stats.reset()
+    return jsonify({"message": "Query statistics reset"}), 200
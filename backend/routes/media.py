@@ -0,0 +1,347 @@
+from flask import Blueprint, request, jsonify, redirect, abort, g
+from uuid import uuid4
+import logging
+import re
+
+from utils.storage import (
+    storage, LocalStorage, sign, verify, media_path, SIGNED_UPLOAD_TTL
+)
+from utils.uploads import UPLOAD_MAX_FILE_BYTES, CappedStream
+from utils.db import get_db_connection, return_db_connection
+from utils.media_objects import lookup, acquire, discard, register, hash_object, reference
+from routes.post import allowed_file
+from models.post_model import create_post
+from models.ad_model import create_advertisement
+from utils.derivatives import schedule as schedule_derivatives
+from utils.media_cache import local_path, send_object, ObjectTooLarge
+from utils.auth import admin_required
+
+media_bp = Blueprint("media", __name__)
+
+logger = logging.getLogger("media")
+
+# Finalize may arrive well after the upload target expired (large files)
+TICKET_GRACE = 3600
+
+VIDEO_EXTENSIONS = {"mp4", "mov"}
+
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+def claim_ticket(ticket):
+    """Record a ticket as used; False if it already was (a replayed finalize)"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("DELETE FROM used_upload_tickets WHERE expires_at < NOW()")
+        cur.execute("""
+            INSERT INTO used_upload_tickets (jti, expires_at)
+            VALUES (%s, to_timestamp(%s))
+            ON CONFLICT (jti) DO NOTHING
+            RETURNING jti
+        """, (ticket["jti"], ticket["exp"]))
+        claimed = cur.fetchone() is not None
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        return_db_connection(conn)
+    return claimed
+
+def release_ticket(ticket):
+    """Let a ticket be finalized again after a failure the client may retry"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("DELETE FROM used_upload_tickets WHERE jti = %s", (ticket["jti"],))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning("Failed to release upload ticket %s: %s", ticket["jti"], e)
+    finally:
+        cur.close()
+        return_db_connection(conn)
+
+@media_bp.route("/api/media/upload-url", methods=["POST"])
+@admin_required
+def create_upload_url():
+    """Issue a short-lived signed target so the browser uploads straight to storage.
+
+    The response carries a `ticket` binding the object key, size and type;
+    it must be passed to /api/media/finalize once the upload has finished,
+    by the same admin, and can be finalized only once. Clients that send the
+    file's `sha256` get `duplicate: true` and no upload target when the same
+    file is already stored, and finalize straight away; otherwise the hash
+    is checked against the uploaded bytes at finalize.
+    """
+    data = request.get_json(silent=True) or {}
+    kind = data.get("kind", "post")  # 'post' or 'ad'
+    filename = data.get("filename")
+    content_type = data.get("content_type")
+
+    if kind not in ["post", "ad"]:
+        return jsonify({"error": "kind must be 'post' or 'ad'"}), 400
+    if not filename or not content_type:
+        return jsonify({"error": "filename and content_type are required"}), 400
+    if not allowed_file(filename):
+        return jsonify({"error": "File type not allowed"}), 400
+    try:
+        size = int(data.get("size"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "size must be an integer"}), 400
+    if size <= 0:
+        return jsonify({"error": "size must be positive"}), 400
+    if size > UPLOAD_MAX_FILE_BYTES:
+        return jsonify({"error": f"File exceeds the {UPLOAD_MAX_FILE_BYTES} byte upload limit"}), 413
+
+    ext = filename.rsplit(".", 1)[1].lower()
+    if kind == "ad":
+        media_type = "video" if ext in VIDEO_EXTENSIONS else "image"
+        path = media_path("ad", ext)
+    else:
+        media_type = data.get("media_type")
+        if media_type not in ["video", "image", "ad"]:
+            return jsonify({"error": "Invalid media_type"}), 400
+        path = media_path(media_type, ext)
+
+    expected_family = "video/" if ext in VIDEO_EXTENSIONS else "image/"
+    if not content_type.startswith(expected_family):
+        return jsonify({"error": f"content_type must be {expected_family}* for .{ext} files"}), 400
+
+    sha256 = (data.get("sha256") or "").lower()
+    if sha256 and not SHA256_RE.match(sha256):
+        return jsonify({"error": "sha256 must be a hex digest"}), 400
+    try:
+        existing_url = lookup(sha256, size) if sha256 else None
+    except Exception as e:
+        logger.warning("Media object lookup failed: %s", e)
+        existing_url = None
+    if existing_url:
+        ticket = sign({
+            "purpose": "media-upload",
+            "jti": str(uuid4()),
+            "sub": g.user["id"],
+            "kind": kind,
+            "sha256": sha256,
+            "size": size,
+            "content_type": content_type,
+            "media_type": media_type
+        }, SIGNED_UPLOAD_TTL + TICKET_GRACE)
+        return jsonify({"duplicate": True, "media_url": existing_url, "ticket": ticket}), 200
+
+    try:
+        target = storage.create_signed_upload(path, content_type, size)
+    except Exception as e:
+        return jsonify({"error": f"Could not create upload URL: {str(e)}"}), 502
+
+    ticket = sign({
+        "purpose": "media-upload",
+        "jti": str(uuid4()),
+        "sub": g.user["id"],
+        "kind": kind,
+        "path": path,
+        "sha256": sha256 or None,
+        "size": size,
+        "content_type": content_type,
+        "media_type": media_type
+    }, SIGNED_UPLOAD_TTL + TICKET_GRACE)
+
+    return jsonify({
+        "upload": target,
+        "path": path,
+        "ticket": ticket,
+        "expires_in": SIGNED_UPLOAD_TTL
+    }), 201
+
+@media_bp.route("/api/media/finalize", methods=["POST"])
+@admin_required
+def finalize_direct_upload():
+    """Verify a directly uploaded object and create its posts/advertisements row"""
+    data = request.get_json(silent=True) or {}
+    ticket = verify(data.get("ticket") or "", "media-upload")
+    if not ticket or not ticket.get("jti"):
+        return jsonify({"error": "Invalid or expired upload ticket"}), 400
+    if ticket.get("sub") != g.user["id"]:
+        return jsonify({"error": "Upload ticket was issued to another user"}), 403
+
+    title = data.get("title")
+    if not title:
+        return jsonify({"error": "Title is required"}), 400
+
+    ad_type = data.get("ad_type", "banner")
+    if ticket["kind"] == "ad" and ad_type not in ["banner", "in_stream"]:
+        return jsonify({"error": "Invalid ad type"}), 400
+
+    # A thumbnail must be an object already in this bucket, e.g. one
+    # uploaded with its own ticket; never an arbitrary external URL
+    thumbnail_url = data.get("thumbnail_url") if ticket["kind"] == "post" else None
+    if thumbnail_url:
+        thumbnail_path = storage.path_from_url(thumbnail_url)
+        try:
+            exists = thumbnail_path is not None and storage.stat(thumbnail_path) is not None
+        except Exception as e:
+            logger.warning("Could not verify thumbnail %s: %s", thumbnail_url, e)
+            return jsonify({"error": "Could not verify thumbnail"}), 502
+        if not exists:
+            return jsonify({"error": "thumbnail_url must be an object in this storage bucket"}), 400
+        thumbnail_url = storage.public_url(thumbnail_path)
+
+    try:
+        if not claim_ticket(ticket):
+            return jsonify({"error": "Upload ticket has already been used"}), 409
+    except Exception as e:
+        logger.warning("Failed to claim upload ticket %s: %s", ticket["jti"], e)
+        return jsonify({"error": "Database error"}), 500
+
+    response, code = finalize_ticket(ticket, data, title, ad_type, thumbnail_url)
+    # Failures the client may retry with the same ticket
+    if code >= 500 or code == 404:
+        release_ticket(ticket)
+    return response, code
+
+def finalize_ticket(ticket, data, title, ad_type, thumbnail_url=None):
+    """Attach the ticket's object to a new row; returns (response, status)"""
+    path = ticket.get("path")
+    if path is None:
+        # The file is already stored; take a reference instead of an upload
+        try:
+            media_url = acquire(ticket["sha256"], ticket["size"])
+        except Exception as e:
+            logger.warning("Failed to reference stored media: %s", e)
+            return jsonify({"error": "Database error"}), 500
+        if not media_url:
+            return jsonify({"error": "Stored copy no longer exists; request a new upload URL"}), 409
+        return create_media_row(ticket, data, title, ad_type, media_url, thumbnail_url)
+
+    try:
+        info = storage.stat(path)
+    except Exception as e:
+        logger.warning("Could not stat upload %s: %s", path, e)
+        return jsonify({"error": "Could not verify upload"}), 502
+    if not info:
+        return jsonify({"error": "Uploaded object not found"}), 404
+
+    problem = None
+    if info["size"] != ticket["size"]:
+        problem = f"Uploaded object is {info['size']} bytes, expected {ticket['size']}"
+    elif info["content_type"] and info["content_type"] != ticket["content_type"]:
+        problem = f"Uploaded object is {info['content_type']}, expected {ticket['content_type']}"
+    if not problem:
+        # Hash what actually arrived so the object is deduplicated and
+        # reference-counted like any other upload
+        try:
+            sha256, size = hash_object(path)
+        except Exception as e:
+            logger.warning("Could not hash upload %s: %s", path, e)
+            return jsonify({"error": "Could not verify upload"}), 502
+        if size != ticket["size"]:
+            problem = f"Uploaded object is {size} bytes, expected {ticket['size']}"
+        elif ticket.get("sha256") and sha256 != ticket["sha256"]:
+            problem = "Uploaded object does not match the declared sha256"
+    if problem:
+        # Don't keep objects that no row will ever reference
+        try:
+            storage.remove([path])
+        except Exception as e:
+            logger.warning("Failed to remove rejected upload %s: %s", path, e)
+        return jsonify({"error": problem}), 422
+
+    try:
+        media_url = register(path, storage.public_url(path), sha256, size, ticket["content_type"])
+    except Exception as e:
+        logger.warning("Failed to register upload %s: %s", path, e)
+        return jsonify({"error": "Database error"}), 500
+    return create_media_row(ticket, data, title, ad_type, media_url, thumbnail_url)
+
+def create_media_row(ticket, data, title, ad_type, media_url, thumbnail_url=None):
+    """Create the posts/advertisements row for a finalized upload.
+
+    Holds the media reference the caller took and, for posts, adds one to
+    the thumbnail; both are given back if the row cannot be created.
+    """
+    referenced = False
+    try:
+        if ticket["kind"] == "ad":
+            ad_id, created_at = create_advertisement(
+                title, ticket["media_type"], media_url, ad_type,
+                data.get("start_date"), data.get("end_date")
+            )
+            return jsonify({
+                "message": "Advertisement created successfully",
+                "ad": {
+                    "id": ad_id,
+                    "title": title,
+                    "media_type": ticket["media_type"],
+                    "media_url": media_url,
+                    "ad_type": ad_type,
+                    "is_active": True,
+                    "start_date": data.get("start_date"),
+                    "end_date": data.get("end_date"),
+                    "created_at": created_at
+                }
+            }), 201
+
+        created_by = g.user["id"]  # from the access token, not the body
+        content = data.get("content", "")
+        referenced = bool(thumbnail_url) and reference(thumbnail_url)
+        post_id, created_at = create_post(title, content, ticket["media_type"], media_url, thumbnail_url, created_by)
+        schedule_derivatives(post_id, ticket["media_type"], media_url, thumbnail_url)
+        return jsonify({
+            "message": "Post uploaded successfully",
+            "post": {
+                "id": post_id,
+                "title": title,
+                "content": content,
+                "media_type": ticket["media_type"],
+                "media_url": media_url,
+                "thumbnail_url": thumbnail_url or media_url,
+                "created_by": created_by,
+                "created_at": created_at
+            }
+        }), 201
+    except Exception as e:
+        logger.warning("Failed to create row for %s: %s", media_url, e)
+        discard([media_url, thumbnail_url if referenced else None])
+        return jsonify({"error": "Database error"}), 500
+
+@media_bp.route("/api/storage/local/<path:key>", methods=["PUT"])
+def local_signed_upload(key):
+    """Accept a signed upload for the local storage backend"""
+    if not isinstance(storage, LocalStorage):
+        abort(404)
+    claims = verify(request.args.get("token", ""), "local-upload")
+    if not claims or claims.get("path") != key:
+        return jsonify({"error": "Invalid or expired upload URL"}), 403
+    if request.content_length is not None and request.content_length > claims["max_size"]:
+        return jsonify({"error": "Upload larger than the size it was signed for"}), 413
+
+    # Content-Length is absent for chunked bodies, so cap what is actually read
+    storage.upload(key, CappedStream(request.stream, claims["max_size"]), request.content_type)
+    return jsonify({"path": key}), 200
+
+@media_bp.route("/media/<path:key>", methods=["GET", "HEAD"])
+def serve_media(key):
+    """Serve a stored object with Range/If-Range, ETag and Last-Modified support.
+
+    Local-backend objects come straight from the storage directory; bucket
+    objects from the on-disk media cache, except ones too large to cache,
+    which are redirected to the bucket.
+    """
+    try:
+        path = local_path(key)
+    except (FileNotFoundError, ValueError):
+        return jsonify({"error": "Not found"}), 404
+    except ObjectTooLarge:
+        return redirect(storage.public_url(key), 302)
+    except Exception as e:
+        logger.warning("Failed to fetch %s from storage: %s", key, e)
+        return jsonify({"error": "Storage unavailable"}), 502
+    return send_object(key, path)
+
+@media_bp.route("/api/storage/local/<path:key>", methods=["GET"])
+def local_object(key):
+    """Serve an object from the local storage backend (URLs from before /media)"""
+    if not isinstance(storage, LocalStorage):
+        abort(404)
+    return serve_media(key)
@@ -1,53 +1,115 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
+import logging
 from werkzeug.utils import secure_filename
 import time
-from uuid import uuid4
+from uuid import uuid4, UUID
 import os
 from datetime import datetime
 import ssl
 import certifi
 import base64
 
-from utils.db import get_db_connection, return_db_connection, supabase  # Your existing db.py
+from utils.db import get_db_connection, return_db_connection  # Your existing db.py
+from utils.media_objects import store, release, remove_objects, discard
+from utils.storage import storage, media_key
+from models.post_model import create_post
+from utils.derivatives import schedule as schedule_derivatives, attach_srcsets
+from utils.serializers import RowMapper, Field, Const, now, new_id, stream_json_array
+from utils.versions import conditional, uncacheable
+from utils.cache import cache, invalidate
+from utils.counters import post_counters
+from utils.helpers import encode_cursor, decode_cursor, parse_limit, count_rows, exact_count_requested, seek_clause, cursor_id, cursor_timestamp
+from utils.auth import admin_required, viewer_is_admin
+from utils.batch import parse_batch, update_where_ids, delete_where_ids, chunked_delete, progress_response, BatchBusy
+from utils.reconcile import reconcile, is_running as reconcile_running, ReconcileBusy, RECONCILE_PREFIXES, RECONCILE_GRACE_HOURS
+from utils.search import prefix_tsquery, fulltext_query, fuzzy_query, fuzzy_threshold_sql
+from utils.logs import sampled
 
 post_bp = Blueprint("posts", __name__)
 
+logger = logging.getLogger("posts")
+
 ALLOWED_EXTENSIONS = {"mp4", "mov", "jpg", "jpeg", "png", "gif"}
-bucket_name = "bigteam-video"
+
+# Admins also see unpublished posts, so only the browser may keep the list;
+# both endpoints revalidate every time and are usually answered with 304
+POSTS_CACHE_CONTROL = "private, no-cache"
+POST_CACHE_CONTROL = "public, no-cache"
+# Share of post list requests that log their page size at DEBUG level
+POSTS_DEBUG_SAMPLE = float(os.getenv("POSTS_DEBUG_SAMPLE", 0.01))
+
+POST_COLUMNS = """
+    id, title, content, media_type, media_url, thumbnail_url,
+    created_by, created_at, is_published
+"""
+POSTS_QUERY = f"SELECT {POST_COLUMNS} FROM posts ORDER BY created_at DESC"
+PUBLISHED_POSTS_QUERY = f"SELECT {POST_COLUMNS} FROM posts WHERE is_published = true ORDER BY created_at DESC"
+
+def _post_mapper(name, is_published):
+    return RowMapper(
+        name,
+        Field("id", 0, fallback=new_id),
+        Field("title", 1, default="Untitled"),
+        Field("content", 2, default=""),
+        Field("media_type", 3, default="image"),
+        Field("media_url", 4, default=""),
+        Field("thumbnail_url", 5),
+        Field("created_by", 6, default="unknown"),
+        Field("created_at", 7, fallback=now),
+        Field("updated_at", 7, fallback=now),
+        is_published,
+        Const("likes_count", 0),
+        Const("shares_count", 0),
+        Const("views_count", 0)
+    )
+
+POST_LIST_MAPPER = _post_mapper("posts", Field("is_published", 8))
+POST_DETAIL_MAPPER = _post_mapper("post", Field("is_published", 8, default=False))
+
+# Paginated listing: same shape as the full list but with the real counters
+POST_PAGE_COLUMNS = POST_COLUMNS + ", likes_count, shares_count, views_count"
+POST_PAGE_MAPPER = RowMapper(
+    "posts_page",
+    Field("id", 0),
+    Field("title", 1, default="Untitled"),
+    Field("content", 2, default=""),
+    Field("media_type", 3, default="image"),
+    Field("media_url", 4, default=""),
+    Field("thumbnail_url", 5),
+    Field("created_by", 6, default="unknown"),
+    Field("created_at", 7, fallback=now),
+    Field("updated_at", 7, fallback=now),
+    Field("is_published", 8, default=False),
+    Field("likes_count", 9, default=0),
+    Field("shares_count", 10, default=0),
+    Field("views_count", 11, default=0)
+)
+
+# sort key -> (expression, direction, index of the expression in POST_PAGE_COLUMNS,
+# whether the expression can be NULL). Each one is served by an index on
+# (expression, id) in create_tables.py
+POST_SORTS = {
+    "newest": ("created_at", "DESC", 7, True),
+    "oldest": ("created_at", "ASC", 7, True),
+    "most-viewed": ("COALESCE(views_count, 0)", "DESC", 11, False),
+    "most-liked": ("COALESCE(likes_count, 0)", "DESC", 9, False),
+}
+POST_PAGE_PARAMS = {"cursor", "limit", "sort", "media_type", "is_published",
+                    "created_by", "created_after", "created_before", "count"}
+MAX_POSTS_LIMIT = 100
+# Totals are planner estimates; with count=exact, filtered totals up to this
+# many rows are counted exactly
+POSTS_EXACT_COUNT_LIMIT = int(os.getenv("POSTS_EXACT_COUNT_LIMIT", 20000))
+
+def viewer_scope():
+    """ETag part for listings whose content depends on who is asking"""
+    return "admin" if viewer_is_admin() else "public"
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def ensure_bucket_exists():
-    """Ensure the storage bucket exists in Supabase"""
-    try:
-        # Try to list buckets to check if our bucket exists
-        buckets = supabase.storage.list_buckets()
-        bucket_exists = any(b.name == bucket_name for b in buckets)
-
-        if not bucket_exists:
-            # Create the bucket if it doesn't exist
-            supabase.storage.create_bucket(bucket_name, {
-                'public': True,  # Make bucket public for media access
-                'allowed_mime_types': ['image/*', 'video/*']
-            })
-            print(f"Created bucket: {bucket_name}")
-        return True
-    except Exception as e:
-        print(f"Error checking/creating bucket: {str(e)}")
-        # Try alternative method to create bucket
-        try:
-            supabase.storage.create_bucket(bucket_name, public=True)
-            print(f"Created bucket: {bucket_name} (alternative method)")
-            return True
-        except:
-            # Bucket might already exist, continue
-            return True
-
-# Ensure bucket exists on startup
-ensure_bucket_exists()
-
 @post_bp.route("/upload", methods=["POST"])
+@admin_required
 def upload_post():
     # Validate file existence
     if "file" not in request.files:
@@ -57,7 +119,7 @@ def upload_post():
     title = request.form.get("title")
     content = request.form.get("content", "")
     media_type = request.form.get("media_type")  # 'video' or 'image'
-    created_by = request.form.get("created_by")  # user UUID
+    created_by = g.user["id"]  # from the access token, not the form
     thumbnail_file = request.files.get("thumbnail", None)  # optional thumbnail file
     thumbnail_url = None
 
@@ -76,18 +138,7 @@ def upload_post():
     base_filename = f"{media_type}_{uuid4().hex}_{int(time.time())}.{ext}"
 
     # Add folder prefix based on media type
-    if media_type == "video":
-        filename = f"video/{base_filename}"
-    elif media_type == "image":
-        filename = f"image/{base_filename}"
-    elif media_type == "ad":
-        filename = f"Ad/{base_filename}"
-    else:
-        filename = base_filename
-
-    # Read file content
-    file.seek(0)  # Ensure we're at the beginning of the file
-    file_content = file.read()
+    filename = media_key(media_type, base_filename)
 
     # Upload thumbnail first if provided (for videos)
     if thumbnail_file and media_type == "video":
@@ -95,132 +146,75 @@ def upload_post():
             thumbnail_ext = "jpg"
             # Save thumbnail in video folder with videos
             thumbnail_filename = f"video/thumbnail_{uuid4().hex}_{int(time.time())}.{thumbnail_ext}"
-            thumbnail_file.seek(0)
-            thumbnail_content = thumbnail_file.read()
-
-            # Upload thumbnail to Supabase
-            thumbnail_response = supabase.storage.from_(bucket_name).upload(
-                path=thumbnail_filename,
-                file=thumbnail_content,
-                file_options={"content-type": "image/jpeg"}
-            )
-            thumbnail_url = supabase.storage.from_(bucket_name).get_public_url(thumbnail_filename)
-            print(f"Thumbnail uploaded successfully: {thumbnail_filename}")
+
+            # Upload thumbnail to Supabase (reusing an identical stored one)
+            thumbnail_url = store(thumbnail_filename, thumbnail_file.stream, "image/jpeg")
+            logger.debug("Thumbnail uploaded successfully: %s", thumbnail_filename)
         except Exception as e:
-            print(f"Thumbnail upload failed (continuing without thumbnail): {str(e)}")
+            logger.warning("Thumbnail upload failed (continuing without thumbnail): %s", e)
             thumbnail_url = None
 
-    # Upload to Supabase Storage
+    # Upload to Supabase Storage. A stored thumbnail holds a reference, so
+    # every failure return below must give it back with discard()
     try:
-        # Method 1: Direct upload with file bytes
-        response = supabase.storage.from_(bucket_name).upload(
-            path=filename,
-            file=file_content,
-            file_options={"content-type": file.content_type}
-        )
-
-        # Get public URL
-        media_url = supabase.storage.from_(bucket_name).get_public_url(filename)
-        print(f"File uploaded successfully to Supabase: {filename}")
+        # Method 1: Direct upload, streamed from the spooled request file;
+        # a file that is already stored is reused without sending it again
+        media_url = store(filename, file.stream, file.content_type)
+        logger.debug("File uploaded successfully to Supabase: %s", filename)
 
     except Exception as e:
         error_msg = str(e)
-        print(f"Supabase upload error: {error_msg}")
+        logger.warning("Supabase upload error: %s", error_msg)
 
         # If it's a duplicate file error, try to get the existing URL
         if "duplicate" in error_msg.lower() or "already exists" in error_msg.lower():
             try:
-                media_url = supabase.storage.from_(bucket_name).get_public_url(filename)
-                print(f"File already exists, using existing URL: {media_url}")
+                media_url = storage.public_url(filename)
+                logger.debug("File already exists, using existing URL: %s", media_url)
             except:
                 # Generate a new filename and retry with folder structure
                 base_filename = f"{media_type}_{uuid4().hex}_{int(time.time())}_retry.{ext}"
-                if media_type == "video":
-                    filename = f"video/{base_filename}"
-                elif media_type == "image":
-                    filename = f"image/{base_filename}"
-                elif media_type == "ad":
-                    filename = f"Ad/{base_filename}"
-                else:
-                    filename = base_filename
+                filename = media_key(media_type, base_filename)
                 try:
-                    response = supabase.storage.from_(bucket_name).upload(
-                        path=filename,
-                        file=file_content,
-                        file_options={"content-type": file.content_type}
-                    )
-                    media_url = supabase.storage.from_(bucket_name).get_public_url(filename)
-                    print(f"Uploaded with new filename: {filename}")
+                    media_url = store(filename, file.stream, file.content_type)
+                    logger.debug("Uploaded with new filename: %s", filename)
                 except Exception as retry_error:
+                    discard([thumbnail_url])
                     return jsonify({"error": f"Upload failed after retry: {str(retry_error)}"}), 500
         else:
             # Try alternative upload method
             try:
                 # Ensure bucket exists
-                ensure_bucket_exists()
+                storage.ensure_bucket()
 
                 # Try with a simpler approach but keep folder structure
                 base_filename = f"{media_type}_{int(time.time())}.{ext}"
-                if media_type == "video":
-                    filename = f"video/{base_filename}"
-                elif media_type == "image":
-                    filename = f"image/{base_filename}"
-                elif media_type == "ad":
-                    filename = f"Ad/{base_filename}"
-                else:
-                    filename = base_filename
-                response = supabase.storage.from_(bucket_name).upload(filename, file_content)
-                media_url = supabase.storage.from_(bucket_name).get_public_url(filename)
-                print(f"Uploaded using alternative method: {filename}")
+                filename = media_key(media_type, base_filename)
+                media_url = store(filename, file.stream, file.content_type)
+                logger.debug("Uploaded using alternative method: %s", filename)
 
             except Exception as alt_error:
+                discard([thumbnail_url])
                 return jsonify({
                     "error": "Supabase upload failed. Please check your Supabase configuration.",
                     "details": str(alt_error)
                 }), 500
 
-    # Generate a unique post ID
-    post_id = str(uuid4())
-    created_at = datetime.now().isoformat()
-
     # Save post info to DB (REQUIRED - don't continue without saving)
-    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Ensure created_by is a valid UUID or use NULL
-        if not created_by or created_by == '1':
-            created_by = None  # Use NULL for anonymous posts
-
-        cur.execute("""
-            INSERT INTO posts (title, content, media_type, media_url, thumbnail_url, created_by, is_published)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING id, created_at;
-        """, (title, content, media_type, media_url, thumbnail_url, created_by, True))
-
-        result = cur.fetchone()
-        if result:
-            post_id = str(result[0])
-            created_at = result[1].isoformat() if result[1] else datetime.now().isoformat()
-
-        conn.commit()
-        print(f"Post saved to database with ID: {post_id}")
+        post_id, created_at = create_post(title, content, media_type, media_url, thumbnail_url, created_by)
+        logger.debug("Post saved to database with ID: %s", post_id)
 
     except Exception as e:
-        print(f"Database error: {str(e)}")
-        if conn:
-            conn.rollback()
+        logger.warning("Database error: %s", e)
+        discard([media_url, thumbnail_url])
         # Return error - don't continue without saving to database
         return jsonify({
             "error": "Failed to save post to database",
             "details": str(e)
         }), 500
-    finally:
-        if conn:
-            if 'cur' in locals():
-                cur.close()
-            return_db_connection(conn)
+
+    schedule_derivatives(post_id, media_type, media_url, thumbnail_url)
 
     # For images, use the image URL as thumbnail if no thumbnail provided
     if media_type == "image" and not thumbnail_url:
@@ -237,173 +231,510 @@ def upload_post():
             "media_url": media_url,
             "thumbnail_url": thumbnail_url or media_url,  # Use media_url as thumbnail if not provided
             "created_by": created_by,
-            "created_at": created_at
+            "created_at": created_at,
+            "size": getattr(file.stream, "size", None),
+            "sha256": getattr(file.stream, "sha256", None)
         }
     }), 201
 
 # Removed local file serving - using Supabase storage only
 
 @post_bp.route("/api/storage/check", methods=["GET"])
+@admin_required
 def check_storage():
-    """Check Supabase storage configuration"""
+    """Check the storage backend, creating the bucket if it is missing"""
     try:
-        # List all buckets
-        buckets = supabase.storage.list_buckets()
-        bucket_names = [b.name for b in buckets] if buckets else []
-
-        # Check if our bucket exists
-        bucket_exists = bucket_name in bucket_names
-
-        # Try to create bucket if it doesn't exist
-        if not bucket_exists:
+        status = storage.check()
+        if status["bucket_exists"]:
+            message = f"Bucket '{status['bucket']}' already exists"
+        else:
             try:
-                supabase.storage.create_bucket(bucket_name, public=True)
-                message = f"Bucket '{bucket_name}' created successfully"
-                bucket_exists = True
+                status = storage.ensure_bucket()
+                message = f"Bucket '{status['bucket']}' created successfully"
             except Exception as create_error:
                 message = f"Bucket creation failed: {str(create_error)}"
-        else:
-            message = f"Bucket '{bucket_name}' already exists"
 
         return jsonify({
-            "buckets": bucket_names,
-            "target_bucket": bucket_name,
-            "bucket_exists": bucket_exists,
+            "buckets": status.get("buckets", [status["bucket"]]),
+            "target_bucket": status["bucket"],
+            "bucket_exists": status["bucket_exists"],
+            "backend": status["backend"],
             "message": message,
-            "supabase_url": os.getenv("SUPABASE_URL", "Not configured")
+            "supabase_url": status.get("url", "Not configured")
         }), 200
     except Exception as e:
         return jsonify({
             "error": str(e),
-            "message": "Failed to connect to Supabase storage"
+            "message": "Failed to connect to storage"
         }), 500
 
-@post_bp.route("/api/posts", methods=["GET"])
-def get_posts():
-    """Get all posts from database"""
+@post_bp.route("/api/storage/reconcile", methods=["POST"])
+@admin_required
+def reconcile_storage():
+    """Report (and with dry_run: false, delete) bucket objects no row references.
+
+    Body: {"dry_run": true, "grace_hours": 24, "prefixes": ["video/", ...]}.
+    Send `Accept: application/x-ndjson` to receive progress lines.
+    """
+    data = request.get_json(silent=True) or {}
+    dry_run = data.get("dry_run", True) is not False
+    prefixes = data.get("prefixes") or list(RECONCILE_PREFIXES)
+    if not isinstance(prefixes, list) or not all(isinstance(p, str) and p.endswith("/") for p in prefixes):
+        return jsonify({"error": "prefixes must be a list of folders ending in /"}), 400
+    try:
+        grace_hours = float(data.get("grace_hours", RECONCILE_GRACE_HOURS))
+    except (TypeError, ValueError):
+        return jsonify({"error": "grace_hours must be a number"}), 400
+    if grace_hours < 1:
+        return jsonify({"error": "grace_hours must be at least 1"}), 400
+    if reconcile_running():
+        return jsonify({"error": "A reconcile run is already in progress"}), 409
+
+    try:
+        # A run that started since the check above raises ReconcileBusy here
+        return progress_response(reconcile(prefixes, grace_hours, dry_run), lambda done: done)
+    except ReconcileBusy as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        logger.warning("Storage reconcile failed: %s", e)
+        return jsonify({"error": "Storage reconcile failed"}), 500
+
+def load_posts():
+    """All posts formatted for /api/posts, newest first"""
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
+        cur.execute(POSTS_QUERY)
+        posts = POST_LIST_MAPPER.many(cur.fetchall())
+        attach_srcsets(cur, posts)
+        cur.close()
+    finally:
+        if conn:
+            return_db_connection(conn)
+    return posts
 
-        # Fetch all posts from database
-        cur.execute("""
-            SELECT id, title, content, media_type, media_url, thumbnail_url,
-                   created_by, created_at, is_published
-            FROM posts
-            ORDER BY created_at DESC
-        """)
-        posts = cur.fetchall()
+def load_post(post_id):
+    """One post formatted for /api/posts/<id>, or None if it does not exist"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(f"SELECT {POST_COLUMNS} FROM posts WHERE id = %s", (post_id,))
+        row = cur.fetchone()
+        post = POST_DETAIL_MAPPER(row) if row else None
+        if post:
+            attach_srcsets(cur, [post])
         cur.close()
+    finally:
+        if conn:
+            return_db_connection(conn)
+    return post
 
-        # Format posts for response
-        formatted_posts = []
-        for post in posts:
-            formatted_posts.append({
-                "id": str(post[0]) if post[0] else str(uuid4()),
-                "title": post[1] or "Untitled",
-                "content": post[2] or "",
-                "media_type": post[3] or "image",
-                "media_url": post[4] or "",
-                "thumbnail_url": post[5] or post[4] or "",
-                "created_by": str(post[6]) if post[6] else "unknown",
-                "created_at": post[7].isoformat() if post[7] else datetime.now().isoformat(),
-                "updated_at": post[7].isoformat() if post[7] else datetime.now().isoformat(),
-                "is_published": post[8] if len(post) > 8 else True,
-                "likes_count": 0,
-                "shares_count": 0,
-                "views_count": 0
-            })
-
-        print(f"Returning {len(formatted_posts)} posts from database")
-        return jsonify(formatted_posts), 200
+def _attach_srcsets_streamed(conn, posts):
+    cur = conn.cursor()
+    try:
+        attach_srcsets(cur, posts)
+    finally:
+        cur.close()
 
+def post_filters(args):
+    """Turn /api/posts filter parameters into (SQL conditions, params); raises ValueError on bad input.
+
+    Only admins see unpublished posts; for everyone else the list is
+    limited to published ones whatever is_published says.
+    """
+    clauses, params = [], []
+    if not viewer_is_admin():
+        clauses.append("is_published = true")
+
+    media_type = args.get("media_type")
+    if media_type:
+        if media_type not in ["video", "image", "ad"]:
+            raise ValueError("media_type must be video, image or ad")
+        clauses.append("media_type = %s")
+        params.append(media_type)
+
+    is_published = args.get("is_published")
+    if is_published == "true":
+        clauses.append("is_published = true")
+    elif is_published == "false":
+        clauses.append("is_published IS NOT TRUE")
+    elif is_published:
+        raise ValueError("is_published must be true or false")
+
+    created_by = args.get("created_by")
+    if created_by:
+        clauses.append("created_by = %s")
+        params.append(str(UUID(created_by)))
+
+    for name, op in (("created_after", ">="), ("created_before", "<")):
+        value = args.get(name)
+        if value:
+            clauses.append(f"created_at {op} %s")
+            params.append(datetime.fromisoformat(value))
+
+    return clauses, params
+
+def get_posts_page(args):
+    """One keyset page of /api/posts for the given filter, sort and cursor parameters"""
+    try:
+        limit = parse_limit(args.get("limit"), default=20, maximum=MAX_POSTS_LIMIT)
+        sort = args.get("sort", "newest")
+        if sort not in POST_SORTS:
+            raise ValueError(f"sort must be one of {', '.join(POST_SORTS)}")
+        clauses, params = post_filters(args)
+        exact = exact_count_requested(args)
+        cursor = decode_cursor(args["cursor"]) if args.get("cursor") else None
+        if cursor is not None and (cursor.get("s") != sort or "k" not in cursor or "i" not in cursor):
+            raise ValueError("Cursor does not belong to this sort order")
+        expression, direction, key_index, nullable = POST_SORTS[sort]
+        if cursor is not None:
+            # Nullable keys are created_at; the others are COALESCEd counts
+            key = cursor_timestamp(cursor["k"]) if nullable else cursor["k"]
+            if not nullable and type(key) is not int:
+                raise ValueError("Invalid cursor")
+            last_id = cursor_id(cursor["i"])
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameters: {str(e)}"}), 400
+
+    where = "WHERE " + " AND ".join(clauses) if clauses else ""
+    seek_where, seek_params = where, list(params)
+    if cursor is not None:
+        seek, seek_values = seek_clause(expression, direction, nullable, key, last_id)
+        seek_where = "WHERE " + " AND ".join(clauses + [seek])
+        seek_params += seek_values
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT {POST_PAGE_COLUMNS}
+            FROM posts
+            {seek_where}
+            ORDER BY {expression} {direction}, id {direction}
+            LIMIT %s
+        """, (*seek_params, limit + 1))
+        rows = cur.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        response = {"limit": limit, "sort": sort, "has_more": has_more, "next_cursor": None}
+        if has_more:
+            last = rows[-1]
+            key = last[key_index]
+            if key is None and not nullable:
+                key = 0  # the sort expression COALESCEs the column
+            response["next_cursor"] = encode_cursor({"s": sort, "k": key, "i": last[0]})
+        if cursor is None:
+            # Totals are only worked out for the first page
+            response["total"], response["total_is_estimate"] = count_rows(
+                cur, f"FROM posts {where}", params, exact_limit=POSTS_EXACT_COUNT_LIMIT if exact else None
+            )
+
+        posts = POST_PAGE_MAPPER.many(rows)
+        attach_srcsets(cur, posts)
+        cur.close()
     except Exception as e:
-        print(f"Database error in get_posts: {str(e)}")
-        # Return empty array if database fails
-        return jsonify([]), 200
+        logger.warning("Database error in get_posts: %s", e)
+        return jsonify({"error": "Failed to fetch posts"}), 500
     finally:
         if conn:
             return_db_connection(conn)
 
-@post_bp.route("/api/posts/<post_id>", methods=["GET"])
-def get_post(post_id):
-    """Get single post by ID from database"""
+    # Include interactions that are still being aggregated in memory
+    for post in posts:
+        for field, delta in post_counters.pending(post["id"]).items():
+            post[field] += delta
+    response["posts"] = posts
+    return jsonify(response), 200
+
+def load_post_stats():
+    conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         cur.execute("""
-            SELECT id, title, content, media_type, media_url, thumbnail_url,
-                   created_by, created_at
+            SELECT COUNT(*),
+                   COUNT(*) FILTER (WHERE is_published = true),
+                   COUNT(*) FILTER (WHERE media_type = 'video'),
+                   COUNT(*) FILTER (WHERE media_type = 'image'),
+                   COALESCE(SUM(views_count), 0),
+                   COALESCE(SUM(likes_count), 0) + COALESCE(SUM(shares_count), 0)
             FROM posts
-            WHERE id = %s
-        """, (post_id,))
-        post = cur.fetchone()
+        """)
+        row = cur.fetchone()
         cur.close()
-        conn.close()
+    finally:
+        if conn:
+            return_db_connection(conn)
+    return {
+        "total_posts": row[0],
+        "published_posts": row[1],
+        "videos": row[2],
+        "images": row[3],
+        "total_views": int(row[4]),
+        "total_engagement": int(row[5])
+    }
+
+@post_bp.route("/api/posts/stats", methods=["GET"])
+@admin_required
+def get_post_stats():
+    """Totals for the admin dashboard, so it does not need every post to show them"""
+    try:
+        stats = cache.get_or_compute("posts:stats", load_post_stats, tags=("posts",))
+    except Exception as e:
+        logger.warning("Database error in get_post_stats: %s", e)
+        return jsonify({"error": "Failed to fetch post stats"}), 500
+    return jsonify(stats), 200
+
+@post_bp.route("/api/posts/search", methods=["GET"])
+@conditional("posts", "counters", cache_control=POSTS_CACHE_CONTROL, extra=viewer_scope)
+def search_posts():
+    """Ranked search over post titles and content.
+
+    `q` is matched word by word as prefixes against the full-text index;
+    if that finds nothing (or `mode=fuzzy` is given) titles are matched by
+    trigram similarity instead, so misspelt queries still find posts. The
+    /api/posts filters apply, and results are paged by `cursor`:
+    {"results", "mode", "next_cursor", "has_more"}.
+    """
+    args = request.args
+    text = (args.get("q") or "").strip()
+    try:
+        if not prefix_tsquery(text):
+            raise ValueError("q must contain at least one word")
+        mode = args.get("mode", "auto")
+        if mode not in ("auto", "fulltext", "fuzzy"):
+            raise ValueError("mode must be auto, fulltext or fuzzy")
+        limit = parse_limit(args.get("limit"), default=20, maximum=MAX_POSTS_LIMIT)
+        clauses, params = post_filters(args)
+        exact = exact_count_requested(args)
+        cursor = decode_cursor(args["cursor"]) if args.get("cursor") else None
+        if cursor is not None:
+            if cursor.get("m") not in ("fulltext", "fuzzy") or "r" not in cursor or "i" not in cursor:
+                raise ValueError("Invalid cursor")
+            # A cursor keeps paging in the mode its first page was served from
+            mode = cursor["m"]
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameters: {str(e)}"}), 400
+
+    after = (cursor["r"], cursor["i"]) if cursor else None
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        rows = []
+        if mode in ("auto", "fulltext"):
+            cur.execute(*fulltext_query(POST_PAGE_COLUMNS, text, clauses, params, after, limit + 1))
+            rows = cur.fetchall()
+            if rows or mode == "fulltext" or cursor is not None:
+                mode = "fulltext"
+            else:
+                mode = "fuzzy"
+        if mode == "fuzzy":
+            cur.execute(*fuzzy_threshold_sql())
+            cur.execute(*fuzzy_query(POST_PAGE_COLUMNS, text, clauses, params, after, limit + 1))
+            rows = cur.fetchall()
+        conn.commit()
 
-        if post:
-            return jsonify({
-                "id": str(post[0]) if post[0] else post_id,
-                "title": post[1] or "Untitled",
-                "content": post[2] or "",
-                "media_type": post[3] or "image",
-                "media_url": post[4] or "",
-                "thumbnail_url": post[5] or post[4] or "",
-                "created_by": str(post[6]) if post[6] else "unknown",
-                "created_at": post[7].isoformat() if post[7] else datetime.now().isoformat(),
-                "updated_at": post[7].isoformat() if post[7] else datetime.now().isoformat(),
-                "is_published": True,
-                "likes_count": 0,
-                "shares_count": 0,
-                "views_count": 0
-            }), 200
-        else:
-            return jsonify({"error": "Post not found"}), 404
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        results = POST_PAGE_MAPPER.many(rows)
+        for result, row in zip(results, rows):
+            result["rank"] = row[12]
+        attach_srcsets(cur, results)
+        cur.close()
+    except Exception as e:
+        logger.warning("Database error in search_posts: %s", e)
+        return jsonify({"error": "Failed to search posts"}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
 
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor({"m": mode, "r": last[12], "i": last[0]})
+    return jsonify({
+        "results": results,
+        "mode": mode,
+        "has_more": has_more,
+        "next_cursor": next_cursor
+    }), 200
+
+@post_bp.route("/api/posts", methods=["GET"])
+@conditional("posts", "counters", cache_control=POSTS_CACHE_CONTROL, extra=viewer_scope)
+def get_posts():
+    """Get all posts (published ones only unless the caller is an admin);
+    if the database fails the last good list is served.
+
+    Passing any of the filter, sort or pagination parameters (media_type,
+    is_published, created_by, created_after, created_before, sort, limit,
+    cursor, count) returns one keyset page instead: {"posts", "next_cursor",
+    "has_more", and on the first page "total"}, an estimate unless
+    count=exact is passed.
+
+    `?stream=true` skips the cache and streams the array straight from a
+    server-side cursor, for tables too large to build in memory.
+    """
+    if POST_PAGE_PARAMS.intersection(request.args):
+        return get_posts_page(request.args)
+
+    admin = viewer_is_admin()
+    if request.args.get("stream") == "true":
+        query = POSTS_QUERY if admin else PUBLISHED_POSTS_QUERY
+        try:
+            return stream_json_array(query, (), POST_LIST_MAPPER, enrich=_attach_srcsets_streamed)
+        except Exception as e:
+            logger.warning("Database error in get_posts: %s", e)
+            return jsonify({"error": "Failed to fetch posts"}), 503
+
+    try:
+        formatted_posts = cache.get_or_compute("posts:all", load_posts, tags=("posts",))
     except Exception as e:
-        print(f"Database error: {str(e)}")
+        logger.warning("Database error in get_posts: %s", e)
+        return jsonify({"error": "Failed to fetch posts"}), 503
+    if not admin:
+        formatted_posts = [post for post in formatted_posts if post["is_published"] is True]
+
+    if sampled(logger, logging.DEBUG, POSTS_DEBUG_SAMPLE):
+        logger.debug("Returning %d posts", len(formatted_posts))
+    return jsonify(formatted_posts), 200
+
+@post_bp.route("/api/posts/<post_id>", methods=["GET"])
+@conditional("posts", cache_control=POST_CACHE_CONTROL, extra=viewer_scope)
+def get_post(post_id):
+    """Get single post by ID; unpublished posts are only shown to admins"""
+    try:
+        post = cache.get_or_compute(f"post:{post_id}", lambda: load_post(post_id), tags=("posts",))
+    except Exception as e:
+        logger.warning("Database error: %s", e)
         return jsonify({"error": "Failed to fetch post"}), 500
 
+    if post is None or (post["is_published"] is not True and not viewer_is_admin()):
+        return jsonify({"error": "Post not found"}), 404
+    if post["is_published"] is not True:
+        uncacheable()  # a draft must not land in a shared cache
+    return jsonify(post), 200
+
 @post_bp.route("/api/posts/<post_id>", methods=["DELETE"])
+@admin_required
 def delete_post(post_id):
     """Delete a post from database"""
+    conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("DELETE FROM posts WHERE id = %s", (post_id,))
+        cur.execute("DELETE FROM posts WHERE id = %s RETURNING media_url, thumbnail_url", (post_id,))
+        deleted = cur.fetchone()
+        # Storage objects go only once no other post/ad shares them
+        freed = release(cur, deleted) if deleted else []
         conn.commit()
         cur.close()
-        conn.close()
+        invalidate("posts")
+        remove_objects(freed)
         return jsonify({"message": "Post deleted successfully"}), 200
     except Exception as e:
-        print(f"Database error: {str(e)}")
+        logger.warning("Database error: %s", e)
+        if conn:
+            conn.rollback()
         return jsonify({"error": "Failed to delete post"}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
 
-@post_bp.route("/api/posts/cleanup/test-data", methods=["DELETE"])
-def cleanup_test_data():
-    """Remove all test data from posts table"""
+@post_bp.route("/api/posts/batch", methods=["POST"])
+@admin_required
+def batch_posts():
+    """Publish, unpublish or delete many posts: {"action", "ids"}.
+
+    Deletes run in chunks; send `Accept: application/x-ndjson` to receive
+    a progress line after each one.
+    """
+    try:
+        action, ids = parse_batch(request.get_json(silent=True), ("publish", "unpublish", "delete"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if action == "delete":
+        remaining, not_found = list(ids), []
+
+        def delete_chunk(cur, limit):
+            chunk = remaining[:limit]
+            del remaining[:limit]
+            if not chunk:
+                return None
+            rows, missing = delete_where_ids(cur, "posts", "media_url, thumbnail_url", chunk)
+            not_found.extend(missing)
+            return rows
+
+        try:
+            return progress_response(
+                chunked_delete(delete_chunk, "posts", summary=lambda: {"not_found": not_found}),
+                lambda done: {"action": action, "requested": len(ids), "deleted": done["deleted"],
+                              "not_found": done["not_found"]}
+            )
+        except BatchBusy as e:
+            return jsonify({"error": str(e)}), 409
+        except Exception as e:
+            logger.warning("Batch delete of posts failed: %s", e)
+            return jsonify({"error": "Failed to delete posts"}), 500
+
+    conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        # Delete posts with obvious test data patterns
-        cur.execute("""
-            DELETE FROM posts
-            WHERE LOWER(title) LIKE '%test%'
-               OR LOWER(title) LIKE '%sample%'
-               OR LOWER(content) LIKE '%test%'
-               OR LOWER(content) LIKE '%lorem%'
-               OR LOWER(content) LIKE '%ipsum%'
-               OR title IN ('sample file 1', 'sample file 2', 'test file')
-        """)
-        affected = cur.rowcount
+        updated, missing = update_where_ids(
+            cur, "posts", "is_published = %s, updated_at = NOW()", (action == "publish",), ids
+        )
         conn.commit()
         cur.close()
-        conn.close()
-        return jsonify({
-            "message": f"Cleaned up {affected} test posts",
-            "deleted_count": affected
-        }), 200
     except Exception as e:
-        print(f"Database error: {str(e)}")
+        logger.warning("Batch %s of posts failed: %s", action, e)
+        if conn:
+            conn.rollback()
+        return jsonify({"error": f"Failed to {action} posts"}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+    invalidate("posts")
+    return jsonify({"action": action, "updated": len(updated), "not_found": missing}), 200
+
+# Posts with obvious test data patterns
+TEST_DATA_CONDITION = """
+    LOWER(title) LIKE '%%test%%'
+    OR LOWER(title) LIKE '%%sample%%'
+    OR LOWER(content) LIKE '%%test%%'
+    OR LOWER(content) LIKE '%%lorem%%'
+    OR LOWER(content) LIKE '%%ipsum%%'
+    OR title IN ('sample file 1', 'sample file 2', 'test file')
+"""
+
+@post_bp.route("/api/posts/cleanup/test-data", methods=["DELETE"])
+@admin_required
+def cleanup_test_data():
+    """Remove all test data from posts table, a chunk at a time"""
+    def delete_chunk(cur, limit):
+        cur.execute(f"""
+            DELETE FROM posts
+            WHERE id IN (SELECT id FROM posts WHERE {TEST_DATA_CONDITION} LIMIT %s FOR UPDATE SKIP LOCKED)
+            RETURNING media_url, thumbnail_url
+        """, (limit,))
+        return cur.fetchall() or None
+
+    try:
+        return progress_response(
+            chunked_delete(delete_chunk, "posts"),
+            lambda done: {
+                "message": f"Cleaned up {done['deleted']} test posts",
+                "deleted_count": done["deleted"]
+            }
+        )
+    except BatchBusy as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        logger.warning("Test data cleanup failed: %s", e)
         return jsonify({"error": "Failed to cleanup test data"}), 500
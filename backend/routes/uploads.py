@@ -0,0 +1,451 @@
+from flask import Blueprint, request, jsonify, g
+import logging
+import math
+
+from utils.db import get_db_connection, return_db_connection, release_request_connection
+from utils.storage import media_path
+from utils.media_objects import store, discard
+from utils.uploads import UPLOAD_MAX_FILE_BYTES
+from utils.resumable import (
+    UPLOAD_CHUNK_SIZE, UPLOAD_CHUNK_MAX, UPLOAD_SESSION_TTL,
+    parse_checksum, receive_chunk, store_chunk, remove_chunks, chunk_key, assemble,
+    remove_session_files, maybe_expire_sessions
+)
+from routes.post import allowed_file
+from models.post_model import create_post
+from utils.derivatives import schedule as schedule_derivatives
+from utils.auth import admin_required
+
+upload_bp = Blueprint("uploads", __name__)
+
+logger = logging.getLogger("uploads")
+
+MIN_CHUNK_SIZE = 256 * 1024
+
+# Status code tus uses when a chunk does not match its Upload-Checksum
+CHECKSUM_MISMATCH = 460
+
+def contiguous_offset(indexes, chunk_size, total_size):
+    """Bytes received without gaps from the start of the file"""
+    received = 0
+    for expected, index in enumerate(sorted(indexes)):
+        if index != expected:
+            break
+        received += 1
+    return min(received * chunk_size, total_size)
+
+def session_status(cur, upload_id):
+    cur.execute("""
+        SELECT id, status, total_size, chunk_size, total_chunks, expires_at, post_id
+        FROM upload_sessions
+        WHERE id = %s AND expires_at > NOW()
+    """, (upload_id,))
+    session = cur.fetchone()
+    if not session:
+        return None
+
+    cur.execute("""
+        SELECT chunk_index FROM upload_chunks
+        WHERE session_id = %s
+        ORDER BY chunk_index
+    """, (upload_id,))
+    received = [row[0] for row in cur.fetchall()]
+    received_set = set(received)
+
+    return {
+        "upload_id": str(session[0]),
+        "status": session[1],
+        "size": session[2],
+        "chunk_size": session[3],
+        "total_chunks": session[4],
+        "expires_at": session[5].isoformat() if session[5] else None,
+        "post_id": str(session[6]) if session[6] else None,
+        "received_chunks": received,
+        "missing_chunks": [i for i in range(session[4]) if i not in received_set],
+        "offset": contiguous_offset(received, session[3], session[2])
+    }
+
+@upload_bp.route("/api/uploads", methods=["POST"])
+@admin_required
+def create_upload():
+    """Open a resumable upload session; chunks are then PATCHed in any order"""
+    data = request.get_json(silent=True) or {}
+    filename = data.get("filename")
+    title = data.get("title")
+    media_type = data.get("media_type")
+    created_by = g.user["id"]  # from the access token, not the body
+
+    if not filename or not title or not media_type:
+        return jsonify({"error": "Missing required fields"}), 400
+    if media_type not in ["video", "image", "ad"]:
+        return jsonify({"error": "Invalid media_type"}), 400
+    if not allowed_file(filename):
+        return jsonify({"error": "File type not allowed"}), 400
+
+    try:
+        size = int(data.get("size"))
+        chunk_size = int(data.get("chunk_size") or UPLOAD_CHUNK_SIZE)
+    except (TypeError, ValueError):
+        return jsonify({"error": "size and chunk_size must be integers"}), 400
+    if size <= 0:
+        return jsonify({"error": "size must be positive"}), 400
+    if size > UPLOAD_MAX_FILE_BYTES:
+        return jsonify({"error": f"File exceeds the {UPLOAD_MAX_FILE_BYTES} byte upload limit"}), 413
+    chunk_size = max(MIN_CHUNK_SIZE, min(chunk_size, UPLOAD_CHUNK_MAX))
+    total_chunks = math.ceil(size / chunk_size)
+
+    sha256 = data.get("sha256")
+    if sha256 is not None:
+        sha256 = str(sha256).lower()
+        if len(sha256) != 64:
+            return jsonify({"error": "sha256 must be a hex digest"}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO upload_sessions
+                (filename, content_type, media_type, title, content, created_by,
+                 total_size, chunk_size, total_chunks, sha256, expires_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW() + %s * INTERVAL '1 second')
+            RETURNING id, expires_at;
+        """, (filename, data.get("content_type") or "application/octet-stream", media_type, title,
+              data.get("content", ""), created_by, size, chunk_size, total_chunks, sha256,
+              UPLOAD_SESSION_TTL))
+        upload_id, expires_at = cur.fetchone()
+        conn.commit()
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+    finally:
+        if conn:
+            if 'cur' in locals():
+                cur.close()
+            return_db_connection(conn)
+
+    maybe_expire_sessions()
+
+    response = jsonify({
+        "upload_id": str(upload_id),
+        "chunk_size": chunk_size,
+        "total_chunks": total_chunks,
+        "expires_at": expires_at.isoformat()
+    })
+    response.headers["Location"] = f"/api/uploads/{upload_id}"
+    return response, 201
+
+@upload_bp.route("/api/uploads/<upload_id>", methods=["GET"])
+def get_upload(upload_id):
+    """Report which chunks have arrived; HEAD returns just the Upload-Offset"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        status = session_status(cur, upload_id)
+    except Exception as e:
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+    finally:
+        if conn:
+            if 'cur' in locals():
+                cur.close()
+            return_db_connection(conn)
+
+    if not status:
+        return jsonify({"error": "Upload not found or expired"}), 404
+
+    response = jsonify(status)
+    response.headers["Upload-Offset"] = str(status["offset"])
+    response.headers["Upload-Length"] = str(status["size"])
+    response.headers["Cache-Control"] = "no-store"
+    return response, 200
+
+@upload_bp.route("/api/uploads/<upload_id>/chunks/<int:index>", methods=["PATCH", "PUT"])
+def upload_chunk(upload_id, index):
+    """Store one chunk from the raw request body.
+
+    An optional `Upload-Checksum: sha256 <base64 or hex>` header is verified
+    against the bytes received; re-sending a chunk simply replaces it.
+    """
+    try:
+        checksum = parse_checksum(request.headers.get("Upload-Checksum"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT status, total_size, chunk_size, total_chunks
+            FROM upload_sessions
+            WHERE id = %s AND expires_at > NOW()
+        """, (upload_id,))
+        session = cur.fetchone()
+    except Exception as e:
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+    finally:
+        if conn:
+            if 'cur' in locals():
+                cur.close()
+        # Don't pin a pool connection while the chunk body streams in
+        release_request_connection()
+
+    if not session:
+        return jsonify({"error": "Upload not found or expired"}), 404
+    status, total_size, chunk_size, total_chunks = session
+    if status != "open":
+        return jsonify({"error": f"Upload is {status}"}), 409
+    if index < 0 or index >= total_chunks:
+        return jsonify({"error": f"Chunk index must be between 0 and {total_chunks - 1}"}), 400
+
+    expected = chunk_size if index < total_chunks - 1 else total_size - chunk_size * (total_chunks - 1)
+    spooled = receive_chunk(request.stream, expected)
+    try:
+        size, digest = spooled.size, spooled.sha256
+        if size != expected:
+            return jsonify({"error": f"Chunk {index} must be {expected} bytes, received {size}"}), 400
+        if checksum and checksum != digest:
+            return jsonify({"error": f"Checksum mismatch for chunk {index}"}), CHECKSUM_MISMATCH
+        # A new key per digest, so the chunk the table points at now is
+        # never overwritten before the row below is committed
+        key = store_chunk(upload_id, index, spooled)
+    except Exception as e:
+        logger.warning("Failed to store chunk %s of upload %s: %s", index, upload_id, e)
+        return jsonify({"error": "Failed to store chunk"}), 500
+    finally:
+        spooled.close()
+
+    conn = None
+    previous = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        # Finalize may have claimed the session while the body streamed in;
+        # holding the row FOR SHARE keeps it from doing so until the chunk
+        # row is committed, so assemble always sees a complete chunk list
+        cur.execute("""
+            SELECT status FROM upload_sessions
+            WHERE id = %s AND expires_at > NOW()
+            FOR SHARE
+        """, (upload_id,))
+        session = cur.fetchone()
+        cur.execute("""
+            SELECT sha256 FROM upload_chunks
+            WHERE session_id = %s AND chunk_index = %s
+            FOR UPDATE
+        """, (upload_id, index))
+        row = cur.fetchone()
+        previous = row[0] if row else None
+        if not session or session[0] != "open":
+            conn.rollback()
+            if previous != digest:
+                remove_chunks([key])
+            if not session:
+                return jsonify({"error": "Upload not found or expired"}), 404
+            return jsonify({"error": f"Upload is {session[0]}"}), 409
+        cur.execute("""
+            INSERT INTO upload_chunks (session_id, chunk_index, size, sha256)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (session_id, chunk_index)
+            DO UPDATE SET size = EXCLUDED.size, sha256 = EXCLUDED.sha256, received_at = NOW()
+        """, (upload_id, index, size, digest))
+        cur.execute("""
+            UPDATE upload_sessions
+            SET expires_at = NOW() + %s * INTERVAL '1 second'
+            WHERE id = %s
+        """, (UPLOAD_SESSION_TTL, upload_id))
+        conn.commit()
+        status = session_status(cur, upload_id)
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        # The previous chunk (if any) is still the recorded one; keep it
+        if previous != digest:
+            remove_chunks([key])
+        logger.warning("Failed to record chunk %s of upload %s: %s", index, upload_id, e)
+        return jsonify({"error": "Failed to record chunk"}), 500
+    finally:
+        if conn:
+            if 'cur' in locals():
+                cur.close()
+            return_db_connection(conn)
+
+    # The replaced chunk's object is unreferenced only now
+    if previous is not None and previous != digest:
+        remove_chunks([chunk_key(upload_id, index, previous)])
+
+    response = jsonify({
+        "chunk": index,
+        "size": size,
+        "sha256": digest,
+        "received_chunks": len(status["received_chunks"]),
+        "total_chunks": total_chunks,
+        "offset": status["offset"]
+    })
+    response.headers["Upload-Offset"] = str(status["offset"])
+    return response, 200
+
+@upload_bp.route("/api/uploads/<upload_id>/finalize", methods=["POST"])
+@admin_required
+def finalize_upload(upload_id):
+    """Assemble the chunks, store the object and create the post like /upload does"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+
+        # Claim the session so concurrent finalize calls can't both run
+        cur.execute("""
+            UPDATE upload_sessions
+            SET status = 'finalizing', expires_at = NOW() + %s * INTERVAL '1 second'
+            WHERE id = %s AND status = 'open' AND expires_at > NOW()
+            RETURNING filename, content_type, media_type, title, content, created_by,
+                      total_size, total_chunks, sha256
+        """, (UPLOAD_SESSION_TTL, upload_id))
+        session = cur.fetchone()
+        conn.commit()
+
+        if not session:
+            status = session_status(cur, upload_id)
+            if not status:
+                return jsonify({"error": "Upload not found or expired"}), 404
+            if status["status"] == "complete":
+                return jsonify({"message": "Upload already finalized", "post_id": status["post_id"]}), 200
+            return jsonify({"error": f"Upload is {status['status']}"}), 409
+
+        filename, content_type, media_type, title, content, created_by, total_size, total_chunks, sha256 = session
+        cur.execute("""
+            SELECT chunk_index, sha256 FROM upload_chunks
+            WHERE session_id = %s
+            ORDER BY chunk_index
+        """, (upload_id,))
+        chunks = cur.fetchall()
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+    finally:
+        if conn:
+            if 'cur' in locals():
+                cur.close()
+        release_request_connection()
+
+    def reopen(error, code):
+        conn = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+            cur.execute("UPDATE upload_sessions SET status = 'open' WHERE id = %s", (upload_id,))
+            conn.commit()
+            cur.close()
+        except Exception as e:
+            # The session stays 'finalizing' until it expires
+            logger.warning("Failed to reopen upload %s: %s", upload_id, e)
+            if conn:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+        return jsonify(error), code
+
+    if len(chunks) != total_chunks:
+        return reopen({"error": f"Upload incomplete: {len(chunks)} of {total_chunks} chunks received"}, 409)
+
+    assembled = None
+    media_url = thumbnail_url = None
+    try:
+        assembled = assemble(upload_id, chunks)
+        if assembled.size != total_size:
+            return reopen({"error": f"Assembled size {assembled.size} does not match declared size {total_size}"}, 422)
+        if sha256 and assembled.sha256 != sha256:
+            return reopen({"error": "Assembled file does not match the declared sha256"}, 422)
+
+        thumbnail_file = request.files.get("thumbnail")
+        if thumbnail_file and media_type == "video":
+            try:
+                thumbnail_url = store(media_path("video", "jpg", name="thumbnail"),
+                                      thumbnail_file.stream, "image/jpeg")
+            except Exception as e:
+                logger.warning("Thumbnail upload failed (continuing without thumbnail): %s", e)
+
+        ext = filename.rsplit(".", 1)[1].lower()
+        media_url = store(media_path(media_type, ext), assembled, content_type)
+        post_id, created_at = create_post(title, content, media_type, media_url, thumbnail_url,
+                                          str(created_by) if created_by else None)
+    except Exception as e:
+        logger.warning("Finalize failed for upload %s: %s", upload_id, e)
+        discard([media_url, thumbnail_url])
+        return reopen({"error": "Failed to finalize upload", "details": str(e)}, 500)
+    finally:
+        if assembled:
+            assembled.close()
+
+    schedule_derivatives(post_id, media_type, media_url, thumbnail_url)
+
+    # The post exists from here on, so the client gets it even if the
+    # session cannot be marked complete (it then expires on its own)
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE upload_sessions SET status = 'complete', post_id = %s WHERE id = %s
+        """, (post_id, upload_id))
+        cur.execute("DELETE FROM upload_chunks WHERE session_id = %s", (upload_id,))
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        logger.warning("Failed to mark upload %s complete (post %s): %s", upload_id, post_id, e)
+        if conn:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+    remove_session_files(upload_id)
+
+    return jsonify({
+        "message": "Post uploaded successfully",
+        "post": {
+            "id": post_id,
+            "title": title,
+            "content": content,
+            "media_type": media_type,
+            "media_url": media_url,
+            "thumbnail_url": thumbnail_url or media_url,
+            "created_by": str(created_by) if created_by else None,
+            "created_at": created_at,
+            "size": assembled.size,
+            "sha256": assembled.sha256
+        }
+    }), 201
+
+@upload_bp.route("/api/uploads/<upload_id>", methods=["DELETE"])
+def abort_upload(upload_id):
+    """Abandon an upload session and discard its chunks"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            DELETE FROM upload_sessions
+            WHERE id = %s AND status <> 'finalizing'
+            RETURNING id
+        """, (upload_id,))
+        deleted = cur.fetchone()
+        conn.commit()
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+    finally:
+        if conn:
+            if 'cur' in locals():
+                cur.close()
+            return_db_connection(conn)
+
+    if not deleted:
+        return jsonify({"error": "Upload not found or being finalized"}), 404
+    remove_session_files(upload_id)
+    return jsonify({"message": "Upload aborted"}), 200
@@ -0,0 +1,104 @@
+"""
+Shared fixtures. Nothing here talks to Postgres or a storage bucket: tests
+stub the few functions that would, so the suite runs anywhere.
+"""
+import os
+import tempfile
+
+# Set before the app modules read their configuration at import
+os.environ.setdefault("UPLOAD_SECRET_KEY", "test-upload-secret-0123456789abcdef0123")
+os.environ.setdefault("JWT_SECRET_KEY", "test-jwt-secret-0123456789abcdef0123456")
+os.environ.setdefault("WARM_ON_STARTUP", "0")
+os.environ.setdefault("METRICS_ENABLED", "0")
+os.environ["VERSION_DIR"] = tempfile.mkdtemp(prefix="bigteam-test-versions-")
+
+import pytest
+
+from app import create_app
+from utils import auth
+
+
+@pytest.fixture
+def app():
+    return create_app(metrics=False)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(monkeypatch):
+    """login(role) -> Authorization headers for an active user with that role"""
+    roles = {}
+    monkeypatch.setattr(auth.claims_cache, "get", lambda user_id: (roles[user_id], True) if user_id in roles else None)
+
+    def headers(role, user_id="00000000-0000-0000-0000-000000000001"):
+        roles[user_id] = role
+        token = auth.issue_tokens({"id": user_id, "role": role})["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    return headers
+
+
+class FakeCursor:
+    """Records statements and answers them from a queue of result sets.
+
+    A queued exception is raised by the statement it would have answered.
+    """
+
+    def __init__(self, results=()):
+        self.results = list(results)
+        self.statements = []
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self.statements.append((" ".join(query.split()), params))
+        result = self.results.pop(0) if self.results else []
+        if isinstance(result, Exception):
+            raise result
+        self._rows = list(result)
+        self.rowcount = len(self._rows)
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.commits = self.rollbacks = 0
+
+    def cursor(self, *args, **kwargs):
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """fake_db(module, *result_sets) -> the FakeCursor `module`'s connections hand out"""
+    def install(module, *results):
+        cursor = FakeCursor(results)
+        connection = FakeConnection(cursor)
+        for name in ("get_db_connection", "get_unscoped_connection"):
+            if hasattr(module, name):
+                monkeypatch.setattr(module, name, lambda *args, **kwargs: connection)
+        monkeypatch.setattr(module, "return_db_connection", lambda conn: None)
+        return cursor
+    return install
@@ -0,0 +1,69 @@
+import logging
+import random
+from datetime import datetime, timedelta
+
+from utils import ad_inventory as inventory_module
+from utils.ad_inventory import AdInventory, _Snapshot, _END_RESOLUTION
+
+BASE = datetime(2026, 1, 1)
+
+
+def ad(index, start=None, end=None, is_active=True, ad_type="banner"):
+    return {"id": str(index), "ad_type": ad_type, "is_active": is_active,
+            "start_date": start, "end_date": end}
+
+
+def brute_force(ads, moment, ad_type=None):
+    return [a for a in ads
+            if a["is_active"] is not False
+            and (a["start_date"] is None or a["start_date"] <= moment)
+            and (a["end_date"] is None or moment < a["end_date"] + _END_RESOLUTION)
+            and (ad_type is None or a["ad_type"] == ad_type)]
+
+
+def test_segments_match_brute_force():
+    rng = random.Random(7)
+
+    def moment():
+        return BASE + timedelta(hours=rng.randint(0, 48))
+
+    ads = [ad(i,
+              start=moment() if rng.random() < 0.7 else None,
+              end=moment() if rng.random() < 0.7 else None,
+              is_active=rng.random() < 0.8,
+              ad_type=rng.choice(("banner", "in_stream")))
+           for i in range(60)]
+    snapshot = _Snapshot(ads, BASE)
+
+    probes = {BASE - timedelta(days=1), BASE + timedelta(days=3)}
+    for boundary in snapshot.boundaries:
+        probes.update((boundary - _END_RESOLUTION, boundary, boundary + _END_RESOLUTION))
+    for probe in sorted(probes):
+        for ad_type in (None, "banner", "in_stream"):
+            assert list(snapshot.active_at(probe, ad_type)) == brute_force(ads, probe, ad_type)
+
+
+def test_end_date_is_inclusive_and_inverted_windows_never_show():
+    ads = [ad(0, start=BASE, end=BASE + timedelta(hours=1)),
+           ad(1, start=BASE + timedelta(hours=2), end=BASE + timedelta(hours=1))]
+    snapshot = _Snapshot(ads, BASE)
+
+    assert [a["id"] for a in snapshot.active_at(BASE + timedelta(hours=1))] == ["0"]
+    assert snapshot.active_at(BASE + timedelta(hours=1) + _END_RESOLUTION) == ()
+    assert snapshot.active_at(BASE + timedelta(hours=3)) == ()
+    assert snapshot.next_boundary(BASE) == BASE + timedelta(hours=1) + _END_RESOLUTION
+
+
+def test_failed_reload_logs_and_serves_previous_snapshot(monkeypatch, caplog):
+    inventory = AdInventory(ttl=60)
+    monkeypatch.setattr(inventory_module, "current", lambda names: "stamp")
+    monkeypatch.setattr(inventory, "_load", lambda: _Snapshot([ad(0)], datetime.now()))
+    assert [a["id"] for a in inventory.active_ads()] == ["0"]
+
+    def fail():
+        raise RuntimeError("database down")
+    monkeypatch.setattr(inventory, "_load", fail)
+    inventory.invalidate()
+    with caplog.at_level(logging.WARNING, logger="ads"):
+        assert [a["id"] for a in inventory.active_ads()] == ["0"]
+    assert "database down" in caplog.text
@@ -0,0 +1,85 @@
+import pytest
+
+from routes import auth as auth_routes
+from utils.helpers import encode_cursor, decode_cursor
+
+
+@pytest.fixture
+def created(monkeypatch):
+    """Roles passed to create_user, without touching the database"""
+    calls = []
+
+    def create_user(**fields):
+        calls.append(fields)
+        return "new-user-id", None
+
+    monkeypatch.setattr(auth_routes, "create_user", create_user)
+    monkeypatch.setattr(auth_routes.password_hasher, "hash", lambda password: "hashed")
+    return calls
+
+
+SIGNUP = {"full_name": "A User", "email": "a@example.com", "username": "auser", "password": "secret"}
+
+
+def test_register_ignores_requested_role(client, created):
+    response = client.post("/auth/register", json={**SIGNUP, "role": "admin"})
+    assert response.status_code == 201
+    assert created[0]["role"] == "customer"
+
+
+def test_admin_create_user_requires_admin(client, created, login):
+    assert client.post("/auth/admin/users", json={**SIGNUP, "role": "admin"}).status_code == 401
+    response = client.post("/auth/admin/users", json={**SIGNUP, "role": "admin"}, headers=login("customer"))
+    assert response.status_code == 403
+    assert created == []
+
+
+def test_admin_create_user_sets_role(client, created, login):
+    response = client.post("/auth/admin/users", json={**SIGNUP, "role": "admin"}, headers=login("admin"))
+    assert response.status_code == 201
+    assert created[0]["role"] == "admin"
+
+
+def test_admin_create_user_rejects_unknown_role(client, created, login):
+    response = client.post("/auth/admin/users", json={**SIGNUP, "role": "root"}, headers=login("admin"))
+    assert response.status_code == 400
+    assert created == []
+
+
+USER_ID = "00000000-0000-0000-0000-0000000000f1"
+
+
+def user_row(created_at):
+    return (USER_ID, "A User", "auser", "a@example.com", "customer", created_at, True)
+
+
+def test_users_cursor_after_null_created_at(client, fake_db, login, monkeypatch):
+    monkeypatch.setattr(auth_routes, "count_rows", lambda *args, **kwargs: (2, True))
+    fake_db(auth_routes, [user_row(None), user_row(None)])
+    body = client.get("/auth/admin/users?limit=1", headers=login("admin")).get_json()
+    assert decode_cursor(body["next_cursor"])["c"] is None
+
+    cur = fake_db(auth_routes, [])
+    response = client.get(f"/auth/admin/users?limit=1&cursor={body['next_cursor']}", headers=login("admin"))
+    assert response.status_code == 200
+    sql, params = cur.statements[0]
+    assert "((created_at IS NULL AND id < %s) OR created_at IS NOT NULL)" in sql
+
+
+@pytest.mark.parametrize("payload", [{"c": 5, "i": USER_ID}, {"c": "soon", "i": USER_ID}, {"c": None, "i": 3}, {"i": USER_ID}])
+def test_users_tampered_cursor_is_rejected(client, fake_db, login, payload):
+    cur = fake_db(auth_routes)
+    response = client.get(f"/auth/admin/users?cursor={encode_cursor(payload)}", headers=login("admin"))
+    assert response.status_code == 400
+    assert cur.statements == []
+
+
+def test_users_total_is_estimated_unless_exact_requested(client, fake_db, login, monkeypatch):
+    calls = []
+    monkeypatch.setattr(auth_routes, "count_rows",
+                        lambda cur, sql, params, exact_limit=None: calls.append(exact_limit) or (1, True))
+    fake_db(auth_routes, [])
+    client.get("/auth/admin/users?limit=5", headers=login("admin"))
+    fake_db(auth_routes, [])
+    client.get("/auth/admin/users?limit=5&count=exact", headers=login("admin"))
+    assert calls == [None, auth_routes.USERS_EXACT_COUNT_LIMIT]
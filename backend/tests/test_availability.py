@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+
+from utils import availability as availability_module
+from utils.availability import AvailabilityIndex, BloomFilter, FIELDS
+
+
+@pytest.fixture
+def stamps(monkeypatch):
+    """The "signups" stamp other workers would move; starts at 1"""
+    stamp = {"signups": 1}
+    monkeypatch.setattr(availability_module, "current", lambda tables: [stamp["signups"]])
+    monkeypatch.setattr(availability_module, "bump", lambda *tables: None)
+    return stamp
+
+
+@pytest.fixture
+def index(stamps):
+    index = AvailabilityIndex(capacity=1000, fp_rate=0.01)
+    index._filters = {field: BloomFilter(1000, 0.01) for field in FIELDS}
+    index._stamp = 1
+    index.add_many([("Taken@Example.com", "taken")])
+    return index
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f"user{i}@example.com")
+
+    assert all(f"user{i}@example.com" in bloom for i in range(1000))
+    false_positives = sum(f"other{i}@example.com" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_values_outside_the_filter_never_reach_the_database(index, fake_db):
+    cur = fake_db(availability_module)
+    assert index.check("email", ["free@example.com"]) == {"free@example.com": False}
+    assert cur.statements == []
+
+
+def test_possible_hits_are_confirmed_by_the_database(index, fake_db):
+    cur = fake_db(availability_module, [("Taken@Example.com",)])
+    assert index.check("email", [" taken@example.com", "Taken@Example.com"]) == {
+        " taken@example.com": False, "Taken@Example.com": True
+    }
+    assert cur.statements[0][0] == "SELECT email FROM users WHERE email = ANY(%s)"
+    assert index.stats()["false_positives_total"] == 1
+
+
+def test_before_the_filters_are_built_every_check_asks_the_database(stamps, fake_db):
+    index = AvailabilityIndex(capacity=1000)
+    cur = fake_db(availability_module, [])
+    assert index.check("username", ["anyone"]) == {"anyone": False}
+    assert cur.statements[0][1] == (["anyone"],)
+
+
+def test_signups_in_other_workers_are_synced_before_checking(index, stamps, fake_db):
+    stamps["signups"] = 2
+    index._synced_at = datetime(2026, 1, 1)
+    cur = fake_db(availability_module, [(datetime(2026, 1, 2),)], [("new@example.com", "newcomer")], [("newcomer",)])
+
+    assert index.check("username", ["newcomer"]) == {"newcomer": True}
+    assert "created_at >= %s" in cur.statements[1][0]
+    assert index._stamp == 2
+
+
+def test_unknown_field_is_rejected(index):
+    with pytest.raises(ValueError):
+        index.check("password_hash", ["x"])
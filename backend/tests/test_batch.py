@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from utils import batch
+
+GONE_ID = "00000000-0000-0000-0000-0000000000b1"
+LIVE_ID = "00000000-0000-0000-0000-0000000000b2"
+
+
+@pytest.fixture
+def released(monkeypatch):
+    """URLs handed to release(), one list per chunk"""
+    calls = []
+
+    def release(cur, urls):
+        calls.append(urls)
+        return []
+    monkeypatch.setattr(batch, "release", release)
+    monkeypatch.setattr(batch, "remove_objects", lambda paths: None)
+    return calls
+
+
+def test_delete_reports_not_found_and_releases_only_deleted_rows(client, login, fake_db, released):
+    cur = fake_db(batch, [(True,)], [(LIVE_ID, "https://cdn/live.jpg", None)], [(True,)])
+    response = client.post("/api/posts/batch", json={"action": "delete", "ids": [GONE_ID, LIVE_ID]},
+                           headers=login("admin"))
+
+    assert response.status_code == 200
+    assert response.get_json() == {"action": "delete", "requested": 2, "deleted": 1, "not_found": [GONE_ID]}
+    assert released == [["https://cdn/live.jpg", None]]
+    assert "pg_advisory_unlock" in cur.statements[-1][0]
+
+
+def test_overlapping_delete_on_same_table_gets_409(client, login, fake_db, released):
+    cur = fake_db(batch, [(False,)])
+    response = client.post("/api/ads/batch", json={"action": "delete", "ids": [LIVE_ID]},
+                           headers=login("admin"))
+
+    assert response.status_code == 409
+    assert released == []
+    assert len(cur.statements) == 1  # nothing deleted, nothing to unlock
+
+
+def test_streamed_delete_reports_failure_without_details(client, login, fake_db, released):
+    fake_db(batch, [(True,)], RuntimeError("relation posts: password=hunter2"), [(True,)])
+    response = client.post("/api/posts/batch", json={"action": "delete", "ids": [LIVE_ID]},
+                           headers={**login("admin"), "Accept": "application/x-ndjson"})
+
+    assert response.status_code == 500
+    assert "hunter2" not in response.get_data(as_text=True)
+
+
+def test_streamed_delete_yields_progress_lines(client, login, fake_db, released):
+    fake_db(batch, [(True,)], [(LIVE_ID, "https://cdn/live.jpg", None)], [(True,)])
+    response = client.post("/api/posts/batch", json={"action": "delete", "ids": [LIVE_ID]},
+                           headers={**login("admin"), "Accept": "application/x-ndjson"})
+
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert events[0] == {"deleted": 1, "chunks": 1, "objects_removed": 0}
+    assert events[-1]["done"] is True and events[-1]["not_found"] == []
@@ -0,0 +1,113 @@
+import atexit
+import threading
+import time
+
+import pytest
+
+from utils import counters
+from utils.counters import CounterAggregator
+
+POST_ID = "00000000-0000-0000-0000-0000000000c1"
+
+
+class Database:
+    """Stands in for the pool; records which thread flushed and can fail"""
+
+    def __init__(self):
+        self.fail = False
+        self.flush_threads = []
+        self.batches = []
+        self.flushed = threading.Event()
+
+    def connection(self):
+        if self.fail:
+            raise ConnectionError("database is down")
+        self.flush_threads.append(threading.current_thread().name)
+        return self
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        self.flushed.set()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def database(monkeypatch):
+    db = Database()
+    monkeypatch.setattr(counters, "get_unscoped_connection", db.connection)
+    monkeypatch.setattr(counters, "return_db_connection", lambda conn: None)
+    monkeypatch.setattr(counters, "bump", lambda table: None)
+    monkeypatch.setattr(counters, "execute_values", lambda cur, sql, rows, **kwargs: db.batches.append(rows))
+    return db
+
+
+@pytest.fixture
+def aggregator():
+    created = []
+
+    def make(**kwargs):
+        created.append(CounterAggregator(shards=1, **kwargs))
+        return created[-1]
+    yield make
+    for instance in created:
+        # Stop the flusher without the exit-time flush, which would use the real pool
+        atexit.unregister(instance.stop)
+        instance._stopped.set()
+        instance._wake.set()
+        if instance._thread is not None:
+            instance._thread.join(2)
+
+
+def test_increments_are_flushed_by_the_background_thread(database, aggregator):
+    counter = aggregator(flush_interval=0, flush_threshold=1000, max_pending=1000)
+    assert counter.increment(POST_ID, "views_count") == 1
+    assert database.flushed.wait(2)
+    assert database.flush_threads == ["counter-flusher"]
+    assert database.batches == [[(POST_ID, 1, 0, 0)]]
+
+
+def test_threshold_wakes_flusher_instead_of_flushing_inline(database, aggregator):
+    counter = aggregator(flush_interval=60, flush_threshold=3, max_pending=3)
+    for _ in range(5):
+        counter.increment(POST_ID, "likes_count")
+    assert database.flushed.wait(2)
+    assert "MainThread" not in database.flush_threads
+
+
+def test_failed_flush_keeps_counts_and_backs_off(database, aggregator):
+    counter = aggregator(flush_interval=60, flush_threshold=1000, max_pending=1000)
+    counter.increment(POST_ID, "views_count", 3)
+    database.fail = True
+    assert counter.flush() == 0
+    assert counter._backing_off()
+    assert counter.pending(POST_ID)["views_count"] == 3
+
+    database.fail = False
+    counter._retry_at = time.monotonic() - 1
+    assert counter.flush() == 1
+    assert database.batches == [[(POST_ID, 3, 0, 0)]]
+    assert counter.pending(POST_ID)["views_count"] == 0
+
+
+def test_pending_increments_are_capped_during_an_outage(database, aggregator):
+    counter = aggregator(flush_interval=60, flush_threshold=1000, max_pending=4)
+    database.fail = True
+    for i in range(10):
+        counter.increment(f"post-{i}", "views_count")
+    assert counter.dropped == 6
+    counter.flush()
+    # The kept posts count once each after the failed flush
+    for i in range(10, 20):
+        counter.increment(f"post-{i}", "views_count")
+    assert sum(len(shard.deltas) for shard in counter._shards) == 4
+    assert counter.dropped == 16
+    assert database.batches == []
+
+
+def test_unknown_counter_is_rejected(aggregator):
+    with pytest.raises(ValueError):
+        aggregator().increment(POST_ID, "clicks_count")
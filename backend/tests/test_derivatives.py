@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from utils import derivatives
+
+FIRST_ID = "00000000-0000-0000-0000-0000000000e1"
+SECOND_ID = "00000000-0000-0000-0000-0000000000e2"
+
+
+def test_backfill_pages_past_posts_without_created_at(fake_db, monkeypatch):
+    monkeypatch.setattr(derivatives, "Image", object())
+    done = []
+    monkeypatch.setattr(derivatives, "_run", lambda post_id, path: done.append(post_id))
+    monkeypatch.setattr(derivatives, "source_path", lambda *row: "image/a.jpg")
+    cur = fake_db(
+        derivatives,
+        [(FIRST_ID, None, "image", "u", None)],
+        [(SECOND_ID, datetime(2024, 1, 1), "image", "u", None)],
+        []
+    )
+
+    assert derivatives.backfill(batch_size=1) == 2
+    assert done == [FIRST_ID, SECOND_ID]
+    second_sql, second_params = cur.statements[1]
+    assert "((created_at IS NULL AND id < %s) OR created_at IS NOT NULL)" in second_sql
+    assert second_params == (FIRST_ID, 1)
+    third_sql, third_params = cur.statements[2]
+    assert "(created_at, id) < (%s, %s)" in third_sql
+    assert third_params == (datetime(2024, 1, 1), SECOND_ID, 1)
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import pytest
+
+from routes import feed
+from utils.helpers import encode_cursor, decode_cursor
+
+FIRST_ID = "00000000-0000-0000-0000-00000000000a"
+SECOND_ID = "00000000-0000-0000-0000-00000000000b"
+
+
+def post_row(post_id, created_at):
+    return (post_id, "t", "c", "image", "u", None, None, created_at, 0, 0, 0, "post")
+
+
+@pytest.fixture(autouse=True)
+def no_side_effects(monkeypatch):
+    monkeypatch.setattr(feed.ad_inventory, "active_ads", lambda: [])
+    monkeypatch.setattr(feed, "attach_srcsets", lambda cur, posts: None)
+    monkeypatch.setattr(feed.post_counters, "increment", lambda *args: None)
+    monkeypatch.setattr(feed.post_counters, "pending", lambda post_id: {})
+
+
+def test_cursor_after_null_created_at_continues_past_it(client, fake_db):
+    # Page one ends on a post without created_at
+    cur = fake_db(feed, [post_row(FIRST_ID, None), post_row(SECOND_ID, None)])
+    body = client.get("/api/feed?cursor=&limit=1").get_json()
+    cursor = decode_cursor(body["next_cursor"])
+    assert cursor["t"] is None and cursor["i"] == FIRST_ID
+
+    cur = fake_db(feed, [post_row(SECOND_ID, datetime(2024, 1, 1))])
+    body = client.get(f"/api/feed?cursor={body['next_cursor']}&limit=1").get_json()
+    sql, params = cur.statements[0]
+    assert "created_at IS NULL AND id < %s" in sql
+    assert params == (FIRST_ID, 2)
+    assert [item["id"] for item in body["feed"]] == [SECOND_ID]
+
+
+def test_cursor_after_dated_post_seeks_on_created_at(client, fake_db):
+    stamp = datetime(2024, 1, 2, 3, 4, 5)
+    cursor = encode_cursor({"p": 1, "a": 0, "t": stamp, "i": FIRST_ID})
+    cur = fake_db(feed, [])
+    assert client.get(f"/api/feed?cursor={cursor}&limit=1").status_code == 200
+    sql, params = cur.statements[0]
+    assert "created_at <= %s AND (created_at, id) < (%s, %s)" in sql
+    assert params == (stamp, stamp, FIRST_ID, 2)
+
+
+@pytest.mark.parametrize("payload", [
+    {"p": 1, "a": 0, "t": "2024-01-01T00:00:00", "i": None},
+    {"p": 1, "a": 0, "t": "not a time", "i": FIRST_ID},
+    {"p": 1, "a": 0, "t": None, "i": "nope"},
+    {"p": "1", "a": 0},
+    {"p": None, "a": 0},
+    {"p": 1, "a": 2},
+])
+def test_malformed_cursor_is_rejected(client, fake_db, payload):
+    cur = fake_db(feed)
+    response = client.get(f"/api/feed?cursor={encode_cursor(payload)}")
+    assert response.status_code == 400
+    assert cur.statements == []
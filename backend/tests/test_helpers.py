@@ -0,0 +1,88 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import FakeCursor
+from utils.helpers import (
+    encode_cursor, decode_cursor, cursor_id, cursor_timestamp, seek_clause, count_rows, exact_count_requested
+)
+
+ROW_ID = "3f1c3c52-8d6c-4a55-9a4c-2a4f5b8f9e10"
+
+
+def test_cursor_round_trip_keeps_null_keys():
+    payload = decode_cursor(encode_cursor({"k": None, "i": ROW_ID}))
+    assert payload == {"k": None, "i": ROW_ID}
+    assert cursor_timestamp(payload["k"]) is None
+
+
+def test_cursor_timestamp_parses_encoded_datetime():
+    stamp = datetime(2024, 5, 1, 12, 30)
+    assert cursor_timestamp(decode_cursor(encode_cursor({"t": stamp}))["t"]) == stamp
+
+
+@pytest.mark.parametrize("value", [12, ["2024-01-01"], "yesterday"])
+def test_cursor_timestamp_rejects_tampered_values(value):
+    with pytest.raises(ValueError):
+        cursor_timestamp(value)
+
+
+@pytest.mark.parametrize("value", [None, 7, "not-a-uuid"])
+def test_cursor_id_rejects_tampered_values(value):
+    with pytest.raises(ValueError):
+        cursor_id(value)
+
+
+@pytest.mark.parametrize("cursor", ["%%%", "bm90IGpzb24", encode_cursor([1, 2])])
+def test_decode_cursor_rejects_garbage(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_seek_clause_desc_after_value_skips_null_group():
+    # NULLs sort first under DESC, so they are all behind a non-NULL key
+    assert seek_clause("created_at", "DESC", True, "2024-01-01", ROW_ID) == (
+        "(created_at, id) < (%s, %s)", ["2024-01-01", ROW_ID]
+    )
+
+
+def test_seek_clause_desc_inside_null_group():
+    sql, params = seek_clause("created_at", "DESC", True, None, ROW_ID)
+    assert sql == "((created_at IS NULL AND id < %s) OR created_at IS NOT NULL)"
+    assert params == [ROW_ID]
+
+
+def test_seek_clause_asc_keeps_trailing_nulls():
+    sql, params = seek_clause("created_at", "ASC", True, "2024-01-01", ROW_ID)
+    assert sql == "((created_at, id) > (%s, %s) OR created_at IS NULL)"
+    assert seek_clause("created_at", "ASC", True, None, ROW_ID) == ("(created_at IS NULL AND id > %s)", [ROW_ID])
+
+
+def test_seek_clause_non_nullable():
+    assert seek_clause("COALESCE(views_count, 0)", "DESC", False, 5, ROW_ID) == (
+        "(COALESCE(views_count, 0), id) < (%s, %s)", [5, ROW_ID]
+    )
+
+
+def plan(rows):
+    return [{"Plan": {"Plan Rows": rows}}]
+
+
+def test_count_rows_returns_the_estimate_by_default():
+    cur = FakeCursor([[(plan(12),)]])
+    assert count_rows(cur, "FROM posts") == (12, True)
+    assert len(cur.statements) == 1
+
+
+def test_count_rows_counts_exactly_only_when_asked_and_small():
+    cur = FakeCursor([[(plan(12),)], [(11,)]])
+    assert count_rows(cur, "FROM posts", exact_limit=100) == (11, False)
+    cur = FakeCursor([[(plan(500),)]])
+    assert count_rows(cur, "FROM posts", exact_limit=100) == (500, True)
+
+
+def test_exact_count_requested():
+    assert exact_count_requested({}) is False
+    assert exact_count_requested({"count": "exact"}) is True
+    with pytest.raises(ValueError):
+        exact_count_requested({"count": "all"})
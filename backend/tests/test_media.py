@@ -0,0 +1,107 @@
+import hashlib
+
+import pytest
+
+from routes import media
+from utils import media_objects, storage as storage_module
+from utils.storage import LocalStorage, sign
+
+
+@pytest.fixture
+def bucket(tmp_path, monkeypatch):
+    local = LocalStorage(root=str(tmp_path))
+    for module in (media, media_objects, storage_module):
+        monkeypatch.setattr(module, "storage", local)
+    return local
+
+
+@pytest.fixture
+def rows(monkeypatch):
+    """Stub the database calls finalize makes; records what they were given"""
+    calls = {"claimed": [], "registered": [], "posts": [], "referenced": []}
+    monkeypatch.setattr(media, "claim_ticket", lambda ticket: calls["claimed"].append(ticket["jti"]) or True)
+    monkeypatch.setattr(media, "release_ticket", lambda ticket: None)
+    monkeypatch.setattr(media, "schedule_derivatives", lambda *args: None)
+    monkeypatch.setattr(media, "reference", lambda url: calls["referenced"].append(url) or True)
+
+    def register(path, url, sha256, size, content_type):
+        calls["registered"].append((path, sha256, size))
+        return url
+
+    def create_post(title, content, media_type, media_url, thumbnail_url, created_by):
+        calls["posts"].append((media_url, thumbnail_url))
+        return "post-id", "now"
+
+    monkeypatch.setattr(media, "register", register)
+    monkeypatch.setattr(media, "create_post", create_post)
+    return calls
+
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+
+
+def ticket_for(path, data, **claims):
+    return sign({
+        "purpose": "media-upload", "jti": "j-1", "sub": USER_ID, "kind": "post", "path": path,
+        "size": len(data), "content_type": "image/png", "media_type": "image", **claims
+    }, 600)
+
+
+def test_direct_upload_is_hashed_and_registered(client, bucket, rows, login):
+    data = b"\x89PNG fake image"
+    bucket.upload("image/a.png", data, "image/png")
+    response = client.post("/api/media/finalize", json={"ticket": ticket_for("image/a.png", data), "title": "t"},
+                           headers=login("admin"))
+    assert response.status_code == 201
+    assert rows["registered"] == [("image/a.png", hashlib.sha256(data).hexdigest(), len(data))]
+
+
+def test_declared_sha256_must_match_the_upload(client, bucket, rows, login):
+    data = b"\x89PNG fake image"
+    bucket.upload("image/a.png", data, "image/png")
+    ticket = ticket_for("image/a.png", data, sha256="0" * 64)
+    response = client.post("/api/media/finalize", json={"ticket": ticket, "title": "t"}, headers=login("admin"))
+    assert response.status_code == 422
+    assert rows["registered"] == []
+    assert bucket.stat("image/a.png") is None
+
+
+def test_thumbnail_must_be_an_object_in_the_bucket(client, bucket, rows, login):
+    data = b"\x89PNG fake image"
+    bucket.upload("image/a.png", data, "image/png")
+    response = client.post("/api/media/finalize", json={
+        "ticket": ticket_for("image/a.png", data), "title": "t",
+        "thumbnail_url": "https://evil.example/media/image/a.png"
+    }, headers=login("admin"))
+    # The URL names one of this bucket's keys on another host; the post
+    # gets the bucket's own URL for that key, never the client's
+    assert response.status_code == 201
+    assert rows["posts"][0][1] == bucket.public_url("image/a.png")
+
+    response = client.post("/api/media/finalize", json={
+        "ticket": ticket_for("image/a.png", data), "title": "t",
+        "thumbnail_url": "https://evil.example/pixel.png"
+    }, headers=login("admin"))
+    assert response.status_code == 400
+    assert rows["claimed"] == ["j-1"]
+
+
+def test_stored_thumbnail_is_referenced(client, bucket, rows, login):
+    data = b"\x89PNG fake image"
+    bucket.upload("image/a.png", data, "image/png")
+    bucket.upload("video/thumb.jpg", b"jpeg", "image/jpeg")
+    thumbnail_url = bucket.public_url("video/thumb.jpg")
+    response = client.post("/api/media/finalize", json={
+        "ticket": ticket_for("image/a.png", data), "title": "t", "thumbnail_url": thumbnail_url
+    }, headers=login("admin"))
+    assert response.status_code == 201
+    assert rows["referenced"] == [thumbnail_url]
+    assert rows["posts"][0][1] == thumbnail_url
+
+
+def test_ad_uploads_use_the_ad_folder(client, bucket, login):
+    response = client.post("/api/media/upload-url", json={
+        "kind": "ad", "filename": "banner.png", "content_type": "image/png", "size": 10
+    }, headers=login("admin"))
+    assert response.status_code == 201
+    assert response.get_json()["path"].startswith("ad/")
@@ -0,0 +1,37 @@
+import pytest
+
+from routes import post
+from utils.helpers import encode_cursor, decode_cursor
+
+FIRST_ID = "00000000-0000-0000-0000-00000000000a"
+
+
+def page_row(post_id, created_at):
+    return (post_id, "t", "c", "image", "u", None, None, created_at, True, 0, 0, 0, None)
+
+
+@pytest.fixture(autouse=True)
+def no_side_effects(monkeypatch):
+    monkeypatch.setattr(post, "attach_srcsets", lambda cur, posts: None)
+    monkeypatch.setattr(post, "count_rows", lambda *args, **kwargs: (2, True))
+
+
+def test_newest_cursor_after_null_created_at(client, fake_db):
+    fake_db(post, [page_row(FIRST_ID, None), page_row(FIRST_ID, None)])
+    body = client.get("/api/posts?limit=1").get_json()
+    cursor = decode_cursor(body["next_cursor"])
+    assert cursor["k"] is None
+
+    cur = fake_db(post, [])
+    assert client.get(f"/api/posts?limit=1&cursor={body['next_cursor']}").status_code == 200
+    sql, params = cur.statements[0]
+    assert "((created_at IS NULL AND id < %s) OR created_at IS NOT NULL)" in sql
+    assert FIRST_ID in params
+
+
+@pytest.mark.parametrize("sort, key", [("newest", 5), ("newest", "soon"), ("most-viewed", "5"), ("most-viewed", None)])
+def test_tampered_cursor_key_is_rejected(client, fake_db, sort, key):
+    cur = fake_db(post)
+    cursor = encode_cursor({"s": sort, "k": key, "i": FIRST_ID})
+    assert client.get(f"/api/posts?sort={sort}&cursor={cursor}").status_code == 400
+    assert cur.statements == []
@@ -0,0 +1,64 @@
+import pytest
+
+from utils import db, query_trace
+from utils.query_trace import QueryStats, fingerprint, scrub_plan
+
+
+class MogrifyCursor:
+    name = None
+    rowcount = 1
+
+    def mogrify(self, query, vars):
+        return (query % tuple(f"'{value}'" for value in vars)).encode()
+
+
+def test_fingerprint_ignores_values():
+    a = fingerprint("SELECT * FROM users WHERE email = 'a@b.c' AND id IN (1, 2, 3)")
+    b = fingerprint("SELECT * FROM users WHERE email = %s AND id IN (%s)")
+    assert a == b
+    assert "a@b.c" not in a[1]
+
+
+def test_scrub_plan_drops_literals_and_keeps_measurements():
+    plan = [{"Plan": {"Node Type": "Index Scan", "Index Name": "users_email_key",
+                      "Index Cond": "(email = 'secret@example.com'::text)",
+                      "Filter": "(login_count > 42)", "Total Cost": 8.27, "Actual Rows": 1}}]
+    node = scrub_plan(plan)[0]["Plan"]
+
+    assert node["Index Cond"] == "(email = ?::text)"
+    assert node["Filter"] == "(login_count > ?)"
+    assert (node["Index Name"], node["Total Cost"], node["Actual Rows"]) == ("users_email_key", 8.27, 1)
+
+
+def test_explain_stores_scrubbed_plan_and_error_class(fake_db):
+    stats = QueryStats()
+    fake_db(db, [], [([{"Plan": {"Node Type": "Seq Scan", "Filter": "(token = 'abc123'::text)"}}],)])
+    captured = stats._explain(b"SELECT * FROM sessions WHERE token = 'abc123'")
+    assert captured["analyze"] is True
+    assert "abc123" not in str(captured["plan"])
+
+    fake_db(db, [], RuntimeError('invalid input syntax for type uuid: "hunter2"'))
+    captured = stats._explain(b"SELECT * FROM posts WHERE id = 'hunter2'")
+    assert captured["error"] == "RuntimeError"
+
+
+def test_one_capture_per_fingerprint_per_interval(monkeypatch):
+    stats = QueryStats()
+    monkeypatch.setattr(query_trace.random, "random", lambda: 0.0)
+    monkeypatch.setattr(query_trace, "SLOW_QUERY_EXPLAIN_SAMPLE", 1.0)
+    monkeypatch.setattr(stats, "_start_explainer", lambda: None)
+    query = "SELECT * FROM users WHERE email = %s"
+    fp, text = fingerprint(query)
+
+    for email in ("a@b.c", "d@e.f"):
+        stats._slow_query(MogrifyCursor(), fp, text, query, (email,), 900, 1, "GET /x", False)
+    assert len(stats._explain_queue) == 1
+
+
+@pytest.mark.parametrize("query", ["COPY posts TO STDOUT", "SET search_path TO public"])
+def test_unexplainable_statements_are_skipped(monkeypatch, query):
+    stats = QueryStats()
+    monkeypatch.setattr(query_trace, "SLOW_QUERY_EXPLAIN_SAMPLE", 1.0)
+    fp, text = fingerprint(query)
+    stats._slow_query(MogrifyCursor(), fp, text, query, (), 900, 0, "GET /x", False)
+    assert not stats._explain_queue
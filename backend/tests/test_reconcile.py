@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+from routes import post
+from utils import reconcile
+
+OLD = time.time() - 48 * 3600
+
+
+class FakeBucket:
+    def __init__(self, objects):
+        self.objects = objects
+        self.removed = []
+
+    def list_page(self, prefix, limit, offset):
+        listed = [obj for obj in self.objects if obj["path"].startswith(prefix)]
+        return listed[offset:offset + limit]
+
+    def remove(self, paths):
+        self.removed.extend(paths)
+
+    def path_from_url(self, url):
+        return url.split("/bucket/", 1)[1] if "/bucket/" in url else None
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    bucket = FakeBucket([
+        {"path": "image/kept.jpg", "size": 10, "updated_at": OLD},
+        {"path": "image/orphan.jpg", "size": 20, "updated_at": OLD},
+        {"path": "image/fresh.jpg", "size": 30, "updated_at": time.time()},
+        {"path": "image/unknown.jpg", "size": 40, "updated_at": None},
+    ])
+    monkeypatch.setattr(reconcile, "storage", bucket)
+    monkeypatch.setattr(reconcile, "referenced_paths", lambda: {"image/kept.jpg"})
+    monkeypatch.setattr(reconcile, "RECONCILE_LIST_PER_SEC", 0)
+    monkeypatch.setattr(reconcile, "RECONCILE_DELETES_PER_SEC", 0)
+    return bucket
+
+
+def run(**kwargs):
+    *_, done = reconcile.reconcile(prefixes=("image/",), grace_hours=24, **kwargs)
+    return done
+
+
+def test_only_old_unreferenced_objects_are_orphans(bucket):
+    done = run(dry_run=True)
+
+    assert done["prefixes"]["image/"] == {"objects": 4, "referenced": 1, "orphans": 1,
+                                          "orphan_bytes": 20, "in_grace_period": 2}
+    assert [obj["path"] for obj in done["orphans"]] == ["image/orphan.jpg"]
+    assert bucket.removed == []
+
+
+def test_delete_run_removes_orphans(bucket):
+    done = run(dry_run=False)
+
+    assert bucket.removed == ["image/orphan.jpg"]
+    assert (done["deleted"], done["failed"]) == (1, 0)
+
+
+def test_referenced_paths_maps_urls_and_keeps_paths(monkeypatch, fake_db):
+    monkeypatch.setattr(reconcile, "storage", FakeBucket([]))
+    fake_db(reconcile, [("https://cdn/bucket/video/a.mp4",), ("https://elsewhere/x.jpg",)],
+            [("image/a_w320.webp",)])
+
+    assert reconcile.referenced_paths() == {"video/a.mp4", "image/a_w320.webp"}
+
+
+def test_run_started_after_the_check_gets_409(client, login, bucket, monkeypatch):
+    monkeypatch.setattr(post, "reconcile_running", lambda: False)
+    reconcile._run_lock.acquire()
+    try:
+        for accept in ("application/json", "application/x-ndjson"):
+            response = client.post("/api/storage/reconcile", json={},
+                                    headers={**login("admin"), "Accept": accept})
+            assert response.status_code == 409
+    finally:
+        reconcile._run_lock.release()
@@ -0,0 +1,101 @@
+import hashlib
+import io
+
+import pytest
+
+from routes import uploads
+from utils import resumable
+from utils.storage import LocalStorage
+
+UPLOAD_ID = "00000000-0000-0000-0000-0000000000d1"
+
+
+@pytest.fixture
+def bucket(tmp_path, monkeypatch):
+    local = LocalStorage(root=str(tmp_path))
+    monkeypatch.setattr(resumable, "storage", local)
+    return local
+
+
+def spool(data):
+    return resumable.receive_chunk(io.BytesIO(data), len(data))
+
+
+def sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_chunks_round_trip_through_storage(bucket):
+    parts = [b"hello ", b"world"]
+    for index, data in enumerate(parts):
+        with spool(data) as chunk:
+            resumable.store_chunk(UPLOAD_ID, index, chunk)
+    assembled = resumable.assemble(UPLOAD_ID, [(i, sha(data)) for i, data in enumerate(parts)])
+    assert assembled.read() == b"hello world"
+    assembled.close()
+
+    resumable.remove_session_files(UPLOAD_ID)
+    assert bucket.list_page(resumable.session_prefix(UPLOAD_ID), 10, 0) == []
+
+
+def test_assemble_rejects_a_chunk_that_does_not_match_its_digest(bucket):
+    with spool(b"abc") as chunk:
+        key = resumable.store_chunk(UPLOAD_ID, 0, chunk)
+    with open(bucket.path_for(key), "wb") as fh:
+        fh.write(b"xyz")
+    with pytest.raises(ValueError):
+        resumable.assemble(UPLOAD_ID, [(0, sha(b"abc"))])
+
+
+@pytest.fixture
+def chunk_db(fake_db, monkeypatch):
+    monkeypatch.setattr(uploads, "release_request_connection", lambda: None)
+
+    def install(*results):
+        # The session lookup before the body is read
+        return fake_db(uploads, [("open", 10, 5, 2)], *results)
+    return install
+
+
+def put_chunk(client, data, index=0):
+    return client.patch(f"/api/uploads/{UPLOAD_ID}/chunks/{index}", data=data)
+
+
+def stored(bucket, data, index=0):
+    return bucket.stat(resumable.chunk_key(UPLOAD_ID, index, sha(data))) is not None
+
+
+def test_failed_insert_keeps_the_recorded_chunk(client, bucket, chunk_db):
+    with spool(b"old!!") as chunk:
+        resumable.store_chunk(UPLOAD_ID, 0, chunk)
+    chunk_db([("open",)], [(sha(b"old!!"),)], RuntimeError("insert failed"))
+
+    assert put_chunk(client, b"new!!").status_code == 500
+    assert stored(bucket, b"old!!")
+    assert not stored(bucket, b"new!!")
+
+
+def test_replacing_a_chunk_removes_the_old_object_after_commit(client, bucket, chunk_db):
+    with spool(b"old!!") as chunk:
+        resumable.store_chunk(UPLOAD_ID, 0, chunk)
+    session = (UPLOAD_ID, "open", 10, 5, 2, None, None)
+    cur = chunk_db([("open",)], [(sha(b"old!!"),)], [], [], [session], [(0,)])
+
+    response = put_chunk(client, b"new!!")
+    assert response.status_code == 200
+    assert response.get_json()["sha256"] == sha(b"new!!")
+    assert stored(bucket, b"new!!")
+    assert not stored(bucket, b"old!!")
+    assert any(sql.startswith("INSERT INTO upload_chunks") for sql, _ in cur.statements)
+
+
+def test_chunk_for_a_session_being_finalized_is_discarded(client, bucket, chunk_db):
+    chunk_db([("finalizing",)], [])
+    assert put_chunk(client, b"new!!").status_code == 409
+    assert not stored(bucket, b"new!!")
+
+
+def test_wrong_size_chunk_is_not_stored(client, bucket, chunk_db):
+    chunk_db()
+    assert put_chunk(client, b"four").status_code == 400
+    assert bucket.list_page(resumable.session_prefix(UPLOAD_ID), 10, 0) == []
@@ -0,0 +1,70 @@
+import pytest
+
+from conftest import FakeCursor
+from utils import user_import
+from utils.user_import import ImportBusy, ImportRejected, load_batch, read_rows, run_import, validate
+
+NEW_ID = "00000000-0000-0000-0000-0000000000c1"
+
+
+class CopyCursor(FakeCursor):
+    def copy_expert(self, sql, file):
+        self.statements.append((sql, file.getvalue()))
+
+
+def row(line, email, username):
+    return {"line": line, "full_name": "Name", "username": username, "email": email,
+            "password_hash": "$2b$04$x", "role": "customer"}
+
+
+def test_load_batch_maps_each_row_to_created_or_its_conflict():
+    cur = CopyCursor([[
+        (1, False, False, NEW_ID),
+        (2, True, False, None),
+        (3, False, True, None),
+        (4, False, False, None),
+    ]])
+    results = load_batch(cur, [row(1, "a@x.io", "a"), row(2, "b@x.io", "b"),
+                               row(3, "c@x.io", "c"), row(4, "d@x.io", "d")])
+
+    assert results == {
+        1: ("created", NEW_ID),
+        2: ("conflict", "Email already exists"),
+        3: ("conflict", "Username already exists"),
+        4: ("conflict", "Email or username already exists"),
+    }
+    assert "2,Name,b,b@x.io" in cur.statements[0][1]
+
+
+def test_validate_rejects_bad_rows_and_in_file_duplicates():
+    emails, usernames = set(), set()
+    record = {"full_name": "A", "email": "a@x.io", "username": "a", "password": "pw"}
+
+    assert validate(record, emails, usernames)["role"] == "customer"
+    assert validate(record, emails, usernames) == "Duplicate email in import"
+    assert validate({**record, "email": "b@x.io"}, emails, usernames) == "Duplicate username in import"
+    assert validate({**record, "role": "owner"}, set(), set()) == "role must be one of customer, admin"
+    assert validate({**record, "password": "", "password_hash": "md5"}, set(), set()) == \
+        "password_hash must be a bcrypt hash"
+    assert validate({**record, "email": "nope"}, set(), set()) == "Invalid email"
+
+
+def test_read_rows_reports_unparseable_lines_and_rejects_bad_headers():
+    lines = [b'{"email": "a@x.io"}\n', b"not json\n", b"[1]\n"]
+    parsed = list(read_rows(lines, "ndjson"))
+    assert parsed[0] == (1, {"email": "a@x.io"})
+    assert parsed[1][1].startswith("Invalid JSON")
+    assert parsed[2] == (3, "Each line must be a JSON object")
+
+    with pytest.raises(ImportRejected):
+        list(read_rows([b"email,username\n"], "csv"))
+
+
+def test_only_one_import_runs_at_a_time():
+    reports, release = run_import([b'{"email": "a@x.io"}\n'], "ndjson")
+    try:
+        with pytest.raises(ImportBusy):
+            run_import([], "ndjson")
+    finally:
+        release()
+    assert not user_import._import_lock.locked()
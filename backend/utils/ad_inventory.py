@@ -0,0 +1,197 @@
+"""
+In-memory advertisement inventory with a time index over ad schedules
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+from utils.db import get_db_connection, return_db_connection
+from utils.versions import current
+
+logger = logging.getLogger("ads")
+
+# Upper bound on how long a worker trusts its copy of the table; writes
+# made by other workers are picked up sooner through the "ads" version stamp
+AD_INVENTORY_TTL = int(os.getenv("AD_INVENTORY_TTL", 60))
+# Seconds to keep serving the old snapshot after a failed reload
+AD_INVENTORY_RETRY = int(os.getenv("AD_INVENTORY_RETRY", 5))
+# Seconds between reads of the "ads" version stamp (a file or Redis read)
+AD_INVENTORY_STAMP_INTERVAL = float(os.getenv("AD_INVENTORY_STAMP_INTERVAL", 1))
+
+AD_TYPES = ("banner", "in_stream")
+
+# Timestamps are stored with microsecond precision, so an ad whose window
+# ends at `end_date` (inclusive) stops being active one microsecond later
+_END_RESOLUTION = timedelta(microseconds=1)
+
+
+class _Snapshot:
+    """Immutable view of the table: every ad plus the ads live in each schedule segment.
+
+    `boundaries` holds every instant at which some switched-on ad starts or
+    stops being active, so the ads live at time t are the same for every t
+    between two of them. `segments[i]` maps each ad type (and None for all
+    types) to the ads live from boundaries[i - 1] up to boundaries[i],
+    newest first. The table is built once here, so a lookup is one bisect.
+    """
+
+    def __init__(self, ads, loaded_at):
+        self.ads = ads
+        self.loaded_at = loaded_at
+
+        starts, ends = {}, {}
+        active = set()
+        for position, ad in enumerate(ads):
+            if ad["is_active"] is False:
+                continue
+            start = ad["start_date"]
+            end = ad["end_date"] + _END_RESOLUTION if ad["end_date"] is not None else None
+            if start is not None and end is not None and end <= start:
+                continue  # a window that ends before it starts is never live
+            if start is None:
+                active.add(position)
+            else:
+                starts.setdefault(start, []).append(position)
+            if end is not None:
+                ends.setdefault(end, []).append(position)
+        self.boundaries = sorted(starts.keys() | ends.keys())
+
+        # Sweep the boundaries once, applying the starts and ends at each
+        self.segments = [self._by_type(active)]
+        for boundary in self.boundaries:
+            active.update(starts.get(boundary, ()))
+            active.difference_update(ends.get(boundary, ()))
+            self.segments.append(self._by_type(active))
+
+    def _by_type(self, positions):
+        live = tuple(self.ads[position] for position in sorted(positions))
+        by_type = {None: live}
+        for ad_type in AD_TYPES:
+            by_type[ad_type] = tuple(ad for ad in live if ad["ad_type"] == ad_type)
+        return by_type
+
+    def active_at(self, moment, ad_type=None):
+        return self.segments[bisect_right(self.boundaries, moment)].get(ad_type, ())
+
+    def next_boundary(self, moment):
+        index = bisect_right(self.boundaries, moment)
+        return self.boundaries[index] if index < len(self.boundaries) else None
+
+
+class AdInventory:
+    """Loads the advertisements table once and answers schedule queries from memory.
+
+    The snapshot is rebuilt lazily on the first query after `invalidate()`
+    or a change of the "ads" version stamp (checked at most once every
+    AD_INVENTORY_STAMP_INTERVAL seconds, not on every query), after the TTL, or once the clock
+    passes the next schedule boundary. If a rebuild fails the previous
+    snapshot keeps being served.
+    """
+
+    def __init__(self, ttl=AD_INVENTORY_TTL):
+        self.ttl = ttl
+        self._snapshot = None
+        self._expires_at = None
+        self._stamp = None
+        self._lock = threading.Lock()
+        self._checked_stamp = None
+        self._stamp_checked_at = None
+
+    def invalidate(self):
+        """Drop the loaded snapshot so the next query reloads from the database"""
+        self._expires_at = None
+        self._stamp_checked_at = None
+
+    def _current_stamp(self):
+        """The "ads" stamp, read at most once every AD_INVENTORY_STAMP_INTERVAL"""
+        now = time.monotonic()
+        checked_at = self._stamp_checked_at
+        if checked_at is None or now - checked_at >= AD_INVENTORY_STAMP_INTERVAL:
+            self._checked_stamp = current(("ads",))
+            self._stamp_checked_at = now
+        return self._checked_stamp
+
+    def _load(self):
+        conn = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id, title, media_type, media_url, ad_type,
+                       is_active, start_date, end_date, created_at
+                FROM advertisements
+                ORDER BY created_at DESC
+            """)
+            rows = cur.fetchall()
+            cur.close()
+        finally:
+            if conn:
+                return_db_connection(conn)
+
+        ads = [{
+            "id": str(row[0]),
+            "title": row[1],
+            "media_type": row[2],
+            "media_url": row[3],
+            "ad_type": row[4],
+            "is_active": row[5],
+            "start_date": row[6],
+            "end_date": row[7],
+            "created_at": row[8]
+        } for row in rows]
+        return _Snapshot(ads, datetime.now())
+
+    def _is_current(self, now, stamp):
+        return (self._snapshot is not None and self._expires_at is not None
+                and now < self._expires_at and stamp == self._stamp)
+
+    def snapshot(self):
+        now = datetime.now()
+        stamp = self._current_stamp()
+        if self._is_current(now, stamp):
+            return self._snapshot
+
+        with self._lock:
+            # Another thread may have reloaded while we waited for the lock
+            if self._is_current(now, stamp):
+                return self._snapshot
+
+            try:
+                snapshot = self._load()
+            except Exception as e:
+                if self._snapshot is None:
+                    raise
+                logger.warning("Ad inventory reload failed, serving previous snapshot: %s", e)
+                self._expires_at = now + timedelta(seconds=AD_INVENTORY_RETRY)
+                self._stamp = stamp
+                return self._snapshot
+
+            expires_at = snapshot.loaded_at + timedelta(seconds=self.ttl)
+            boundary = snapshot.next_boundary(snapshot.loaded_at)
+            if boundary is not None and boundary < expires_at:
+                expires_at = boundary
+
+            self._snapshot = snapshot
+            self._expires_at = expires_at
+            self._stamp = stamp
+            return snapshot
+
+    def active_ads(self, ad_type=None, at=None):
+        """Ads that are switched on and scheduled at `at` (default now), newest first"""
+        snapshot = self.snapshot()
+        return list(snapshot.active_at(at or datetime.now(), ad_type))
+
+    def list_ads(self, is_active=None, ad_type=None):
+        """All ads, optionally filtered on the is_active flag and ad type, newest first"""
+        ads = self.snapshot().ads
+        if is_active is not None:
+            ads = [ad for ad in ads if ad["is_active"] == is_active]
+        if ad_type:
+            ads = [ad for ad in ads if ad["ad_type"] == ad_type]
+        return list(ads)
+
+
+ad_inventory = AdInventory()
@@ -0,0 +1,190 @@
+"""
+Signed access/refresh tokens and the decorator that protects routes.
+
+Tokens are HS256 JWTs signed with JWT_SECRET_KEY, a secret of their own
+(upload tickets use UPLOAD_SECRET_KEY), so checking one needs no database
+round trip. The role and active flag are deliberately not
+trusted from the token: they are looked up per user and kept in a small
+in-process TTL cache, so a role change or deactivation applies within
+AUTH_CLAIMS_TTL seconds at most. Deactivation is immediate: it bumps the
+"users" version stamp, which every worker checks before using a cached entry.
+"""
+import logging
+import os
+import threading
+import time
+from functools import wraps
+
+import jwt
+from flask import g, jsonify, request
+
+from utils.db import get_db_connection, return_db_connection
+from utils.storage import upload_secret
+from utils.versions import bump, current
+
+logger = logging.getLogger("auth")
+
+# Seconds an access token is valid; clients renew it with the refresh token
+ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL", 900))
+REFRESH_TOKEN_TTL = int(os.getenv("REFRESH_TOKEN_TTL", 14 * 24 * 3600))
+# Seconds a user's role and active flag are cached per worker
+AUTH_CLAIMS_TTL = float(os.getenv("AUTH_CLAIMS_TTL", 30))
+AUTH_CLAIMS_MAX_ENTRIES = int(os.getenv("AUTH_CLAIMS_MAX_ENTRIES", 10000))
+
+
+def auth_secret():
+    """JWT_SECRET_KEY, which signs access and refresh tokens.
+
+    Required and kept apart from the upload-ticket secret, so a leaked or
+    reused upload key can never mint an access token. create_app() refuses
+    to start without it.
+    """
+    secret = os.getenv("JWT_SECRET_KEY")
+    if not secret:
+        raise RuntimeError("JWT_SECRET_KEY is not set")
+    if secret == upload_secret():
+        raise RuntimeError("JWT_SECRET_KEY must differ from UPLOAD_SECRET_KEY")
+    return secret
+
+
+def sign_token(claims, ttl):
+    """Sign claims into an access or refresh token"""
+    return jwt.encode({**claims, "exp": int(time.time()) + ttl}, auth_secret(), algorithm="HS256")
+
+
+def verify_token(token, purpose):
+    """Claims of a token issued by sign_token(), or None if invalid or expired"""
+    try:
+        claims = jwt.decode(token, auth_secret(), algorithms=["HS256"])
+    except jwt.PyJWTError:
+        return None
+    return claims if claims.get("purpose") == purpose else None
+
+
+def issue_tokens(user):
+    """Access and refresh tokens for a user row (needs id and role)"""
+    user_id = str(user["id"])
+    return {
+        "access_token": sign_token({"purpose": "access", "sub": user_id, "role": user["role"]}, ACCESS_TOKEN_TTL),
+        "refresh_token": sign_token({"purpose": "refresh", "sub": user_id}, REFRESH_TOKEN_TTL),
+        "token_type": "Bearer",
+        "expires_in": ACCESS_TOKEN_TTL
+    }
+
+
+def load_claims(user_id):
+    """(role, is_active) for a user, or None if there is no such user"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT role, is_active FROM users WHERE id = %s", (user_id,))
+        row = cur.fetchone()
+        cur.close()
+    finally:
+        if conn:
+            return_db_connection(conn)
+    if row is None:
+        return None
+    return row[0], row[1] is not False
+
+
+class ClaimsCache:
+    """user id -> (role, is_active), expiring after `ttl` or on a "users" stamp change.
+
+    Unlike the response cache this never serves an entry past its expiry,
+    so a database error fails the request instead of trusting old claims.
+    """
+
+    def __init__(self, ttl=AUTH_CLAIMS_TTL, max_entries=AUTH_CLAIMS_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # user id -> (claims, expires_at, stamp)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        stamps = current(("users",))
+        stamp = stamps[0] if stamps else None
+        entry = self._entries.get(user_id)
+        if entry is not None and stamp is not None:
+            claims, expires_at, cached_stamp = entry
+            if cached_stamp == stamp and time.time() < expires_at:
+                return claims
+
+        claims = load_claims(user_id)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[user_id] = (claims, time.time() + self.ttl, stamp)
+        return claims
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+claims_cache = ClaimsCache()
+
+
+def invalidate_user(user_id):
+    """Drop cached claims after a user's role or active flag changes; call after commit"""
+    claims_cache.discard(str(user_id))
+    bump("users")
+
+
+def bearer_token():
+    header = request.headers.get("Authorization", "")
+    scheme, _, token = header.partition(" ")
+    return token.strip() if scheme.lower() == "bearer" else None
+
+
+def authenticate():
+    """(user, None) for a valid access token of an active user, else (None, error response)"""
+    token = bearer_token()
+    claims = verify_token(token, "access") if token else None
+    if claims is None:
+        return None, (jsonify({"error": "Authentication required"}), 401)
+
+    try:
+        user = claims_cache.get(claims["sub"])
+    except Exception as e:
+        logger.warning("Failed to load claims for %s: %s", claims['sub'], e)
+        return None, (jsonify({"error": "Could not verify credentials"}), 503)
+    if user is None or not user[1]:
+        return None, (jsonify({"error": "Account is not active"}), 401)
+    return {"id": claims["sub"], "role": user[0]}, None
+
+
+def require_auth(*roles):
+    """Reject requests without a valid access token for an active user with one of `roles`.
+
+    With no roles any active user is allowed. The user is available as
+    g.user = {"id", "role"} inside the view.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user, error = authenticate()
+            if error:
+                return error
+            if roles and user["role"] not in roles:
+                return jsonify({"error": "Forbidden"}), 403
+
+            g.user = user
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def viewer_is_admin():
+    """Whether the request carries a valid admin access token.
+
+    For routes open to everyone that show admins more (e.g. unpublished
+    posts); a missing or bad token just means an anonymous viewer.
+    """
+    if "viewer" not in g:
+        g.viewer = authenticate()[0] if bearer_token() else None
+    return g.viewer is not None and g.viewer["role"] == "admin"
+
+
+admin_required = require_auth("admin")
@@ -0,0 +1,232 @@
+"""
+In-memory Bloom filters answering "is this email/username taken?".
+
+Most availability checks are for values nobody has, and a Bloom filter can
+say "definitely not taken" without touching Postgres. A possible hit (a
+real one or, rarely, a false positive) is confirmed with a lookup that
+reads only the matching column.
+
+The filters are built from the users table by `warm()` on a background
+thread at startup. Until they are ready every check goes to the database.
+New signups in this worker are added directly. Signups in other workers
+bump the "signups" version stamp; on the next check this worker fetches
+only the users created since its last sync.
+"""
+import hashlib
+import logging
+import math
+import os
+import threading
+from datetime import timedelta
+from uuid import uuid4
+
+from utils.db import get_unscoped_connection, get_db_connection, return_db_connection
+from utils.versions import bump, current
+
+logger = logging.getLogger("availability")
+
+# Users the filters are sized for before their false positive rate degrades
+AVAILABILITY_CAPACITY = int(os.getenv("AVAILABILITY_CAPACITY", 1000000))
+AVAILABILITY_FP_RATE = float(os.getenv("AVAILABILITY_FP_RATE", 0.01))
+# Incremental syncs re-read this far back, to catch rows committed late
+AVAILABILITY_SYNC_OVERLAP = timedelta(seconds=int(os.getenv("AVAILABILITY_SYNC_OVERLAP", 60)))
+
+FIELDS = ("email", "username")
+
+
+def normalize(value):
+    return value.strip().lower()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings using double hashing"""
+
+    def __init__(self, capacity, fp_rate):
+        capacity = max(1, capacity)
+        self.size = max(64, int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, value):
+        bits = self.bits
+        for pos in self._positions(value):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value):
+        bits = self.bits
+        for pos in self._positions(value):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class AvailabilityIndex:
+    def __init__(self, capacity=AVAILABILITY_CAPACITY, fp_rate=AVAILABILITY_FP_RATE):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self._filters = None  # field -> BloomFilter, once built
+        self._synced_at = None  # database time of the last full or incremental load
+        self._stamp = None
+        self._lock = threading.Lock()
+        self._building = False
+
+        self._checks = 0
+        self._db_confirmations = 0
+        self._false_positives = 0
+
+    @property
+    def ready(self):
+        return self._filters is not None
+
+    def warm(self):
+        """Build the filters on a background thread"""
+        with self._lock:
+            if self._building or self.ready:
+                return
+            self._building = True
+        threading.Thread(target=self._build, name="availability-index", daemon=True).start()
+
+    def _build(self):
+        conn = None
+        try:
+            conn = get_unscoped_connection()
+            cur = conn.cursor()
+            stamp = (current(("signups",)) or [None])[0]
+            cur.execute("SELECT now(), (SELECT reltuples::bigint FROM pg_class WHERE oid = 'users'::regclass)")
+            synced_at, estimate = cur.fetchone()
+            capacity = max(self.capacity, 2 * (estimate or 0))
+            filters = {field: BloomFilter(capacity, self.fp_rate) for field in FIELDS}
+
+            named = conn.cursor(name=f"availability_{uuid4().hex}")
+            named.itersize = 5000
+            named.execute("SELECT email, username FROM users")
+            while True:
+                rows = named.fetchmany(5000)
+                if not rows:
+                    break
+                for email, username in rows:
+                    if email:
+                        filters["email"].add(normalize(email))
+                    if username:
+                        filters["username"].add(normalize(username))
+            named.close()
+            cur.close()
+
+            with self._lock:
+                self._filters = filters
+                self._synced_at = synced_at
+                self._stamp = stamp
+            logger.info("Availability index built")
+        except Exception as e:
+            logger.warning("Failed to build availability index: %s", e)
+        finally:
+            with self._lock:
+                self._building = False
+            if conn:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                return_db_connection(conn)
+
+    def _sync(self, cur, stamp):
+        """Add users other workers created since the last sync"""
+        cur.execute("SELECT now()")
+        synced_at = cur.fetchone()[0]
+        cur.execute(
+            "SELECT email, username FROM users WHERE created_at >= %s",
+            (self._synced_at - AVAILABILITY_SYNC_OVERLAP,)
+        )
+        rows = cur.fetchall()
+        with self._lock:
+            for email, username in rows:
+                if email:
+                    self._filters["email"].add(normalize(email))
+                if username:
+                    self._filters["username"].add(normalize(username))
+            self._synced_at = synced_at
+            self._stamp = stamp
+
+    def _with_cursor(self, fn):
+        conn = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+            value = fn(cur)
+            cur.close()
+            return value
+        finally:
+            if conn:
+                return_db_connection(conn)
+
+    def add(self, email, username):
+        """Record a new user; call after create_user commits"""
+        self.add_many([(email, username)])
+
+    def add_many(self, users):
+        """Record (email, username) pairs of newly committed users"""
+        users = list(users)
+        if not users:
+            return
+        if self.ready:
+            with self._lock:
+                for email, username in users:
+                    self._filters["email"].add(normalize(email))
+                    self._filters["username"].add(normalize(username))
+        bump("signups")
+
+    def check(self, field, values):
+        """Map each value to whether a user already has it as `field`"""
+        if field not in FIELDS:
+            raise ValueError(f"Unknown field: {field}")
+        result = {value: False for value in values}
+        self._checks += len(result)
+
+        ready = self.ready
+        if ready:
+            stamp = (current(("signups",)) or [None])[0]
+            if stamp is not None and stamp != self._stamp:
+                self._with_cursor(lambda cur: self._sync(cur, stamp))
+            bloom = self._filters[field]
+            candidates = [value for value in result if normalize(value) in bloom]
+        else:
+            candidates = list(result)
+        if not candidates:
+            return result
+
+        # Confirm possible hits with the same exact match create_user uses,
+        # without reading whole rows
+        def confirm(cur):
+            cur.execute(f"SELECT {field} FROM users WHERE {field} = ANY(%s)", (candidates,))
+            return {row[0] for row in cur.fetchall()}
+
+        taken = self._with_cursor(confirm)
+        self._db_confirmations += len(candidates)
+        for value in candidates:
+            result[value] = value in taken
+        if ready:
+            self._false_positives += sum(1 for value in candidates if value not in taken)
+        return result
+
+    def exists(self, field, value):
+        return self.check(field, [value])[value]
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "checks_total": self._checks,
+            "db_confirmations_total": self._db_confirmations,
+            "false_positives_total": self._false_positives,
+            "bits": self._filters["email"].size if self.ready else None,
+            "hashes": self._filters["email"].hashes if self.ready else None
+        }
+
+
+availability = AvailabilityIndex()
@@ -0,0 +1,174 @@
+"""
+Helpers for admin batch operations on posts and ads.
+
+Updates are one set-based statement over `id = ANY(...)`. Deletes run in
+chunks of BATCH_DELETE_CHUNK rows, each in its own short transaction, so a
+large delete never holds row locks (or a pool connection's transaction)
+for long. After each chunk commits, the storage objects it freed are
+removed with one multi-key call and a progress event is produced.
+Clients that send `Accept: application/x-ndjson` get these events
+streamed; everyone else gets only the final summary.
+
+Only one chunked delete runs per table at a time, across all workers: each
+holds a Postgres advisory lock named after its table for the whole run and
+a second one gets BatchBusy (409 in the routes).
+"""
+import logging
+import os
+import time
+from uuid import UUID
+
+from flask import Response, jsonify, request
+
+from utils.db import get_unscoped_connection, return_db_connection
+from utils.media_objects import release, remove_objects
+from utils.cache import invalidate
+from utils.serializers import dumps
+
+logger = logging.getLogger("batch")
+
+# Most ids one batch request may name
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", 5000))
+# Rows deleted per transaction
+BATCH_DELETE_CHUNK = int(os.getenv("BATCH_DELETE_CHUNK", 500))
+
+
+class BatchBusy(Exception):
+    """Another chunked delete on the same table is in progress"""
+
+
+def parse_batch(data, actions):
+    """Validate a {"action", "ids"} body; returns (action, ids) or raises ValueError"""
+    data = data or {}
+    action = data.get("action")
+    if action not in actions:
+        raise ValueError(f"action must be one of {', '.join(actions)}")
+    ids = data.get("ids")
+    if not isinstance(ids, list) or not ids:
+        raise ValueError("ids must be a non-empty list")
+    if len(ids) > BATCH_MAX_IDS:
+        raise ValueError(f"At most {BATCH_MAX_IDS} ids per request")
+    try:
+        ids = list(dict.fromkeys(str(UUID(str(value))) for value in ids))
+    except ValueError:
+        raise ValueError("ids must be UUIDs")
+    return action, ids
+
+
+def update_where_ids(cur, table, assignments, params, ids):
+    """Run one UPDATE over all ids; returns (updated ids, ids not found)"""
+    cur.execute(
+        f"UPDATE {table} SET {assignments} WHERE id = ANY(%s::uuid[]) RETURNING id",
+        (*params, ids)
+    )
+    updated = [str(row[0]) for row in cur.fetchall()]
+    found = set(updated)
+    return updated, [value for value in ids if value not in found]
+
+
+def delete_where_ids(cur, table, url_columns, ids):
+    """DELETE the rows with these ids; returns (their url_columns as tuples, ids not found)"""
+    cur.execute(
+        f"DELETE FROM {table} WHERE id = ANY(%s::uuid[]) RETURNING id, {url_columns}",
+        (ids,)
+    )
+    rows = cur.fetchall()
+    found = {str(row[0]) for row in rows}
+    return [row[1:] for row in rows], [value for value in ids if value not in found]
+
+
+def chunked_delete(delete_chunk, tag, on_commit=None, summary=None):
+    """Delete in chunks, yielding a progress dict after each one.
+
+    `delete_chunk(cur, limit)` deletes at most `limit` rows and returns the
+    deleted rows' media URLs as a list of tuples, or None once there is
+    nothing left; an empty list (e.g. a chunk of ids that were already
+    gone) moves on to the next chunk. `tag` is the cache/ETag table
+    invalidated after every chunk, and `on_commit()` runs after each one
+    too. The last event has "done": True, plus whatever `summary()` returns.
+
+    References are released only for the rows `delete_chunk` returns, which
+    must come from the DELETE's RETURNING clause: a row another statement
+    deleted first is not returned, so its media is never released twice.
+    Raises BatchBusy from the first next() while another delete holds `tag`.
+    """
+    conn = get_unscoped_connection()
+    started = time.time()
+    deleted = chunks = objects = 0
+    locked = False
+    try:
+        cur = conn.cursor()
+        # Session-level, so it outlives the per-chunk commits
+        cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (f"batch_delete:{tag}",))
+        locked = cur.fetchone()[0]
+        conn.commit()
+        if not locked:
+            raise BatchBusy(f"A batch delete on {tag} is already in progress")
+        while True:
+            try:
+                rows = delete_chunk(cur, BATCH_DELETE_CHUNK)
+                freed = release(cur, [url for row in rows for url in row]) if rows else []
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            if rows is None:
+                break
+            deleted += len(rows)
+            chunks += 1
+            objects += len(freed)
+            invalidate(tag)
+            if on_commit is not None:
+                on_commit()
+            remove_objects(freed)
+            yield {"deleted": deleted, "chunks": chunks, "objects_removed": objects}
+        cur.close()
+        yield {
+            "done": True,
+            "deleted": deleted,
+            "chunks": chunks,
+            "objects_removed": objects,
+            "seconds": round(time.time() - started, 3),
+            **(summary() if summary is not None else {})
+        }
+    finally:
+        if locked:
+            try:
+                unlock = conn.cursor()
+                unlock.execute("SELECT pg_advisory_unlock(hashtext(%s))", (f"batch_delete:{tag}",))
+                unlock.close()
+                conn.commit()
+            except Exception as e:
+                # Ending the session releases it; the pool drops closed connections
+                logger.warning("Failed to release the batch delete lock on %s: %s", tag, e)
+                conn.close()
+        return_db_connection(conn)
+
+
+def progress_response(events, summarize):
+    """Stream progress events as NDJSON if the client asked for them, else
+    run to completion and return `summarize(last_event)` as JSON.
+
+    The first event is produced before the response is built, so an error
+    raised before any work is done (BatchBusy, ReconcileBusy) reaches the
+    caller rather than the stream.
+    """
+    first = next(events)
+    if request.accept_mimetypes.best == "application/x-ndjson":
+        def generate():
+            try:
+                yield dumps(first) + b"\n"
+                for event in events:
+                    yield dumps(event) + b"\n"
+            except Exception as e:
+                logger.warning("Batch operation failed: %s", e)
+                yield dumps({"error": "Batch operation failed"}) + b"\n"
+
+        response = Response(generate(), mimetype="application/x-ndjson")
+        response.call_on_close(events.close)
+        return response
+
+    last = first
+    for last in events:
+        pass
+    return jsonify(summarize(last)), 200
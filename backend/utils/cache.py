@@ -0,0 +1,235 @@
+"""
+Application cache for computed responses.
+
+Values are cached under a key with a TTL and a set of tags. Tags are the
+table version stamps from utils.versions: an entry is only fresh while the
+stamps of its tags are unchanged, so `invalidate("posts")` after a write
+expires every cached value built from posts, in every worker, together
+with the ETags built from the same stamps.
+
+Two backends are available via CACHE_BACKEND: "memory" (a bounded LRU per
+process, the default) and "redis" (shared, using REDIS_URL). RedisBackend
+accepts any client with get/set/delete, so LocalRedis can stand in for a
+server in tests.
+
+`get_or_compute` adds three behaviours on top of the backend:
+- single-flight: concurrent misses for one key in a process share a
+  single computation instead of all hitting the database
+- stale-while-revalidate: an entry past its TTL (but with unchanged
+  tags) is returned at once while one background refresh runs
+- serve-stale-on-error: if recomputing fails, the last value is served,
+  even one invalidated by a write, rather than an error
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from flask import has_request_context
+
+from utils.versions import bump, current, uncacheable, REDIS_URL
+from utils.serializers import dumps, loads
+
+logger = logging.getLogger("cache")
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+# Seconds a value is served without recomputing
+CACHE_TTL = float(os.getenv("CACHE_TTL", 30))
+# Seconds past the TTL a value is kept for stale-while-revalidate and errors
+CACHE_STALE_TTL = float(os.getenv("CACHE_STALE_TTL", 300))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+# Seconds a request waits for another request's computation of the same key
+CACHE_WAIT_TIMEOUT = float(os.getenv("CACHE_WAIT_TIMEOUT", 10))
+
+REDIS_CACHE_PREFIX = "bigteam:cache:"
+
+
+class MemoryBackend:
+    """Bounded in-process LRU; entries are (value, fresh_until, stamps)"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (entry, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            entry, expires_at = item
+            if time.time() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, expire_in):
+        with self._lock:
+            self._entries[key] = (entry, time.time() + expire_in)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisBackend:
+    """Entries stored as JSON in Redis, so cached values must be JSON-serializable"""
+
+    def __init__(self, client=None, prefix=REDIS_CACHE_PREFIX):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        data = loads(raw)
+        return data["v"], data["f"], data["s"]
+
+    def set(self, key, entry, expire_in):
+        value, fresh_until, stamps = entry
+        payload = dumps({"v": value, "f": fresh_until, "s": stamps})
+        self.client.set(self.prefix + key, payload, ex=max(1, int(expire_in)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class LocalRedis:
+    """In-process stand-in for the subset of the Redis client RedisBackend uses"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            item = self._data.get(name)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and time.time() >= expires_at:
+                del self._data[name]
+                return None
+            return value
+
+    def set(self, name, value, ex=None):
+        with self._lock:
+            self._data[name] = (value, time.time() + ex if ex else None)
+        return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+
+class Cache:
+    def __init__(self, backend, ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    def _get(self, key):
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            logger.warning("Cache read failed for %s: %s", key, e)
+            return None
+
+    def _store(self, key, value, stamps, ttl):
+        try:
+            self.backend.set(key, (value, time.time() + ttl, stamps), ttl + self.stale_ttl)
+        except Exception as e:
+            logger.warning("Cache write failed for %s: %s", key, e)
+
+    def _compute(self, key, compute, tags, ttl):
+        """Run compute once per key at a time; concurrent callers get the same result"""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result(timeout=CACHE_WAIT_TIMEOUT)
+
+        try:
+            # Read the stamps first: a write during compute leaves the
+            # stored entry already out of date rather than wrongly fresh
+            stamps = current(tags) if tags else []
+            value = compute()
+            if stamps is not None:
+                self._store(key, value, stamps, ttl)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _refresh_in_background(self, key, compute, tags, ttl):
+        with self._lock:
+            if key in self._inflight:
+                return
+            if self._refresher is None:
+                self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+
+        def refresh():
+            try:
+                self._compute(key, compute, tags, ttl)
+            except Exception as e:
+                logger.warning("Background refresh of %s failed: %s", key, e)
+
+        self._refresher.submit(refresh)
+
+    def get_or_compute(self, key, compute, tags=(), ttl=None):
+        """Return the cached value for key, computing (and caching) it when needed.
+
+        `compute` must not depend on the current request, since it may run
+        on a background thread.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        entry = self._get(key)
+        if entry is not None:
+            value, fresh_until, stamps = entry
+            if not tags or list(stamps) == current(tags):
+                if time.time() >= fresh_until:
+                    self._refresh_in_background(key, compute, tags, ttl)
+                return value
+
+        try:
+            return self._compute(key, compute, tags, ttl)
+        except Exception as e:
+            if entry is None:
+                raise
+            logger.warning("Serving stale %s after error: %s", key, e)
+            if has_request_context():
+                uncacheable()
+            return entry[0]
+
+    def delete(self, key):
+        try:
+            self.backend.delete(key)
+        except Exception as e:
+            logger.warning("Cache delete failed for %s: %s", key, e)
+
+
+def invalidate(*tags):
+    """Expire every cached value and ETag built from these tables; call after the write commits"""
+    bump(*tags)
+
+
+cache = Cache(RedisBackend() if CACHE_BACKEND == "redis" else MemoryBackend())
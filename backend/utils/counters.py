@@ -0,0 +1,244 @@
+"""
+Write-behind aggregation of post view/like/share counters
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from psycopg2.extras import execute_values
+
+from utils.db import get_unscoped_connection, return_db_connection
+from utils.versions import bump
+
+logger = logging.getLogger("counters")
+
+COUNTER_FIELDS = ("views_count", "likes_count", "shares_count")
+
+# Seconds between background flushes; 0 wakes the flusher on every increment
+COUNTER_FLUSH_INTERVAL = float(os.getenv("COUNTER_FLUSH_INTERVAL", 2))
+# Pending increments that wake the flusher before the interval elapses
+COUNTER_FLUSH_THRESHOLD = int(os.getenv("COUNTER_FLUSH_THRESHOLD", 500))
+# Cap on increments held between flushes (a post kept after a failed flush
+# counts once), which bounds memory through a database outage; increments
+# past it are dropped and counted
+COUNTER_MAX_PENDING = int(os.getenv("COUNTER_MAX_PENDING", 5000))
+COUNTER_SHARDS = int(os.getenv("COUNTER_SHARDS", 16))
+# Longest wait (seconds) between flush attempts while the database is failing;
+# the wait doubles from one second after each failed flush
+COUNTER_FLUSH_BACKOFF_MAX = float(os.getenv("COUNTER_FLUSH_BACKOFF_MAX", 30))
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.deltas = {}
+        self.count = 0
+        self.dropped = 0
+
+
+class CounterAggregator:
+    """Collects counter increments in memory and applies them in one bulk UPDATE.
+
+    Increments are spread over lock-striped shards keyed by post id so
+    concurrent requests rarely contend. Only a daemon thread writes: it
+    flushes every `flush_interval` seconds or as soon as `flush_threshold`
+    increments are pending, and a final flush runs at interpreter exit.
+    Requests never flush themselves, so they never need a second pooled
+    connection.
+
+    After a failed flush the increments are kept and the next attempt waits
+    for a backoff delay, so a database outage does not turn every increment
+    into a failing UPDATE. At most `max_pending` increments are held; past
+    that they are dropped and counted in `dropped`.
+    """
+
+    def __init__(self, flush_interval=COUNTER_FLUSH_INTERVAL, flush_threshold=COUNTER_FLUSH_THRESHOLD,
+                 max_pending=COUNTER_MAX_PENDING, shards=COUNTER_SHARDS):
+        self.flush_interval = flush_interval
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self._shard_threshold = max(1, flush_threshold // len(self._shards))
+        self._shard_max_pending = max(1, max_pending // len(self._shards))
+        self._in_flight = {}
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._failures = 0
+        self._retry_at = None
+        self._dropped_reported = 0
+
+    def _shard(self, post_id):
+        return self._shards[hash(post_id) % len(self._shards)]
+
+    def increment(self, post_id, field, amount=1):
+        """Record an increment and return the total not yet written to the database"""
+        if field not in COUNTER_FIELDS:
+            raise ValueError(f"Unknown counter: {field}")
+
+        post_id = str(post_id)
+        index = COUNTER_FIELDS.index(field)
+        shard = self._shard(post_id)
+        with shard.lock:
+            if shard.count >= self._shard_max_pending:
+                deltas = shard.deltas.get(post_id)
+                pending = deltas[index] if deltas else 0
+                shard.dropped += 1
+                shard_count = shard.count
+            else:
+                deltas = shard.deltas.setdefault(post_id, [0] * len(COUNTER_FIELDS))
+                deltas[index] += amount
+                pending = deltas[index]
+                shard.count += 1
+                shard_count = shard.count
+
+        in_flight = self._in_flight.get(post_id)
+        if in_flight:
+            pending += in_flight[index]
+
+        self._ensure_started()
+        # While backing off the flusher retries once the delay is over
+        if not self._backing_off() and (self.flush_interval <= 0 or shard_count >= self._shard_threshold):
+            self._wake.set()
+        return pending
+
+    @property
+    def dropped(self):
+        """Increments dropped so far because too many were pending"""
+        return sum(shard.dropped for shard in self._shards)
+
+    def _backing_off(self):
+        retry_at = self._retry_at
+        return retry_at is not None and time.monotonic() < retry_at
+
+    def pending(self, post_id):
+        """Unflushed deltas for a post as {field: delta}"""
+        post_id = str(post_id)
+        totals = [0] * len(COUNTER_FIELDS)
+        shard = self._shard(post_id)
+        with shard.lock:
+            deltas = shard.deltas.get(post_id)
+            if deltas:
+                totals = list(deltas)
+        in_flight = self._in_flight.get(post_id)
+        if in_flight:
+            totals = [a + b for a, b in zip(totals, in_flight)]
+        return dict(zip(COUNTER_FIELDS, totals))
+
+    def flush(self):
+        """Write all pending increments in a single UPDATE ... FROM (VALUES ...)"""
+        with self._flush_lock:
+            # Publish the batch before draining the shards so pending() keeps
+            # seeing every increment until the UPDATE is committed
+            batch = {}
+            self._in_flight = batch
+            for shard in self._shards:
+                with shard.lock:
+                    deltas, shard.deltas = shard.deltas, {}
+                    shard.count = 0
+                for post_id, values in deltas.items():
+                    merged = batch.setdefault(post_id, [0] * len(COUNTER_FIELDS))
+                    for i, value in enumerate(values):
+                        merged[i] += value
+
+            if not batch:
+                self._in_flight = {}
+                return 0
+
+            conn = None
+            try:
+                # Never a request's connection: flush() may be called with
+                # one checked out and must not commit the caller's transaction
+                conn = get_unscoped_connection()
+                cur = conn.cursor()
+                rows = [(post_id, *values) for post_id, values in batch.items()]
+                execute_values(cur, """
+                    UPDATE posts AS p
+                    SET views_count = COALESCE(p.views_count, 0) + v.views,
+                        likes_count = COALESCE(p.likes_count, 0) + v.likes,
+                        shares_count = COALESCE(p.shares_count, 0) + v.shares
+                    FROM (VALUES %s) AS v(id, views, likes, shares)
+                    WHERE p.id = v.id
+                """, rows, template="(%s::uuid, %s, %s, %s)", page_size=len(rows))
+                conn.commit()
+                cur.close()
+                self._failures = 0
+                self._retry_at = None
+                self._report_dropped()
+                # ETags of listings that show counts depend on this
+                bump("counters")
+                return len(rows)
+            except Exception as e:
+                self._failures += 1
+                delay = min(COUNTER_FLUSH_BACKOFF_MAX, 2 ** (self._failures - 1))
+                self._retry_at = time.monotonic() + delay
+                logger.warning("Counter flush failed, keeping %d posts pending, retrying in %gs: %s",
+                               len(batch), delay, e)
+                self._report_dropped()
+                if conn:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                self._restore(batch)
+                return 0
+            finally:
+                self._in_flight = {}
+                if conn:
+                    return_db_connection(conn)
+
+    def _report_dropped(self):
+        dropped = self.dropped
+        if dropped > self._dropped_reported:
+            logger.warning("Dropped %d counter increments over the %d pending limit",
+                           dropped - self._dropped_reported, self._shard_max_pending * len(self._shards))
+            self._dropped_reported = dropped
+
+    def _restore(self, batch):
+        """Put a failed batch back; each post counts as one pending entry"""
+        for post_id, values in batch.items():
+            shard = self._shard(post_id)
+            with shard.lock:
+                deltas = shard.deltas.get(post_id)
+                if deltas is None:
+                    deltas = shard.deltas[post_id] = [0] * len(COUNTER_FIELDS)
+                    shard.count += 1
+                for i, value in enumerate(values):
+                    deltas[i] += value
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="counter-flusher", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self._next_wait())
+            self._wake.clear()
+            if self._backing_off() and not self._stopped.is_set():
+                continue
+            self.flush()
+
+    def _next_wait(self):
+        wait = (self._retry_at or 0) - time.monotonic()
+        if wait > 0:
+            return wait
+        # With interval <= 0 every increment wakes the thread
+        return self.flush_interval if self.flush_interval > 0 else COUNTER_FLUSH_BACKOFF_MAX
+
+    def stop(self):
+        """Stop the background flusher and write out whatever is still pending"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+
+post_counters = CounterAggregator()
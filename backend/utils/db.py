@@ -1,64 +1,400 @@
+import logging
 import os
 import psycopg2
-from psycopg2 import pool
 from dotenv import load_dotenv
 from psycopg2.extras import RealDictCursor
-from supabase import create_client, Client
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from flask import g, has_app_context, request, has_request_context
+import threading
 import time
+import traceback
+
+from utils.logs import sampled
+from utils.metrics import Gauge, DB_POOL_WAIT_SECONDS, DB_QUERY_SECONDS
+from utils.query_trace import query_stats, statement_type, QUERY_TRACE_ENABLED
 
 load_dotenv()
 
-# Create a connection pool for better performance
+logger = logging.getLogger("db")
+
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 20))
+# Seconds a caller waits for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))
+# Idle connections older than this are pinged before being handed out
+DB_POOL_HEALTHCHECK_AFTER = float(os.getenv("DB_POOL_HEALTHCHECK_AFTER", 30))
+# Checkouts held longer than this are reported as leaked or long-held
+DB_POOL_LEAK_TIMEOUT = float(os.getenv("DB_POOL_LEAK_TIMEOUT", 60))
+
+# Share of slow (>100ms) checkouts that are logged
+DB_SLOW_CHECKOUT_LOG_SAMPLE = float(os.getenv("DB_SLOW_CHECKOUT_LOG_SAMPLE", 0.1))
+
+# Upper bounds (ms) of the checkout wait time histogram buckets
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the checkout timeout"""
+
+
+class TimedCursorMixin:
+    """Records every statement's duration in db_query_duration_seconds and,
+    unless QUERY_TRACE_ENABLED=0, its fingerprint aggregates in query_stats"""
+
+    def _record(self, query, vars, start, failed):
+        elapsed = time.perf_counter() - start
+        DB_QUERY_SECONDS.observe(elapsed, statement_type(query))
+        if QUERY_TRACE_ENABLED:
+            try:
+                query_stats.record(self, query, vars, elapsed * 1000, failed)
+            except Exception as e:
+                logger.warning("Query tracing failed: %s", e)
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            self._record(query, vars, start, failed)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().executemany(query, vars_list)
+            failed = False
+            return result
+        finally:
+            self._record(query, None, start, failed)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().copy_expert(sql, file, size)
+            failed = False
+            return result
+        finally:
+            self._record(sql, None, start, failed)
+
+
+_timed_cursors = {}
+
+
+def timed_cursor_class(base):
+    """`base` (a psycopg2 cursor class) with TimedCursorMixin mixed in"""
+    cls = _timed_cursors.get(base)
+    if cls is None:
+        cls = _timed_cursors[base] = type(f"Timed{base.__name__}", (TimedCursorMixin, base), {})
+    return cls
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Connection whose cursors, whatever their cursor_factory, are timed"""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+
+def connect():
+    """Open a new direct database connection"""
+    return psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        port=os.getenv("DB_PORT", 5432),
+        connection_factory=InstrumentedConnection
+    )
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool.
+
+    Checkout blocks up to `timeout` seconds for a free slot, idle connections
+    are health-checked before reuse, and every checkout is tracked so
+    connections that are never returned show up in `leaks()` and `stats()`.
+    """
+
+    def __init__(self, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 healthcheck_after=DB_POOL_HEALTHCHECK_AFTER, leak_timeout=DB_POOL_LEAK_TIMEOUT):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_after = healthcheck_after
+        self.leak_timeout = leak_timeout
+
+        self._cond = threading.Condition()
+        self._idle = []  # (conn, returned_at), most recently used last
+        self._in_use = {}  # id(conn) -> (conn, checked_out_at, holder)
+        self._reserved = 0
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_buckets = [0] * len(WAIT_BUCKETS_MS)
+        self._wait_total_ms = 0.0
+        self._rate_slots = [(0, 0)] * 60  # (second, checkouts) over the last minute
+        self._last_leak_check = 0.0
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use) + self._reserved
+
+    def _healthy(self, conn, idle_since):
+        if conn.closed or conn.info.transaction_status == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.time() - idle_since < self.healthcheck_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        self._discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self, holder=None):
+        start = time.time()
+        deadline = start + self.timeout
+
+        while True:
+            conn = None
+            with self._cond:
+                while not self._idle and self._size() >= self.maxconn:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"No database connection available after {self.timeout:.1f}s "
+                            f"({len(self._in_use)} in use)"
+                        )
+                    self._cond.wait(remaining)
+
+                # Reserve the slot until the connection is tracked as in use
+                self._reserved += 1
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+
+            if conn is not None and not self._healthy(conn, idle_since):
+                self._discard(conn)
+                with self._cond:
+                    self._reserved -= 1
+                    self._cond.notify()
+                continue
+
+            if conn is None:
+                try:
+                    conn = connect()
+                except Exception:
+                    with self._cond:
+                        self._reserved -= 1
+                        self._cond.notify()
+                    raise
+
+            wait_ms = (time.time() - start) * 1000
+            holder = holder or _describe_holder()
+            with self._cond:
+                self._reserved -= 1
+                self._in_use[id(conn)] = (conn, time.time(), holder)
+                self._record_checkout(wait_ms)
+            if wait_ms > 100 and sampled(logger, logging.WARNING, DB_SLOW_CHECKOUT_LOG_SAMPLE):
+                logger.warning("DB connection took %.2fms (%s)", wait_ms, holder)
+            self._maybe_report_leaks()
+            return conn
+
+    def putconn(self, conn):
+        with self._cond:
+            tracked = id(conn) in self._in_use
+        if not tracked:
+            # Not ours (e.g. a fallback direct connection); just close it
+            self._discard(conn)
+            return
+
+        keep = False
+        if not conn.closed:
+            try:
+                if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                keep = conn.info.transaction_status == TRANSACTION_STATUS_IDLE
+            except Exception:
+                keep = False
+
+        with self._cond:
+            self._in_use.pop(id(conn), None)
+            if keep:
+                self._idle.append((conn, time.time()))
+            self._cond.notify()
+        if not keep:
+            self._discard(conn)
+
+    def _record_checkout(self, wait_ms):
+        DB_POOL_WAIT_SECONDS.observe(wait_ms / 1000)
+        self._checkouts += 1
+        self._wait_total_ms += wait_ms
+        for i, bound in enumerate(WAIT_BUCKETS_MS):
+            if wait_ms <= bound:
+                self._wait_buckets[i] += 1
+                break
+
+        now = int(time.time())
+        second, count = self._rate_slots[now % 60]
+        self._rate_slots[now % 60] = (now, count + 1 if second == now else 1)
+
+    def leaks(self):
+        """Checkouts held longer than the leak timeout, oldest first"""
+        now = time.time()
+        with self._cond:
+            held = [(now - since, holder) for _, since, holder in self._in_use.values()]
+        return sorted(
+            ({"held_seconds": round(age, 1), "holder": holder} for age, holder in held if age > self.leak_timeout),
+            key=lambda leak: -leak["held_seconds"]
+        )
+
+    def _maybe_report_leaks(self):
+        now = time.time()
+        if now - self._last_leak_check < self.leak_timeout:
+            return
+        self._last_leak_check = now
+        for leak in self.leaks():
+            logger.warning("DB connection held for %ss by %s", leak["held_seconds"], leak["holder"])
+
+    def stats(self):
+        with self._cond:
+            now = int(time.time())
+            recent = sum(count for second, count in self._rate_slots if now - second < 60)
+            stats = {
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "reserved": self._reserved,
+                "max": self.maxconn,
+                "checkouts_total": self._checkouts,
+                "checkouts_per_sec": round(recent / 60.0, 2),
+                "timeouts_total": self._timeouts,
+                "discarded_total": self._discarded,
+                "wait_ms_total": round(self._wait_total_ms, 2),
+                "wait_ms_histogram": {
+                    ("+Inf" if bound == float("inf") else str(bound)): count
+                    for bound, count in zip(WAIT_BUCKETS_MS, self._wait_buckets)
+                }
+            }
+        stats["leaks"] = self.leaks()
+        return stats
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+def _describe_holder():
+    """Identify who is checking out a connection, for leak reports"""
+    if has_request_context():
+        return f"{request.method} {request.path}"
+    for frame in reversed(traceback.extract_stack(limit=6)[:-3]):
+        if frame.filename != __file__:
+            return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+    return threading.current_thread().name
+
+
+# Create a connection pool for better performance; created on first
+# checkout, so importing this module never connects
 connection_pool = None
+_pool_lock = threading.Lock()
 
 def init_connection_pool():
     global connection_pool
-    try:
-        connection_pool = psycopg2.pool.SimpleConnectionPool(
-            1, 20,  # min and max connections
-            host=os.getenv("DB_HOST"),
-            database=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASS"),
-            port=os.getenv("DB_PORT", 5432)
-        )
-    except Exception as e:
-        print(f"Error creating connection pool: {e}")
+    with _pool_lock:
+        if connection_pool is None:
+            try:
+                connection_pool = ConnectionPool()
+            except Exception as e:
+                logger.warning("Error creating connection pool: %s", e)
+    return connection_pool
 
 def get_db_connection():
-    """Get a connection from the pool with performance timing"""
-    start_time = time.time()
+    """Get a database connection.
+
+    Inside a request every call returns the same pooled connection, which is
+    handed back by `release_request_connection` at teardown; elsewhere this is
+    a plain checkout that must be paired with `return_db_connection`.
+    """
+    if has_app_context():
+        conn = g.get("_db_conn")
+        if conn is not None and conn.closed:
+            release_request_connection()
+            conn = None
+        if conn is None:
+            conn = _checkout()
+            g._db_conn = conn
+        return conn
+    return _checkout()
+
+def get_unscoped_connection():
+    """Check out a connection that outlives the request (e.g. for a streamed
+    response body); it must be handed back with `return_db_connection`"""
+    return _checkout()
 
+def _checkout():
     # Initialize pool if not exists
     if connection_pool is None:
         init_connection_pool()
 
-    # Get connection from pool
     if connection_pool:
-        conn = connection_pool.getconn()
-        elapsed = (time.time() - start_time) * 1000  # Convert to ms
-        if elapsed > 100:  # Log slow connections
-            print(f"DB connection took {elapsed:.2f}ms")
-        return conn
-    else:
-        # Fallback to direct connection
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            database=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASS"),
-            port=os.getenv("DB_PORT", 5432)
-        )
-        return conn
+        return connection_pool.getconn()
+    # Fallback to direct connection
+    return connect()
 
 def return_db_connection(conn):
-    """Return connection to the pool"""
+    """Return connection to the pool (request-scoped connections wait for teardown)"""
+    if conn is None:
+        return
+    if has_app_context() and g.get("_db_conn") is conn:
+        return
     if connection_pool:
         connection_pool.putconn(conn)
+    else:
+        conn.close()
+
+def release_request_connection(exc=None):
+    """Teardown handler returning the request's connection to the pool"""
+    conn = g.pop("_db_conn", None)
+    if conn is not None:
+        if connection_pool:
+            connection_pool.putconn(conn)
+        else:
+            conn.close()
 
-# Initialize pool on module load
-init_connection_pool()
+def init_app(app):
+    """Return each request's database connection when its app context ends"""
+    app.teardown_appcontext(release_request_connection)
+
+def pool_stats():
+    pool = connection_pool or init_connection_pool()
+    if pool is None:
+        return None
+    return pool.stats()
+
+
+def _pool_connections():
+    if connection_pool is None:
+        return {}
+    with connection_pool._cond:
+        return {
+            ("in_use",): len(connection_pool._in_use),
+            ("idle",): len(connection_pool._idle),
+            ("max",): connection_pool.maxconn
+        }
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
\ No newline at end of file
+Gauge("db_pool_connections", "Pooled connections by state", ("state",), collect=_pool_connections)
@@ -0,0 +1,209 @@
+"""
+Resized WebP/JPEG derivatives of post images, generated off the request path.
+
+Each image post (and each video post's thumbnail) gets one object per
+width and format stored next to the original, e.g.
+image/image_<uuid>_<ts>_w640.webp, and recorded in media_derivatives so
+listings can return a srcset-style map without touching storage.
+"""
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.db import get_db_connection, return_db_connection
+from utils.storage import storage
+from utils.cache import invalidate
+from utils.helpers import seek_clause
+
+logger = logging.getLogger("derivatives")
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it no derivatives are made
+    Image = None
+
+DERIVATIVE_WIDTHS = tuple(int(w) for w in os.getenv("DERIVATIVE_WIDTHS", "320,640,1080").split(","))
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", 2))
+# Width used for thumbnail_url when a post has no explicit thumbnail
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", 640))
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DERIVATIVE_WORKERS, thread_name_prefix="derivatives")
+    return _executor
+
+
+def derivative_path(path, width, fmt):
+    base = path.rsplit(".", 1)[0]
+    return f"{base}_w{width}.{'jpg' if fmt == 'jpeg' else fmt}"
+
+
+def derivative_paths(path):
+    """Every key derivatives of `path` may have been stored under"""
+    return [derivative_path(path, width, fmt) for width in DERIVATIVE_WIDTHS for fmt in FORMATS]
+
+
+def render(source_bytes, widths=DERIVATIVE_WIDTHS):
+    """Yield (width, format, content_type, bytes) for every derivative of an image.
+
+    Widths at or above the original's are skipped; images are never upscaled.
+    """
+    image = Image.open(io.BytesIO(source_bytes))
+    # Let the JPEG decoder skip detail we are about to throw away
+    image.draft("RGB", (max(widths), max(widths)))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    for width in sorted(widths, reverse=True):
+        if width >= image.width:
+            continue
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+        for fmt, (pil_format, content_type, options) in FORMATS.items():
+            out = io.BytesIO()
+            resized.save(out, pil_format, **options)
+            yield width, fmt, content_type, out.getvalue()
+
+
+def generate(post_id, path):
+    """Build and store the derivatives for one post's image; returns how many were stored"""
+    if Image is None:
+        return 0
+
+    rows = []
+    for width, fmt, content_type, body in render(storage.download(path)):
+        target = derivative_path(path, width, fmt)
+        storage.upload(target, body, content_type)
+        rows.append((post_id, width, fmt, target, storage.public_url(target), len(body)))
+
+    if not rows:
+        return 0
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.executemany("""
+            INSERT INTO media_derivatives (post_id, width, format, path, url, bytes)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (post_id, width, format)
+            DO UPDATE SET path = EXCLUDED.path, url = EXCLUDED.url, bytes = EXCLUDED.bytes
+        """, rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        return_db_connection(conn)
+    # Listings carry the srcset map, so their ETags must change
+    invalidate("posts")
+    return len(rows)
+
+
+def _run(post_id, path):
+    try:
+        count = generate(post_id, path)
+        logger.info("Stored %s derivatives for post %s", count, post_id)
+    except Exception as e:
+        logger.warning("Derivative generation failed for post %s: %s", post_id, e)
+
+
+def source_path(media_type, media_url, thumbnail_url):
+    """Storage key of the image a post's derivatives are made from, if any"""
+    if media_type == "image":
+        return storage.path_from_url(media_url)
+    if thumbnail_url:
+        return storage.path_from_url(thumbnail_url)
+    return None
+
+
+def schedule(post_id, media_type, media_url, thumbnail_url=None):
+    """Queue derivative generation for a freshly created post"""
+    if Image is None:
+        return
+    path = source_path(media_type, media_url, thumbnail_url)
+    if path:
+        _get_executor().submit(_run, str(post_id), path)
+
+
+def srcsets_for(cur, post_ids):
+    """Map post id -> {"webp": {width: url}, "jpeg": {width: url}} for the given posts"""
+    if not post_ids:
+        return {}
+    cur.execute("""
+        SELECT post_id, width, format, url
+        FROM media_derivatives
+        WHERE post_id = ANY(%s::uuid[])
+    """, (list(post_ids),))
+    srcsets = {}
+    for post_id, width, fmt, url in cur.fetchall():
+        srcsets.setdefault(str(post_id), {}).setdefault(fmt, {})[str(width)] = url
+    return srcsets
+
+
+def attach_srcsets(cur, items):
+    """Add each post item's srcset map and fill a missing thumbnail from its derivatives"""
+    srcsets = srcsets_for(cur, [item["id"] for item in items])
+    for item in items:
+        srcset = item["srcset"] = srcsets.get(item["id"], {})
+        if not item["thumbnail_url"] or item["thumbnail_url"] == item["media_url"]:
+            item["thumbnail_url"] = thumbnail_from(srcset) or item["thumbnail_url"] or item["media_url"]
+
+
+def thumbnail_from(srcset):
+    """JPEG derivative closest to THUMBNAIL_WIDTH, or None"""
+    jpegs = (srcset or {}).get("jpeg")
+    if not jpegs:
+        return None
+    width = min(jpegs, key=lambda w: abs(int(w) - THUMBNAIL_WIDTH))
+    return jpegs[width]
+
+
+def backfill(batch_size=100, limit=None):
+    """Generate derivatives for existing posts that have none, in keyset-ordered batches"""
+    if Image is None:
+        logger.warning("Pillow is not installed; nothing to do")
+        return 0
+
+    processed = 0
+    after = None
+    while limit is None or processed < limit:
+        # Posts without created_at sort first; seek_clause keeps paging past them
+        seek, seek_params = seek_clause("created_at", "DESC", True, *after) if after else ("TRUE", [])
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(f"""
+                SELECT id, created_at, media_type, media_url, thumbnail_url
+                FROM posts p
+                WHERE (media_type = 'image' OR thumbnail_url IS NOT NULL)
+                  AND NOT EXISTS (SELECT 1 FROM media_derivatives d WHERE d.post_id = p.id)
+                  AND {seek}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """, (*seek_params, batch_size))
+            batch = cur.fetchall()
+        finally:
+            cur.close()
+            return_db_connection(conn)
+
+        if not batch:
+            break
+        for post_id, _, media_type, media_url, thumbnail_url in batch:
+            path = source_path(media_type, media_url, thumbnail_url)
+            if path:
+                _run(str(post_id), path)
+            processed += 1
+        after = (batch[-1][1], batch[-1][0])
+        logger.info("Backfilled %s posts", processed)
+    return processed
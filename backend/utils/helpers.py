@@ -0,0 +1,100 @@
+import base64
+import json
+from datetime import datetime
+from uuid import UUID
+
+
+def encode_cursor(payload):
+    """Encode a pagination position as an opaque, URL-safe cursor string"""
+    def default(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return str(value)
+
+    raw = json.dumps(payload, default=default, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+    if not isinstance(payload, dict):
+        raise ValueError("Invalid cursor")
+    return payload
+
+
+def cursor_id(value):
+    """The row id stored in a cursor, as a UUID string, or ValueError"""
+    try:
+        return str(UUID(str(value)))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def cursor_timestamp(value):
+    """A timestamp stored in a cursor (None for a NULL column), or ValueError"""
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError("Invalid cursor")
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def seek_clause(expression, direction, nullable, key, last_id):
+    """(SQL condition, params) for the rows after (key, last_id) in the sort order.
+
+    Postgres puts NULLs first in DESC order and last in ASC order, as the
+    (created_at, id) indexes do, and a row comparison with a NULL is never
+    true, so a nullable key needs its NULL group handled explicitly.
+    """
+    op = "<" if direction == "DESC" else ">"
+    if key is None:
+        after_nulls = f"({expression} IS NULL AND id {op} %s)"
+        if direction == "DESC":
+            return f"({after_nulls} OR {expression} IS NOT NULL)", [last_id]
+        return after_nulls, [last_id]
+    clause = f"({expression}, id) {op} (%s, %s)"
+    if nullable and direction == "ASC":
+        return f"({clause} OR {expression} IS NULL)", [key, last_id]
+    return clause, [key, last_id]
+
+
+def parse_limit(value, default=10, maximum=50):
+    """Parse a page size query parameter and clamp it to 1..maximum"""
+    if value in (None, ""):
+        return default
+    limit = int(value)
+    return max(1, min(limit, maximum))
+
+
+def count_rows(cur, from_sql, params=(), exact_limit=None):
+    """Count rows matching `FROM ... WHERE ...` from the planner's estimate.
+
+    No COUNT(*) runs unless the caller opts in with `exact_limit`, and then
+    only when the estimate is at or below it. Returns (count, is_estimate).
+    """
+    cur.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 {from_sql}", params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    estimate = int(plan[0]["Plan"]["Plan Rows"])
+    if exact_limit is None or estimate > exact_limit:
+        return estimate, True
+    cur.execute(f"SELECT COUNT(*) {from_sql}", params)
+    return cur.fetchone()[0], False
+
+
+def exact_count_requested(args):
+    """Whether a listing was asked for an exact total (`count=exact`); raises ValueError on other values"""
+    count = args.get("count", "estimate")
+    if count not in ("estimate", "exact"):
+        raise ValueError("count must be estimate or exact")
+    return count == "exact"
@@ -0,0 +1,24 @@
+"""
+Leveled logging for hot paths.
+
+Per-request diagnostics go through `logging` at DEBUG and are sampled, so
+turning them on (LOG_LEVEL=DEBUG) in production logs a fraction of requests
+instead of every one. `sampled()` is checked before building the message,
+so a disabled or unsampled log line costs one level check and, at most,
+one random().
+"""
+import logging
+import os
+import random
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+
+def configure():
+    """Send log records to stderr at LOG_LEVEL unless logging is already set up"""
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+def sampled(logger, level, rate):
+    """Whether to emit a `level` record on `logger`, for `rate` (0-1) of calls"""
+    return logger.isEnabledFor(level) and (rate >= 1 or random.random() < rate)
@@ -0,0 +1,304 @@
+"""
+Serving stored media from local disk: a size-bounded LRU cache of bucket
+objects and byte-range responses that never copy the body through Python.
+
+With the local backend objects are served straight from the storage
+directory. Otherwise an object is downloaded into MEDIA_CACHE_DIR on its
+first request (concurrent requests for it wait for that one download) and
+served from there until it is evicted. Eviction scans the directory, so the
+bound holds for all workers sharing it: once the cache grows past
+MEDIA_CACHE_MAX_BYTES the least recently served files are deleted until it
+is back under 90% of it.
+
+Responses pass an open file to the server's wsgi.file_wrapper, positioned at
+the start of the range and with Content-Length set to its length; gunicorn
+then sends it with sendfile(2). Servers without a file wrapper read it in
+blocks.
+"""
+import hashlib
+import mimetypes
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from flask import Response, request
+from werkzeug.http import http_date, is_resource_modified
+from werkzeug.wsgi import wrap_file
+
+from utils.storage import storage, LocalStorage
+
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR") or os.path.join(os.path.dirname(os.path.dirname(__file__)), "media_cache")
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+# Larger objects are not cached; /media redirects to the bucket for them
+MEDIA_CACHE_MAX_OBJECT_BYTES = int(os.getenv("MEDIA_CACHE_MAX_OBJECT_BYTES", MEDIA_CACHE_MAX_BYTES // 8))
+MEDIA_CACHE_CONTROL = os.getenv("MEDIA_CACHE_CONTROL", "public, max-age=86400")
+
+# Cached files are re-marked as recently used at most this often (seconds)
+TOUCH_INTERVAL = 60
+# Leftover partial downloads older than this (seconds) are removed on eviction
+STALE_TMP_AGE = 3600
+
+# Upper bounds (ms) of the fetch time histogram buckets
+FETCH_BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float("inf"))
+
+
+class ObjectTooLarge(Exception):
+    """The object is over MEDIA_CACHE_MAX_OBJECT_BYTES and is not cached"""
+
+
+class MediaCache:
+    def __init__(self, root=MEDIA_CACHE_DIR, max_bytes=MEDIA_CACHE_MAX_BYTES,
+                 max_object_bytes=MEDIA_CACHE_MAX_OBJECT_BYTES):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self._used = None  # bytes on disk, from a scan on first use
+        self._lock = threading.Lock()
+        self._fetching = {}  # key -> lock held by the request downloading it
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._fetch_buckets = [0] * len(FETCH_BUCKETS_MS)
+        self._fetch_total_ms = 0.0
+
+    def _file_for(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+        ext = os.path.splitext(key)[1].lower()
+        return os.path.join(self.root, digest[:2], digest + ext)
+
+    def get(self, key):
+        """Local path of a cached copy of the object, fetching it on a miss.
+
+        Raises FileNotFoundError if the bucket has no such object and
+        ObjectTooLarge if it is too big to cache.
+        """
+        path = self._file_for(key)
+        if self._hit(path):
+            return path
+
+        with self._lock:
+            fetch_lock = self._fetching.setdefault(key, threading.Lock())
+        with fetch_lock:
+            try:
+                # Another request may have fetched it while this one waited
+                if self._hit(path):
+                    return path
+                self._fetch(key, path)
+                return path
+            finally:
+                with self._lock:
+                    self._fetching.pop(key, None)
+
+    def _hit(self, path):
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            return False
+        now = time.time()
+        if now - info.st_atime > TOUCH_INTERVAL:
+            # Recency for eviction; mtime keeps the object's Last-Modified
+            os.utime(path, (now, info.st_mtime))
+        with self._lock:
+            self._hits += 1
+        return True
+
+    def _fetch(self, key, path):
+        started = time.time()
+        body, info = storage.open(key)
+        try:
+            if info["size"] is not None and info["size"] > self.max_object_bytes:
+                raise ObjectTooLarge(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{uuid4().hex}.tmp"
+            try:
+                with open(tmp, "wb") as out:
+                    shutil.copyfileobj(body, out, 1024 * 1024)
+                size = os.path.getsize(tmp)
+                modified = info["last_modified"] or time.time()
+                os.utime(tmp, (time.time(), modified))
+                os.replace(tmp, path)
+            except BaseException:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                raise
+        finally:
+            body.close()
+
+        fetch_ms = (time.time() - started) * 1000
+        with self._lock:
+            self._misses += 1
+            self._fetch_total_ms += fetch_ms
+            for i, bound in enumerate(FETCH_BUCKETS_MS):
+                if fetch_ms <= bound:
+                    self._fetch_buckets[i] += 1
+                    break
+            if self._used is None:
+                self._used = self._scan()[1]
+            else:
+                self._used += size
+            over = self._used > self.max_bytes
+        if over:
+            self.evict()
+
+    def _scan(self):
+        """([(last used, size, path)], total bytes) of the cached files"""
+        files, total = [], 0
+        now = time.time()
+        if not os.path.isdir(self.root):
+            return files, total
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    info = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(".tmp"):
+                    if now - info.st_mtime > STALE_TMP_AGE:
+                        self._unlink(entry.path)
+                    continue
+                files.append((info.st_atime, info.st_size, entry.path))
+                total += info.st_size
+        return files, total
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+            return True
+        except OSError:
+            return False
+
+    def evict(self):
+        """Delete least recently used files until the cache is under 90% of its bound"""
+        files, total = self._scan()
+        target = self.max_bytes * 0.9
+        evicted = 0
+        # Requests already serving a deleted file keep their open descriptor
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            if self._unlink(path):
+                total -= size
+                evicted += 1
+        with self._lock:
+            self._used = total
+            self._evictions += evicted
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": not isinstance(storage, LocalStorage),
+                "hits_total": self._hits,
+                "misses_total": self._misses,
+                "evictions_total": self._evictions,
+                "bytes_used": self._used,
+                "max_bytes": self.max_bytes,
+                "max_object_bytes": self.max_object_bytes,
+                "fetching": len(self._fetching),
+                "fetch_ms_total": round(self._fetch_total_ms, 2),
+                "fetch_ms_histogram": {
+                    ("+Inf" if bound == float("inf") else str(bound)): count
+                    for bound, count in zip(FETCH_BUCKETS_MS, self._fetch_buckets)
+                }
+            }
+
+
+media_cache = MediaCache()
+
+
+def local_path(key):
+    """Path of a local file holding the object (see MediaCache.get for errors)"""
+    if isinstance(storage, LocalStorage):
+        path = storage.path_for(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(key)
+        return path
+    return media_cache.get(key)
+
+
+class _FileRange:
+    """A file limited to `length` bytes from its current position.
+
+    Keeps fileno() so servers can sendfile() it: gunicorn sends from the
+    current offset and stops at the response's Content-Length.
+    """
+
+    def __init__(self, fh, length):
+        self.fh = fh
+        self.remaining = length
+
+    def fileno(self):
+        return self.fh.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fh.read(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fh.close()
+
+
+def _if_range_matches(etag, last_modified):
+    if_range = request.if_range
+    if if_range.etag is not None:
+        # If-Range needs a strong match
+        return if_range.etag == etag.strip('"')
+    if if_range.date is not None:
+        return int(last_modified.timestamp()) == int(if_range.date.timestamp())
+    return True
+
+
+def send_object(key, path):
+    """Response for a stored object's local file honouring conditional and Range headers"""
+    fh = open(path, "rb")
+    try:
+        info = os.fstat(fh.fileno())
+        size = info.st_size
+        last_modified = datetime.fromtimestamp(int(info.st_mtime), timezone.utc)
+        etag = f'"{size:x}-{int(info.st_mtime):x}-{hashlib.blake2b(key.encode("utf-8"), digest_size=6).hexdigest()}"'
+
+        headers = {
+            "ETag": etag,
+            "Last-Modified": http_date(last_modified),
+            "Accept-Ranges": "bytes",
+            "Cache-Control": MEDIA_CACHE_CONTROL
+        }
+        mimetype = mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            fh.close()
+            return Response(status=304, headers=headers)
+
+        status, start, length = 200, 0, size
+        byte_range = request.range
+        if byte_range is not None and len(byte_range.ranges) == 1 and _if_range_matches(etag, last_modified):
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                fh.close()
+                headers["Content-Range"] = f"bytes */{size}"
+                return Response(status=416, headers=headers)
+            start, stop = bounds
+            status, length = 206, stop - start
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+
+        headers["Content-Length"] = str(length)
+        if request.method == "HEAD":
+            fh.close()
+            return Response(status=status, headers=headers, mimetype=mimetype)
+
+        fh.seek(start)
+        body = wrap_file(request.environ, _FileRange(fh, length), 256 * 1024)
+        return Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
+    except BaseException:
+        fh.close()
+        raise
@@ -0,0 +1,210 @@
+"""
+Content-addressed storage of uploaded media.
+
+media_objects maps the SHA-256 of every file stored through the API to the
+single object holding it and counts the posts/advertisements columns that
+point at it. Uploading a file that is already stored only adds a reference,
+and an object is removed from the bucket once its last reference is gone.
+Direct browser uploads are hashed from storage at finalize and registered
+the same way. Objects stored before this table existed are untracked and
+are removed once no row references their URL.
+"""
+import hashlib
+import logging
+import os
+from collections import Counter
+
+from psycopg2.extras import execute_values
+
+from utils.db import get_db_connection, return_db_connection
+from utils.derivatives import derivative_paths
+from utils.storage import storage, upload_file
+
+logger = logging.getLogger("media")
+
+# Keys per storage remove call (the storage API caps one request)
+STORAGE_REMOVE_BATCH = int(os.getenv("STORAGE_REMOVE_BATCH", 1000))
+HASH_BUFFER = 64 * 1024
+
+def lookup(sha256, size):
+    """URL of the stored object with this content, or None"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT url FROM media_objects WHERE sha256 = %s AND size = %s", (sha256, size))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        return_db_connection(conn)
+    return row[0] if row else None
+
+
+def acquire(sha256, size):
+    """Add a reference to a stored object with this content; returns its URL or None"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE media_objects SET refcount = refcount + 1
+            WHERE sha256 = %s AND size = %s
+            RETURNING url
+        """, (sha256, size))
+        row = cur.fetchone()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        return_db_connection(conn)
+    return row[0] if row else None
+
+
+def store(path, stream, content_type):
+    """Store an uploaded file once per distinct content and return its public URL.
+
+    `stream` must be a SpooledUpload, whose hash and size were computed as
+    the upload arrived. If the same bytes are already stored their URL is
+    returned with one more reference and nothing is sent to storage;
+    otherwise the file is uploaded under `path`.
+    """
+    sha256, size = stream.sha256, stream.size
+    url = acquire(sha256, size)
+    if url:
+        logger.debug("Reusing stored object for sha256 %s", sha256[:12])
+        return url
+
+    return register(path, upload_file(path, stream, content_type), sha256, size, content_type)
+
+
+def register(path, url, sha256, size, content_type):
+    """Record a freshly stored object with one reference and return the URL to use.
+
+    If the same content was registered meanwhile (a concurrent upload, or a
+    direct upload of a file already stored), that copy gains the reference
+    and the object at `path` is removed.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO media_objects (sha256, path, url, size, content_type, refcount)
+            VALUES (%s, %s, %s, %s, %s, 1)
+            ON CONFLICT (sha256) DO UPDATE SET refcount = media_objects.refcount + 1
+            RETURNING path, url
+        """, (sha256, path, url, size, content_type))
+        stored_path, stored_url = cur.fetchone()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        return_db_connection(conn)
+
+    if stored_path != path:
+        remove_objects([path], with_derivatives=False)
+    return stored_url
+
+
+def hash_object(path):
+    """(sha256, size) of a stored object, read back from storage"""
+    digest = hashlib.sha256()
+    size = 0
+    body, _ = storage.open(path)
+    with body:
+        while True:
+            block = body.read(HASH_BUFFER)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def reference(url):
+    """Add a reference to an existing object a new row will also point at.
+
+    Returns False if the URL is not one of this bucket's objects. Untracked
+    objects need no count: they are kept while any row references them.
+    """
+    if not storage.path_from_url(url):
+        return False
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("UPDATE media_objects SET refcount = refcount + 1 WHERE url = %s", (url,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        return_db_connection(conn)
+    return True
+
+
+def release(cur, urls):
+    """Drop one reference per URL within the caller's transaction.
+
+    Call this after deleting the rows that held the URLs and before
+    committing. Returns the storage keys that are no longer referenced;
+    pass them to remove_objects once the transaction has committed.
+    """
+    counts = Counter(url for url in urls if url)
+    if not counts:
+        return []
+
+    rows = execute_values(cur, """
+        UPDATE media_objects AS m SET refcount = m.refcount - v.n
+        FROM (VALUES %s) AS v(url, n)
+        WHERE m.url = v.url
+        RETURNING m.url, m.path, m.refcount
+    """, list(counts.items()), fetch=True)
+    tracked = {url for url, _, _ in rows}
+    freed = [path for _, path, refcount in rows if refcount <= 0]
+    if freed:
+        cur.execute("DELETE FROM media_objects WHERE path = ANY(%s) AND refcount <= 0", (freed,))
+
+    untracked = [url for url in counts if url not in tracked]
+    if untracked:
+        cur.execute("""
+            SELECT u FROM unnest(%s::text[]) AS u
+            WHERE NOT EXISTS (SELECT 1 FROM posts WHERE media_url = u OR thumbnail_url = u)
+              AND NOT EXISTS (SELECT 1 FROM advertisements WHERE media_url = u)
+        """, (untracked,))
+        for (url,) in cur.fetchall():
+            path = storage.path_from_url(url)
+            if path:
+                freed.append(path)
+    return freed
+
+
+def remove_objects(paths, with_derivatives=True):
+    """Delete objects (and their image derivatives) from storage; failures are only logged"""
+    paths = list(paths)
+    if with_derivatives:
+        paths += [derived for path in paths for derived in derivative_paths(path)]
+    for start in range(0, len(paths), STORAGE_REMOVE_BATCH):
+        chunk = paths[start:start + STORAGE_REMOVE_BATCH]
+        try:
+            storage.remove(chunk)
+        except Exception as e:
+            logger.warning("Failed to remove %d storage objects: %s", len(chunk), e)
+
+
+def discard(urls):
+    """Give back references taken by store() for a row that was never created"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        freed = release(cur, urls)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning("Failed to release media references: %s", e)
+        return
+    finally:
+        cur.close()
+        return_db_connection(conn)
+    remove_objects(freed)
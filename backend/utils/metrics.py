@@ -0,0 +1,213 @@
+"""
+In-process metrics in the Prometheus text exposition format, served at /metrics.
+
+Counters, gauges and histograms are plain dicts keyed by label values and
+guarded by one lock each; recording a value costs a dict lookup, a bisect
+over the bucket bounds and a few additions. Values are per worker process,
+so scrape each worker (or aggregate by instance label) as usual.
+
+`init_app` instruments request handling: per-route latency histograms,
+response counts by status and in-flight gauges. The DB pool and storage backends
+record into the metrics defined at the bottom of this module.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import request
+
+logger = logging.getLogger("metrics")
+
+# Set to 0 to create the app without request instrumentation (/metrics stays)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# Upper bounds (seconds) of the default latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1024, 16384, 131072, 1048576, 8388608, 67108864, 268435456, 1073741824)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in items
+        ]
+
+
+class Gauge(Metric):
+    """A value that goes up and down; `collect` (returning {labels: value})
+    reads it from elsewhere at scrape time instead"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        if self.collect is not None:
+            try:
+                items = list((self.collect() or {}).items())
+            except Exception as e:
+                logger.warning("Failed to collect %s: %s", self.name, e)
+                items = []
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in items
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then sum
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self):
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        lines = self.header()
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render():
+    """Every registered metric in the text exposition format (version 0.0.4)"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to build the response, by route",
+    ("blueprint", "route", "method")
+)
+HTTP_RESPONSES = Counter(
+    "http_responses_total", "Responses sent, by route and status code",
+    ("blueprint", "route", "method", "status")
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests being handled, by blueprint", ("blueprint",)
+)
+
+DB_POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds", "Time spent waiting to check out a pooled connection"
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Time to execute a statement, by statement type", ("statement",)
+)
+
+STORAGE_UPLOAD_SECONDS = Histogram(
+    "storage_upload_duration_seconds", "Time to upload an object, by backend and outcome",
+    ("backend", "outcome"), buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+STORAGE_UPLOAD_BYTES = Histogram(
+    "storage_upload_bytes", "Size of uploaded objects, by backend", ("backend",), buckets=SIZE_BUCKETS
+)
+
+
+def init_app(app):
+    """Record latency, status counts and in-flight requests for every route.
+
+    Wraps app.full_dispatch_request (before_request hooks, the view and
+    after_request hooks) rather than adding hooks of its own: that is one
+    context lookup per request instead of one per hook and per `g` access,
+    which keeps the cost to a few microseconds.
+    """
+    dispatch = app.full_dispatch_request
+
+    def full_dispatch_request():
+        req = request._get_current_object()
+        rule = req.url_rule
+        blueprint = req.blueprint or ""
+        labels = (blueprint, rule.rule if rule is not None else "unmatched", req.method)
+        HTTP_IN_FLIGHT.inc(blueprint)
+        start = time.perf_counter()
+        status = 500  # unless a response comes back; Flask turns the error into one
+        try:
+            response = dispatch()
+            status = response.status_code
+            return response
+        finally:
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, *labels)
+            HTTP_RESPONSES.inc(*labels, status)
+            HTTP_IN_FLIGHT.dec(blueprint)
+
+    app.full_dispatch_request = full_dispatch_request
@@ -0,0 +1,182 @@
+"""
+Password hashing on a dedicated, bounded worker pool.
+
+bcrypt is deliberately slow, so hashing on request threads lets a burst of
+logins occupy every thread and starve other traffic. Hashes run on
+PASSWORD_HASH_WORKERS threads instead (bcrypt releases the GIL, so they
+run in parallel), with at most PASSWORD_HASH_QUEUE more jobs waiting.
+Beyond that, submissions fail at once with HashPoolFull, which the routes
+turn into 503 + Retry-After.
+
+The cost factor is PASSWORD_HASH_ROUNDS. Stored hashes made with a
+different cost are rehashed in the background after a successful login.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask_bcrypt import Bcrypt
+
+logger = logging.getLogger("auth")
+
+# bcrypt cost factor (log2 of the number of rounds) for new hashes
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+# Jobs allowed to wait for a worker before new ones are rejected
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", 32))
+# Seconds a request waits for its hash (queueing included) before giving up
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", 10))
+
+# Upper bounds (ms) of the hash latency and queue wait histogram buckets
+HASH_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+
+_bcrypt = Bcrypt()
+
+
+class HashPoolFull(Exception):
+    """Raised when the hashing queue is full or a hash does not finish in time"""
+
+
+def _cost(password_hash):
+    """Cost factor of a bcrypt hash ("$2b$12$..."), or None if it is not one"""
+    try:
+        return int(password_hash.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(HASH_BUCKETS_MS)
+        self.total_ms = 0.0
+
+    def record(self, ms):
+        self.total_ms += ms
+        for i, bound in enumerate(HASH_BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+
+    def snapshot(self):
+        return {
+            "total_ms": round(self.total_ms, 2),
+            "histogram": {
+                ("+Inf" if bound == float("inf") else str(bound)): count
+                for bound, count in zip(HASH_BUCKETS_MS, self.buckets)
+            }
+        }
+
+
+class PasswordHasher:
+    """bcrypt hash/verify on a fixed thread pool with a bounded queue"""
+
+    def __init__(self, rounds=PASSWORD_HASH_ROUNDS, workers=PASSWORD_HASH_WORKERS,
+                 queue_size=PASSWORD_HASH_QUEUE, timeout=PASSWORD_HASH_TIMEOUT):
+        self.rounds = rounds
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        # One slot per running or queued job
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self._pending = 0
+        self._completed = {}
+        self._rejected = 0
+        self._timeouts = 0
+        self._hash_ms = _Histogram()
+        self._wait_ms = _Histogram()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+            return self._executor
+
+    def _submit(self, op, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HashPoolFull("Password hashing queue is full")
+        submitted = time.time()
+        with self._lock:
+            self._pending += 1
+
+        def run():
+            started = time.time()
+            try:
+                return fn(*args)
+            finally:
+                finished = time.time()
+                with self._lock:
+                    self._pending -= 1
+                    self._completed[op] = self._completed.get(op, 0) + 1
+                    self._wait_ms.record((started - submitted) * 1000)
+                    self._hash_ms.record((finished - started) * 1000)
+                self._slots.release()
+
+        try:
+            return self._get_executor().submit(run)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+            raise
+
+    def _wait(self, future):
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            raise HashPoolFull(f"Password hashing did not finish within {self.timeout:.0f}s")
+
+    def hash(self, password):
+        """bcrypt hash of password at the configured cost"""
+        future = self._submit("hash", _bcrypt.generate_password_hash, password, self.rounds)
+        return self._wait(future).decode("utf-8")
+
+    def check(self, password_hash, password):
+        """Whether password matches the stored hash"""
+        return self._wait(self._submit("check", _bcrypt.check_password_hash, password_hash, password))
+
+    def needs_rehash(self, password_hash):
+        return _cost(password_hash) != self.rounds
+
+    def rehash_later(self, password, on_hashed):
+        """Hash password in the background and pass the new hash to on_hashed.
+
+        Best effort: when the queue is full nothing is done, and the next
+        login tries again.
+        """
+        def rehash():
+            new_hash = _bcrypt.generate_password_hash(password, self.rounds).decode("utf-8")
+            try:
+                on_hashed(new_hash)
+            except Exception as e:
+                logger.warning("Password rehash failed: %s", e)
+
+        try:
+            self._submit("rehash", rehash)
+        except HashPoolFull:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rounds": self.rounds,
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "pending": self._pending,
+                "completed_total": dict(self._completed),
+                "rejected_total": self._rejected,
+                "timeouts_total": self._timeouts,
+                "hash_ms": self._hash_ms.snapshot(),
+                "queue_wait_ms": self._wait_ms.snapshot()
+            }
+
+
+password_hasher = PasswordHasher()
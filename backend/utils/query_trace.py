@@ -0,0 +1,287 @@
+"""
+Per-statement tracing: fingerprints, aggregates, a slow-query log and
+sampled EXPLAIN plans.
+
+Every statement run through a pool connection (see TimedCursorMixin in
+utils/db.py) is reduced to a fingerprint: its text with literals and
+parameters replaced by ?, IN/VALUES lists collapsed and whitespace
+normalized, so `WHERE id = %s` with any id is one entry. Per fingerprint
+this worker keeps calls, errors, total/max time, rows and the routes that
+ran it; they are served by GET /api/admin/queries.
+
+Statements slower than SLOW_QUERY_MS are logged (fingerprint, time, rows,
+route; never parameter values) and kept in a ring buffer. For a sample of
+them (SLOW_QUERY_EXPLAIN_SAMPLE, at most once per fingerprint every
+SLOW_QUERY_EXPLAIN_INTERVAL seconds) the plan is captured on a background
+thread with its own connection: `EXPLAIN (ANALYZE, BUFFERS)` for read-only
+statements, and a plain EXPLAIN for writes, which must not run twice.
+EXPLAIN has to run the statement with its values, so the plan is taken as
+JSON and every literal in its conditions is replaced by ? before it is
+stored; a failed capture keeps only the error class.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+from flask import has_request_context, request
+
+logger = logging.getLogger("slow_query")
+
+# Statements slower than this (ms) are logged and may get an EXPLAIN
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 500))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", 200))
+# Share of slow statements whose plan is captured
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", 0.1))
+# Seconds between two plan captures for the same fingerprint
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", 300))
+# Milliseconds an EXPLAIN ANALYZE may run before it is cancelled
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", 10000))
+# Distinct fingerprints tracked per worker; statements beyond are counted only
+QUERY_STATS_MAX_FINGERPRINTS = int(os.getenv("QUERY_STATS_MAX_FINGERPRINTS", 2000))
+QUERY_TRACE_ENABLED = os.getenv("QUERY_TRACE_ENABLED", "1") != "0"
+
+# Routes remembered per fingerprint
+MAX_ROUTES = 10
+
+_STATEMENT_RE = re.compile(r"\s*(\w+)")
+STATEMENT_TYPES = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "COPY"}
+
+_NORMALIZE = [
+    (re.compile(r"--[^\n]*"), " "),
+    (re.compile(r"/\*.*?\*/", re.S), " "),
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"%\(\w+\)s|%s"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\s+"), " "),
+    # IN (?, ?, ?) and VALUES (?, ?), (?, ?) collapse to one entry
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?)"),
+    (re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+"), "(?)"),
+]
+_WRITES_RE = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.I)
+# Literals that may appear in a plan's conditions ("Filter", "Index Cond", ...)
+_PLAN_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+]
+
+
+def statement_type(query):
+    """SELECT/INSERT/UPDATE/DELETE/WITH/COPY, or OTHER, for a query string"""
+    if isinstance(query, bytes):
+        query = query[:64].decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        return "OTHER"  # a psycopg2.sql.Composed
+    match = _STATEMENT_RE.match(query)
+    verb = match.group(1).upper() if match else ""
+    return verb if verb in STATEMENT_TYPES else "OTHER"
+
+
+def normalize(query):
+    """Statement text with literals and parameters replaced by ?"""
+    for pattern, replacement in _NORMALIZE:
+        query = pattern.sub(replacement, query)
+    return query.strip()
+
+
+_fingerprints = {}  # query string -> (fingerprint, normalized text)
+
+
+def fingerprint(query):
+    """(fingerprint id, normalized text) of a statement; cached per query string"""
+    cached = _fingerprints.get(query)
+    if cached is None:
+        text = query.decode("utf-8", "replace") if isinstance(query, bytes) else str(query)
+        text = normalize(text)
+        cached = (hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest(), text)
+        if len(_fingerprints) >= 4 * QUERY_STATS_MAX_FINGERPRINTS:
+            _fingerprints.clear()
+        _fingerprints[query] = cached
+    return cached
+
+
+def scrub_plan(node):
+    """A JSON plan with the literals in its text fields replaced by ?; the
+    numeric fields (costs, rows, timings, buffers) are kept"""
+    if isinstance(node, dict):
+        return {key: scrub_plan(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [scrub_plan(value) for value in node]
+    if isinstance(node, str):
+        for pattern, replacement in _PLAN_LITERALS:
+            node = pattern.sub(replacement, node)
+    return node
+
+
+def current_route():
+    if has_request_context():
+        rule = request.url_rule
+        return f"{request.method} {rule.rule if rule is not None else request.path}"
+    return threading.current_thread().name
+
+
+class QueryStats:
+    def __init__(self, max_fingerprints=QUERY_STATS_MAX_FINGERPRINTS):
+        self.max_fingerprints = max_fingerprints
+        self._entries = {}
+        self._slow = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        self._lock = threading.Lock()
+        self._untracked = 0
+        self._since = time.time()
+
+        self._explain_queue = deque(maxlen=8)
+        self._explain_ready = threading.Event()
+        self._explain_thread = None
+        self._explained_at = {}  # fingerprint -> time of the last capture
+        self._local = threading.local()  # set on the explain thread itself
+
+    def record(self, cursor, query, vars, ms, failed):
+        if getattr(self._local, "explaining", False):
+            return
+        fp, text = fingerprint(query)
+        rows = cursor.rowcount if not failed and cursor.rowcount and cursor.rowcount > 0 else 0
+        route = current_route()
+        with self._lock:
+            entry = self._entries.get(fp)
+            if entry is None:
+                if len(self._entries) >= self.max_fingerprints:
+                    self._untracked += 1
+                    entry = None
+                else:
+                    entry = self._entries[fp] = {
+                        "fingerprint": fp, "query": text, "calls": 0, "errors": 0,
+                        "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "slow": 0,
+                        "routes": {}, "plan": None
+                    }
+            if entry is not None:
+                entry["calls"] += 1
+                entry["total_ms"] += ms
+                entry["rows"] += rows
+                if failed:
+                    entry["errors"] += 1
+                if ms > entry["max_ms"]:
+                    entry["max_ms"] = ms
+                routes = entry["routes"]
+                if route in routes or len(routes) < MAX_ROUTES:
+                    routes[route] = routes.get(route, 0) + 1
+                if ms >= SLOW_QUERY_MS:
+                    entry["slow"] += 1
+
+        if ms >= SLOW_QUERY_MS:
+            self._slow_query(cursor, fp, text, query, vars, ms, rows, route, failed)
+
+    def _slow_query(self, cursor, fp, text, query, vars, ms, rows, route, failed):
+        self._slow.append({
+            "at": time.time(), "fingerprint": fp, "ms": round(ms, 2), "rows": rows,
+            "route": route, "failed": failed
+        })
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning("%.1fms %s rows=%s route=%s fingerprint=%s: %s",
+                           ms, "failed" if failed else "ok", rows, route, fp, text[:500])
+
+        # Named (server-side) cursors only declare here; nothing to explain
+        if failed or getattr(cursor, "name", None) or statement_type(query) not in STATEMENT_TYPES - {"COPY"}:
+            return
+        if random.random() >= SLOW_QUERY_EXPLAIN_SAMPLE:
+            return
+        now = time.time()
+        with self._lock:
+            if now - self._explained_at.get(fp, 0) < SLOW_QUERY_EXPLAIN_INTERVAL:
+                return
+            self._explained_at[fp] = now
+        try:
+            statement = cursor.mogrify(query, vars)
+        except Exception:
+            return
+        self._explain_queue.append((fp, statement))
+        self._start_explainer()
+
+    def _start_explainer(self):
+        with self._lock:
+            if self._explain_thread is None:
+                self._explain_thread = threading.Thread(target=self._explain_loop, name="query-explain", daemon=True)
+                self._explain_thread.start()
+        self._explain_ready.set()
+
+    def _explain_loop(self):
+        self._local.explaining = True
+        while True:
+            self._explain_ready.wait()
+            self._explain_ready.clear()
+            while self._explain_queue:
+                fp, statement = self._explain_queue.popleft()
+                plan = self._explain(statement)
+                with self._lock:
+                    entry = self._entries.get(fp)
+                    if entry is not None:
+                        entry["plan"] = plan
+
+    def _explain(self, statement):
+        # Imported here: utils.db imports this module
+        from utils.db import get_unscoped_connection, return_db_connection
+
+        text = statement.decode("utf-8", "replace") if isinstance(statement, bytes) else statement
+        analyze = not _WRITES_RE.search(normalize(text))
+        options = "ANALYZE, BUFFERS" if analyze else "COSTS"
+        conn = None
+        try:
+            conn = get_unscoped_connection()
+            cur = conn.cursor()
+            cur.execute("SET LOCAL statement_timeout = %s", (SLOW_QUERY_EXPLAIN_TIMEOUT_MS,))
+            cur.execute(f"EXPLAIN ({options}, FORMAT JSON) {text}")
+            plan = cur.fetchone()[0]
+            cur.close()
+            if isinstance(plan, str):
+                plan = json.loads(plan)  # json typecaster not registered
+            return {"captured_at": time.time(), "analyze": analyze, "plan": scrub_plan(plan)}
+        except Exception as e:
+            # Error messages can quote the values that caused them
+            return {"captured_at": time.time(), "analyze": analyze, "error": type(e).__name__}
+        finally:
+            if conn:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                return_db_connection(conn)
+
+    def top(self, sort="total_ms", limit=50):
+        """Aggregates per fingerprint, largest `sort` first"""
+        with self._lock:
+            entries = [
+                {**entry, "routes": dict(entry["routes"])} for entry in self._entries.values()
+            ]
+        for entry in entries:
+            entry["mean_ms"] = round(entry["total_ms"] / entry["calls"], 3) if entry["calls"] else 0.0
+            entry["total_ms"] = round(entry["total_ms"], 2)
+            entry["max_ms"] = round(entry["max_ms"], 2)
+        entries.sort(key=lambda entry: entry[sort], reverse=True)
+        return entries[:limit]
+
+    def slow_log(self):
+        return list(reversed(self._slow))
+
+    def summary(self):
+        with self._lock:
+            return {
+                "since": self._since,
+                "fingerprints": len(self._entries),
+                "untracked_calls": self._untracked,
+                "slow_query_ms": SLOW_QUERY_MS
+            }
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._slow.clear()
+            self._explained_at.clear()
+            self._untracked = 0
+            self._since = time.time()
+
+
+query_stats = QueryStats()
@@ -0,0 +1,176 @@
+"""
+Reconcile the storage bucket against the database: find objects that no row
+references any more and delete them.
+
+Objects can outlive their rows when a storage delete failed, a retry in
+upload_post stored a second copy, or a direct upload was never finalized.
+A run:
+1. pages through the bucket listing of each prefix (RECONCILE_PREFIXES),
+   at most RECONCILE_LIST_PER_SEC listing calls a second;
+2. then loads the keys the database references: posts.media_url and
+   thumbnail_url, advertisements.media_url, media_derivatives.path and
+   media_objects.path. Loading them after listing means any object a row
+   pointed at when listing began is seen as referenced;
+3. treats every listed key missing from that set as an orphan, unless it
+   was modified within the grace period (an upload may still be on its way
+   to its row) or its age is unknown;
+4. deletes orphans in batches of RECONCILE_DELETE_BATCH keys, at most
+   RECONCILE_DELETES_PER_SEC objects a second, so live traffic keeps its
+   share of the storage API. A dry run stops before this step.
+
+`reconcile()` yields progress events like utils.batch.chunked_delete; the
+last one has "done": True and the full report.
+"""
+import logging
+import os
+import threading
+import time
+from uuid import uuid4
+
+from utils.db import get_unscoped_connection, return_db_connection
+from utils.storage import storage
+
+logger = logging.getLogger("reconcile")
+
+RECONCILE_PREFIXES = tuple(os.getenv("RECONCILE_PREFIXES", "video/,image/,Ad/,ad/").split(","))
+# Objects modified more recently than this (hours) are never deleted
+RECONCILE_GRACE_HOURS = float(os.getenv("RECONCILE_GRACE_HOURS", 24))
+RECONCILE_PAGE_SIZE = int(os.getenv("RECONCILE_PAGE_SIZE", 1000))
+RECONCILE_LIST_PER_SEC = float(os.getenv("RECONCILE_LIST_PER_SEC", 5))
+RECONCILE_DELETE_BATCH = int(os.getenv("RECONCILE_DELETE_BATCH", 100))
+RECONCILE_DELETES_PER_SEC = float(os.getenv("RECONCILE_DELETES_PER_SEC", 100))
+# Orphan keys listed in a report (the counts always cover all of them)
+RECONCILE_REPORT_LIMIT = int(os.getenv("RECONCILE_REPORT_LIMIT", 1000))
+
+REFERENCE_QUERY = """
+    SELECT media_url FROM posts
+    UNION ALL SELECT thumbnail_url FROM posts WHERE thumbnail_url IS NOT NULL
+    UNION ALL SELECT media_url FROM advertisements
+"""
+PATH_QUERY = """
+    SELECT path FROM media_derivatives
+    UNION ALL SELECT path FROM media_objects WHERE refcount > 0
+"""
+
+# One run at a time per worker; the storage API is shared with live traffic
+_run_lock = threading.Lock()
+
+
+class ReconcileBusy(Exception):
+    """Another reconcile run is in progress"""
+
+
+class RateLimiter:
+    """Spaces out work so no more than `rate` units are done per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+
+    def wait(self, units=1):
+        now = time.monotonic()
+        if self._next > now:
+            time.sleep(self._next - now)
+            now = self._next
+        self._next = now + units * self.interval
+
+
+def list_objects(prefix, limiter, page_size=RECONCILE_PAGE_SIZE):
+    """Every object under prefix, one rate-limited listing page at a time"""
+    offset = 0
+    while True:
+        limiter.wait()
+        page = storage.list_page(prefix, page_size, offset)
+        yield from page
+        if len(page) < page_size:
+            return
+        offset += page_size
+
+
+def referenced_paths():
+    """Storage keys any row points at, read with a server-side cursor"""
+    conn = get_unscoped_connection()
+    paths = set()
+    try:
+        for query, is_url in ((REFERENCE_QUERY, True), (PATH_QUERY, False)):
+            named = conn.cursor(name=f"reconcile_{uuid4().hex}")
+            named.itersize = 5000
+            named.execute(query)
+            for (value,) in named:
+                path = storage.path_from_url(value) if is_url else value
+                if path:
+                    paths.add(path)
+            named.close()
+        conn.rollback()
+    finally:
+        return_db_connection(conn)
+    return paths
+
+
+def is_running():
+    return _run_lock.locked()
+
+
+def reconcile(prefixes=RECONCILE_PREFIXES, grace_hours=RECONCILE_GRACE_HOURS, dry_run=True):
+    """Find (and unless dry_run, delete) unreferenced objects; yields progress dicts.
+
+    Raises ReconcileBusy from the first next() if a run is already going.
+    """
+    if not _run_lock.acquire(blocking=False):
+        raise ReconcileBusy("A reconcile run is already in progress")
+    try:
+        started = time.time()
+        cutoff = started - grace_hours * 3600
+        list_limiter = RateLimiter(RECONCILE_LIST_PER_SEC)
+
+        listed = {}
+        for prefix in prefixes:
+            listed[prefix] = list(list_objects(prefix, list_limiter))
+            yield {"phase": "list", "prefix": prefix, "objects": len(listed[prefix])}
+
+        referenced = referenced_paths()
+        yield {"phase": "references", "referenced": len(referenced)}
+
+        report = {"prefixes": {}, "orphans": [], "dry_run": dry_run, "grace_hours": grace_hours}
+        to_delete = []
+        for prefix, objects in listed.items():
+            counts = {"objects": len(objects), "referenced": 0, "orphans": 0,
+                      "orphan_bytes": 0, "in_grace_period": 0}
+            for obj in objects:
+                if obj["path"] in referenced:
+                    counts["referenced"] += 1
+                elif obj["updated_at"] is None or obj["updated_at"] > cutoff:
+                    counts["in_grace_period"] += 1
+                else:
+                    counts["orphans"] += 1
+                    counts["orphan_bytes"] += obj["size"] or 0
+                    to_delete.append(obj["path"])
+                    if len(report["orphans"]) < RECONCILE_REPORT_LIMIT:
+                        report["orphans"].append(obj)
+            report["prefixes"][prefix] = counts
+
+        deleted = failed = 0
+        if not dry_run:
+            delete_limiter = RateLimiter(RECONCILE_DELETES_PER_SEC)
+            for start in range(0, len(to_delete), RECONCILE_DELETE_BATCH):
+                batch = to_delete[start:start + RECONCILE_DELETE_BATCH]
+                delete_limiter.wait(len(batch))
+                try:
+                    storage.remove(batch)
+                    deleted += len(batch)
+                except Exception as e:
+                    failed += len(batch)
+                    logger.warning("Failed to remove %s orphaned objects: %s", len(batch), e)
+                yield {"phase": "delete", "deleted": deleted, "failed": failed, "orphans": len(to_delete)}
+
+        yield {
+            "done": True,
+            **report,
+            "orphans_total": len(to_delete),
+            "orphan_bytes": sum(counts["orphan_bytes"] for counts in report["prefixes"].values()),
+            "deleted": deleted,
+            "failed": failed,
+            "seconds": round(time.time() - started, 3)
+        }
+    finally:
+        _run_lock.release()
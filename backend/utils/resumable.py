@@ -0,0 +1,225 @@
+"""
+Chunk storage and housekeeping for resumable uploads.
+
+Session and chunk bookkeeping lives in the upload_sessions/upload_chunks
+tables; chunk bytes are objects in the storage backend under
+UPLOAD_CHUNK_PREFIX, so any worker on any host can accept the next chunk
+or finalize the upload. Chunk keys include the chunk's sha256: re-sending
+a chunk stores a new object instead of overwriting the one its row points
+at, so the table and the bucket never disagree. A superseded object is
+removed only after the row pointing at the new one is committed.
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from utils.db import get_db_connection, return_db_connection
+from utils.storage import storage
+from utils.uploads import SpooledUpload, UPLOAD_MAX_FILE_BYTES, open_upload
+
+logger = logging.getLogger("uploads")
+
+# Bucket folder holding chunks of unfinished uploads, one sub-folder per session
+UPLOAD_CHUNK_PREFIX = os.getenv("UPLOAD_CHUNK_PREFIX", "uploads/")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+UPLOAD_CHUNK_MAX = int(os.getenv("UPLOAD_CHUNK_MAX", 32 * 1024 * 1024))
+# Sessions expire this many seconds after their last chunk
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", 24 * 3600))
+# Minimum seconds between garbage-collection sweeps in one process
+UPLOAD_GC_INTERVAL = int(os.getenv("UPLOAD_GC_INTERVAL", 600))
+
+COPY_BUFFER = 64 * 1024
+LIST_PAGE = 1000
+
+_last_gc = 0.0
+_gc_lock = threading.Lock()
+
+
+def session_prefix(session_id):
+    return f"{UPLOAD_CHUNK_PREFIX}{session_id}/"
+
+
+def chunk_key(session_id, index, sha256):
+    return f"{session_prefix(session_id)}{index:06d}.{sha256}.part"
+
+
+def parse_checksum(header):
+    """Parse a tus-style `Upload-Checksum: sha256 <digest>` header into a hex digest.
+
+    The digest may be base64 (as in tus) or hex. Returns None when the
+    header is absent and raises ValueError when it is unusable.
+    """
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(" ")
+    if algorithm.lower() != "sha256" or not value:
+        raise ValueError("Upload-Checksum must be 'sha256 <digest>'")
+    value = value.strip()
+    if len(value) == 64:
+        try:
+            bytes.fromhex(value)
+            return value.lower()
+        except ValueError:
+            pass
+    try:
+        digest = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("Upload-Checksum digest is not valid base64 or hex")
+    if len(digest) != 32:
+        raise ValueError("Upload-Checksum digest has the wrong length for sha256")
+    return digest.hex()
+
+
+def receive_chunk(stream, max_size):
+    """Buffer a request body, hashing it as it arrives.
+
+    Returns a SpooledUpload (with .size and .sha256) the caller verifies,
+    then passes to store_chunk, and closes. More than `max_size` bytes
+    aborts with 413.
+    """
+    spooled = SpooledUpload(max_size=max_size)
+    try:
+        while True:
+            block = stream.read(COPY_BUFFER)
+            if not block:
+                break
+            spooled.write(block)
+        return spooled
+    except Exception:
+        spooled.close()
+        raise
+
+
+def store_chunk(session_id, index, spooled):
+    """Upload a verified chunk under its content-addressed key and return the key"""
+    key = chunk_key(session_id, index, spooled.sha256)
+    body = open_upload(spooled)
+    try:
+        storage.upload(key, body, "application/octet-stream")
+    except Exception:
+        # Same key means same bytes: a re-sent chunk may already be there
+        existing = storage.stat(key)
+        if not existing or existing["size"] != spooled.size:
+            raise
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    return key
+
+
+def remove_chunks(keys):
+    """Best-effort removal of chunk objects; leftovers go when the session expires"""
+    keys = [key for key in keys if key]
+    if not keys:
+        return
+    try:
+        storage.remove(keys)
+    except Exception as e:
+        logger.warning("Failed to remove %d upload chunks: %s", len(keys), e)
+
+
+def assemble(session_id, chunks):
+    """Concatenate chunk objects into a disk-backed SpooledUpload.
+
+    `chunks` is [(index, sha256), ...] in index order, as recorded in
+    upload_chunks; each object is checked against its digest on the way.
+    """
+    assembled = SpooledUpload(threshold=0, max_size=UPLOAD_MAX_FILE_BYTES)
+    try:
+        for index, sha256 in chunks:
+            digest = hashlib.sha256()
+            part, _ = storage.open(chunk_key(session_id, index, sha256))
+            with part:
+                while True:
+                    block = part.read(COPY_BUFFER)
+                    if not block:
+                        break
+                    digest.update(block)
+                    assembled.write(block)
+            if digest.hexdigest() != sha256:
+                raise ValueError(f"Chunk {index} does not match its recorded sha256")
+        assembled.seek(0)
+        return assembled
+    except Exception:
+        assembled.close()
+        raise
+
+
+def remove_session_files(session_id):
+    """Remove every chunk object of a session"""
+    prefix = session_prefix(session_id)
+    while True:
+        try:
+            keys = [item["path"] for item in storage.list_page(prefix, LIST_PAGE, 0)]
+        except Exception as e:
+            logger.warning("Failed to list chunks of upload %s: %s", session_id, e)
+            return
+        if not keys:
+            return
+        try:
+            storage.remove(keys)
+        except Exception as e:
+            logger.warning("Failed to remove chunks of upload %s: %s", session_id, e)
+            return
+        if len(keys) < LIST_PAGE:
+            return
+
+
+def expire_sessions(limit=500):
+    """Delete expired sessions and their chunk objects; returns how many were removed.
+
+    Objects go first and rows second, so a crash in between leaves expired
+    rows that the next sweep finds again rather than objects nothing
+    points at.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT id FROM upload_sessions
+            WHERE expires_at < NOW()
+              -- a finalize that died mid-way gets an extra hour of grace
+              AND (status <> 'finalizing' OR expires_at < NOW() - INTERVAL '1 hour')
+            ORDER BY expires_at
+            LIMIT %s
+        """, (limit,))
+        expired = [str(row[0]) for row in cur.fetchall()]
+        conn.commit()
+
+        for session_id in expired:
+            remove_session_files(session_id)
+
+        if expired:
+            cur.execute("""
+                DELETE FROM upload_sessions
+                WHERE id = ANY(%s::uuid[]) AND expires_at < NOW()
+                RETURNING id
+            """, (expired,))
+            expired = cur.fetchall()
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        return_db_connection(conn)
+    return len(expired)
+
+
+def maybe_expire_sessions():
+    """Run expire_sessions at most once per UPLOAD_GC_INTERVAL in this process"""
+    global _last_gc
+    now = time.time()
+    if now - _last_gc < UPLOAD_GC_INTERVAL or not _gc_lock.acquire(blocking=False):
+        return
+    try:
+        _last_gc = now
+        expire_sessions()
+    except Exception as e:
+        logger.warning("Upload session cleanup failed: %s", e)
+    finally:
+        _gc_lock.release()
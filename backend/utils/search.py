@@ -0,0 +1,71 @@
+"""
+Full-text and fuzzy search over posts.
+
+posts.search_vector is a tsvector over title (weight A) and content
+(weight B), kept up to date by a trigger (see create_tables.py), with a
+GIN index, so matching never scans the table.
+Every search term is matched as a prefix. When full-text finds nothing,
+titles are matched by trigram word similarity through a pg_trgm GIN index,
+which tolerates typos. Results are ordered by rank and paged by keyset on
+(rank, id).
+"""
+import os
+import re
+
+# Text search configuration; must match the one search_vector is built with
+SEARCH_CONFIG = os.getenv("SEARCH_CONFIG", "english")
+# Minimum word similarity (0..1) for a fuzzy title match
+SEARCH_FUZZY_THRESHOLD = float(os.getenv("SEARCH_FUZZY_THRESHOLD", 0.4))
+SEARCH_MAX_TERMS = 8
+
+
+def prefix_tsquery(text):
+    """Build a to_tsquery() string matching every word of `text` as a prefix, or None"""
+    terms = re.findall(r"\w+", text.lower())[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    return " & ".join(f"{term}:*" for term in terms)
+
+
+def fulltext_query(columns, text, clauses=(), params=(), after=None, limit=20, table="posts"):
+    """SQL and params for one page of ranked full-text matches; rank is the last column"""
+    conditions = ["search_vector @@ q", *clauses]
+    args = [SEARCH_CONFIG, prefix_tsquery(text), *params]
+    if after is not None:
+        conditions.append("(ts_rank_cd(search_vector, q), id) < (%s::real, %s)")
+        args += [after[0], after[1]]
+    sql = f"""
+        SELECT {columns}, ts_rank_cd(search_vector, q) AS rank
+        FROM {table}, to_tsquery(%s, %s) AS q
+        WHERE {" AND ".join(conditions)}
+        ORDER BY rank DESC, id DESC
+        LIMIT %s
+    """
+    return sql, (*args, limit)
+
+
+def fuzzy_query(columns, text, clauses=(), params=(), after=None, limit=20, table="posts"):
+    """SQL and params for one page of typo-tolerant title matches; rank is the last column.
+
+    The `<%` operator is what lets Postgres use the trigram index; its
+    cut-off is pg_trgm.word_similarity_threshold, set by fuzzy_threshold_sql.
+    """
+    text = " ".join(re.findall(r"\w+", text))
+    conditions = ["%s <%% title", *clauses]
+    args = [text, text, *params]
+    if after is not None:
+        conditions.append("(word_similarity(%s, title), id) < (%s::real, %s)")
+        args += [text, after[0], after[1]]
+    sql = f"""
+        SELECT {columns}, word_similarity(%s, title) AS rank
+        FROM {table}
+        WHERE {" AND ".join(conditions)}
+        ORDER BY rank DESC, id DESC
+        LIMIT %s
+    """
+    return sql, (*args, limit)
+
+
+def fuzzy_threshold_sql():
+    """Statement (and params) setting the fuzzy cut-off for the current transaction"""
+    return "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)", (str(SEARCH_FUZZY_THRESHOLD),)
@@ -0,0 +1,198 @@
+"""
+Row-to-JSON serialization for listings.
+
+RowMapper compiles one function per query shape that turns a row (tuple or
+dict) into a response dict, so per-row work is a single dict build with no
+attribute lookups or isoformat()/str() calls; datetimes, dates, UUIDs and
+Decimals are handled by the JSON encoder instead. The encoder is orjson
+when available (JSON_ENCODER=json forces the standard library) and is also
+installed as the app's Flask JSON provider, so jsonify uses it too.
+
+stream_json_array emits a large listing from a server-side cursor a batch
+at a time, so the whole result never has to be held in memory.
+"""
+import json
+import logging
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID, uuid4
+
+from flask import Response
+from flask.json.provider import JSONProvider
+
+from utils.db import get_unscoped_connection, return_db_connection
+
+logger = logging.getLogger("serializers")
+
+try:
+    import orjson
+except ImportError:  # fall back to the standard library encoder
+    orjson = None
+
+JSON_ENCODER = os.getenv("JSON_ENCODER", "orjson" if orjson else "json")
+# Rows fetched per round trip when streaming from a server-side cursor
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 500))
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if JSON_ENCODER == "orjson" and orjson:
+    def dumps(value):
+        """Serialize to UTF-8 JSON bytes"""
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+else:
+    _encoder = json.JSONEncoder(default=_default, separators=(",", ":"), ensure_ascii=False)
+
+    def dumps(value):
+        """Serialize to UTF-8 JSON bytes"""
+        return _encoder.encode(value).encode("utf-8")
+
+    loads = json.loads
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by the configured encoder"""
+
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
+
+
+class Field:
+    """One output key of a RowMapper.
+
+    `source` is the tuple index or dict key to read. `default` replaces
+    falsy values (like `value or default`); `fallback` is a callable used
+    instead when the replacement must be computed per row.
+    """
+
+    def __init__(self, key, source, default=None, fallback=None):
+        self.key = key
+        self.source = source
+        self.default = default
+        self.fallback = fallback
+
+
+class Const:
+    """An output key with the same value on every row"""
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+
+class RowMapper:
+    """Row -> dict function compiled once for a fixed list of fields"""
+
+    def __init__(self, name, *fields):
+        self.name = name
+        self.keys = [field.key for field in fields]
+        namespace = {}
+        items = []
+        for i, field in enumerate(fields):
+            if isinstance(field, Const):
+                namespace[f"_c{i}"] = field.value
+                items.append(f"{field.key!r}: _c{i}")
+                continue
+            expr = f"row[{field.source!r}]"
+            if field.fallback is not None:
+                namespace[f"_f{i}"] = field.fallback
+                expr = f"({expr} or _f{i}())"
+            elif field.default is not None:
+                namespace[f"_d{i}"] = field.default
+                expr = f"({expr} or _d{i})"
+            items.append(f"{field.key!r}: {expr}")
+
+        source = "def map_row(row):\n    return {" + ", ".join(items) + "}\n"
+        exec(compile(source, f"<RowMapper {name}>", "exec"), namespace)
+        self.map_row = namespace["map_row"]
+
+    def __call__(self, row):
+        return self.map_row(row)
+
+    def many(self, rows):
+        map_row = self.map_row
+        return [map_row(row) for row in rows]
+
+
+def now():
+    return datetime.now()
+
+
+def new_id():
+    return str(uuid4())
+
+
+def stream_json_array(query, params, mapper, enrich=None, batch_size=STREAM_BATCH_SIZE):
+    """Stream a query's rows as a JSON array response.
+
+    Rows are read from a server-side (named) cursor with fetchmany and
+    encoded batch by batch. `enrich(conn, items)` may add fields to each
+    mapped batch using the same connection. The connection is held for the
+    life of the response, so it is checked out outside the request scope
+    and returned when the response is closed, even if it was never read.
+    """
+    conn = get_unscoped_connection()
+
+    def release():
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        return_db_connection(conn)
+
+    def generate():
+        cur = None
+        try:
+            cur = conn.cursor(name=f"stream_{uuid4().hex}")
+            cur.itersize = batch_size
+            cur.execute(query, params)
+            yield b"["
+            first = True
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                items = mapper.many(rows)
+                if enrich is not None:
+                    enrich(conn, items)
+                # Encode the batch as one array and drop its brackets
+                chunk = dumps(items)[1:-1]
+                if first:
+                    first = False
+                    yield chunk
+                else:
+                    yield b"," + chunk
+            yield b"]"
+        except Exception as e:
+            logger.warning("Streaming %s failed: %s", mapper.name, e)
+            raise
+        finally:
+            if cur is not None:
+                try:
+                    cur.close()
+                except Exception:
+                    pass
+
+    response = Response(generate(), mimetype="application/json")
+    response.call_on_close(release)
+    return response
@@ -0,0 +1,415 @@
+"""
+Helpers for moving media between the API and the storage bucket.
+
+STORAGE_BACKEND picks where objects live: "supabase" (the bigteam-video
+bucket, the default) or "local", a directory on disk that mimics the
+bucket - including signed upload URLs - for offline development and tests.
+Both implement StorageBackend.
+
+Nothing here touches the network at import: the Supabase client is created
+on first use, and the bucket is checked (and created if missing) only by
+`ensure_bucket()`, which the app runs from its startup warm-up and the
+storage health/check endpoints.
+"""
+import io
+import logging
+import mimetypes
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from uuid import uuid4
+
+import jwt
+
+from utils.metrics import STORAGE_UPLOAD_SECONDS, STORAGE_UPLOAD_BYTES
+from utils.uploads import open_upload
+
+logger = logging.getLogger("storage")
+
+BUCKET_NAME = "bigteam-video"
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR") or os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage")
+# Base URL the API is reachable at, used to build local object and upload URLs
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:5000").rstrip("/")
+# Seconds a signed upload target stays valid
+SIGNED_UPLOAD_TTL = int(os.getenv("SIGNED_UPLOAD_TTL", 600))
+# Seconds to wait for the bucket to start sending an object
+STORAGE_OPEN_TIMEOUT = float(os.getenv("STORAGE_OPEN_TIMEOUT", 10))
+
+
+def upload_secret():
+    """UPLOAD_SECRET_KEY, which signs upload tickets and local upload URLs.
+
+    It must be set, and be the same for every worker. There is deliberately
+    no fallback: a key committed to the repo or a per-process random one
+    would make tickets forgeable or fail on other workers. create_app()
+    refuses to start without it.
+    """
+    secret = os.getenv("UPLOAD_SECRET_KEY")
+    if not secret:
+        raise RuntimeError("UPLOAD_SECRET_KEY is not set")
+    return secret
+
+
+def sign(claims, ttl):
+    """Sign claims into a short-lived token"""
+    return jwt.encode({**claims, "exp": int(time.time()) + ttl}, upload_secret(), algorithm="HS256")
+
+
+def verify(token, purpose):
+    """Return the claims of a token issued by sign(), or None if invalid or expired"""
+    try:
+        claims = jwt.decode(token, upload_secret(), algorithms=["HS256"])
+    except jwt.PyJWTError:
+        return None
+    return claims if claims.get("purpose") == purpose else None
+
+
+def _body_size(body):
+    """Length of an upload body if it can be told without reading it"""
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    try:
+        position = body.tell()
+        size = body.seek(0, os.SEEK_END) - position
+        body.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class StorageBackend:
+    """Where media objects live, addressed by keys like video/<name>.mp4"""
+
+    name = None
+
+    def upload(self, path, body, content_type):
+        """Store body (bytes or a readable file) under path, recording its duration and size"""
+        start = time.perf_counter()
+        size = _body_size(body)
+        outcome = "error"
+        try:
+            written = self._upload(path, body, content_type)
+            outcome = "ok"
+        finally:
+            STORAGE_UPLOAD_SECONDS.observe(time.perf_counter() - start, self.name, outcome)
+        size = written if written is not None else size
+        if size is not None:
+            STORAGE_UPLOAD_BYTES.observe(size, self.name)
+
+    def _upload(self, path, body, content_type):
+        """Backend-specific upload; may return the number of bytes written"""
+        raise NotImplementedError
+
+    def public_url(self, path):
+        raise NotImplementedError
+
+    def path_from_url(self, url):
+        """Object key for one of this backend's public URLs, or None"""
+        raise NotImplementedError
+
+    def download(self, path):
+        raise NotImplementedError
+
+    def open(self, path):
+        """(readable stream, {"size", "last_modified", "content_type"}) for an object.
+
+        Raises FileNotFoundError if there is no such object. Size and
+        last_modified (a Unix timestamp) may be None when unknown.
+        """
+        body = self.download(path)
+        return io.BytesIO(body), {"size": len(body), "last_modified": None,
+                                  "content_type": mimetypes.guess_type(path)[0]}
+
+    def create_signed_upload(self, path, content_type, max_size):
+        """Signed target the browser can PUT the object body to directly"""
+        raise NotImplementedError
+
+    def stat(self, path):
+        """Size and content type of a stored object, or None if it does not exist"""
+        raise NotImplementedError
+
+    def remove(self, paths):
+        raise NotImplementedError
+
+    def list_page(self, prefix, limit, offset):
+        """Up to `limit` objects directly under `prefix` (e.g. "video/") in name
+        order, starting at `offset`: [{"path", "size", "updated_at"}, ...] with
+        updated_at a Unix timestamp"""
+        raise NotImplementedError
+
+    def ensure_bucket(self):
+        """Make sure the bucket exists, creating it if needed; returns a check() dict"""
+        raise NotImplementedError
+
+    def check(self):
+        """{"backend", "bucket", "bucket_exists", ...} without changing anything"""
+        raise NotImplementedError
+
+
+class SupabaseStorage(StorageBackend):
+    name = "supabase"
+
+    def __init__(self, bucket=BUCKET_NAME):
+        self.bucket = bucket
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """Supabase client, created on first use"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # Imported here: the package is slow to import
+                    from supabase import create_client
+                    self._client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+        return self._client
+
+    def _bucket(self):
+        return self.client.storage.from_(self.bucket)
+
+    def _upload(self, path, body, content_type):
+        self._bucket().upload(path=path, file=body, file_options={"content-type": content_type})
+
+    def public_url(self, path):
+        return self._bucket().get_public_url(path)
+
+    def path_from_url(self, url):
+        """Object key for one of this bucket's public URLs, or None"""
+        marker = f"/{self.bucket}/"
+        if not url or marker not in url:
+            return None
+        return url.split(marker, 1)[1].split("?", 1)[0]
+
+    def download(self, path):
+        return self._bucket().download(path)
+
+    def open(self, path):
+        # Stream from the public URL rather than holding the object in memory
+        try:
+            response = urllib.request.urlopen(self.public_url(path), timeout=STORAGE_OPEN_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code in (400, 404):
+                raise FileNotFoundError(path)
+            raise
+        length = response.headers.get("Content-Length")
+        modified = response.headers.get("Last-Modified")
+        return response, {
+            "size": int(length) if length else None,
+            "last_modified": parsedate_to_datetime(modified).timestamp() if modified else None,
+            "content_type": response.headers.get_content_type()
+        }
+
+    def create_signed_upload(self, path, content_type, max_size):
+        """Signed target the browser can PUT the object body to directly"""
+        signed = self._bucket().create_signed_upload_url(path)
+        return {
+            "url": signed.get("signed_url") or signed.get("signedUrl"),
+            "method": "PUT",
+            "headers": {"Content-Type": content_type}
+        }
+
+    def stat(self, path):
+        """Size and content type of a stored object, or None if it does not exist"""
+        folder, _, name = path.rpartition("/")
+        for item in self._bucket().list(folder, {"search": name, "limit": 100}) or []:
+            if item.get("name") == name:
+                metadata = item.get("metadata") or {}
+                return {"size": metadata.get("size"), "content_type": metadata.get("mimetype")}
+        return None
+
+    def remove(self, paths):
+        if paths:
+            self._bucket().remove(list(paths))
+
+    def list_page(self, prefix, limit, offset):
+        items = self._bucket().list(prefix.rstrip("/"), {
+            "limit": limit,
+            "offset": offset,
+            "sortBy": {"column": "name", "order": "asc"}
+        }) or []
+        objects = []
+        for item in items:
+            if item.get("id") is None:
+                continue  # a sub-folder, not an object
+            metadata = item.get("metadata") or {}
+            stamp = item.get("updated_at") or item.get("created_at")
+            objects.append({
+                "path": prefix + item["name"],
+                "size": metadata.get("size"),
+                "updated_at": datetime.fromisoformat(stamp.replace("Z", "+00:00")).timestamp() if stamp else None
+            })
+        return objects
+
+    def check(self):
+        buckets = [b.name for b in self.client.storage.list_buckets() or []]
+        return {
+            "backend": self.name,
+            "bucket": self.bucket,
+            "bucket_exists": self.bucket in buckets,
+            "buckets": buckets,
+            "url": os.getenv("SUPABASE_URL", "Not configured")
+        }
+
+    def ensure_bucket(self):
+        status = self.check()
+        if not status["bucket_exists"]:
+            try:
+                self.client.storage.create_bucket(self.bucket, options={
+                    "public": True,  # Make bucket public for media access
+                    "allowed_mime_types": ["image/*", "video/*"]
+                })
+            except Exception as e:
+                # Another worker may have created it in the meantime
+                if "already exists" not in str(e).lower():
+                    raise
+            logger.info("Created bucket: %s", self.bucket)
+            status = {**status, "bucket_exists": True, "created": True}
+        return status
+
+
+class LocalStorage(StorageBackend):
+    """Bucket stand-in on the local filesystem, served by /media in routes/media.py"""
+
+    name = "local"
+
+    def __init__(self, root=LOCAL_STORAGE_DIR):
+        self.root = os.path.abspath(root)
+        self.bucket = BUCKET_NAME
+
+    def path_for(self, path):
+        full = os.path.abspath(os.path.join(self.root, path))
+        if not full.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid object key: {path}")
+        return full
+
+    def _upload(self, path, body, content_type):
+        full = self.path_for(path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        tmp = f"{full}.{uuid4().hex}.tmp"
+        written = 0
+        try:
+            with open(tmp, "wb") as out:
+                if isinstance(body, (bytes, bytearray)):
+                    written = out.write(body)
+                else:
+                    while True:
+                        block = body.read(64 * 1024)
+                        if not block:
+                            break
+                        written += out.write(block)
+            os.replace(tmp, full)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        return written
+
+    def public_url(self, path):
+        return f"{PUBLIC_BASE_URL}/media/{path}"
+
+    def path_from_url(self, url):
+        # Objects stored before /media existed have /api/storage/local/ URLs
+        for marker in ("/api/storage/local/", "/media/"):
+            if url and marker in url:
+                return url.split(marker, 1)[1].split("?", 1)[0]
+        return None
+
+    def download(self, path):
+        with open(self.path_for(path), "rb") as fh:
+            return fh.read()
+
+    def open(self, path):
+        full = self.path_for(path)
+        fh = open(full, "rb")
+        info = os.fstat(fh.fileno())
+        return fh, {"size": info.st_size, "last_modified": info.st_mtime,
+                    "content_type": mimetypes.guess_type(path)[0]}
+
+    def create_signed_upload(self, path, content_type, max_size):
+        token = sign({"purpose": "local-upload", "path": path, "max_size": max_size}, SIGNED_UPLOAD_TTL)
+        return {
+            "url": f"{PUBLIC_BASE_URL}/api/storage/local/{path}?token={token}",
+            "method": "PUT",
+            "headers": {"Content-Type": content_type}
+        }
+
+    def stat(self, path):
+        try:
+            size = os.path.getsize(self.path_for(path))
+        except (OSError, ValueError):
+            return None
+        return {"size": size, "content_type": mimetypes.guess_type(path)[0]}
+
+    def remove(self, paths):
+        for path in paths:
+            try:
+                os.unlink(self.path_for(path))
+            except (OSError, ValueError):
+                pass
+
+    def list_page(self, prefix, limit, offset):
+        try:
+            folder = self.path_for(prefix.rstrip("/"))
+            entries = sorted(
+                (entry for entry in os.scandir(folder) if entry.is_file() and not entry.name.endswith(".tmp")),
+                key=lambda entry: entry.name
+            )
+        except (FileNotFoundError, ValueError):
+            return []
+        objects = []
+        for entry in entries[offset:offset + limit]:
+            info = entry.stat()
+            objects.append({"path": prefix + entry.name, "size": info.st_size, "updated_at": info.st_mtime})
+        return objects
+
+    def check(self):
+        return {"backend": self.name, "bucket": self.root, "bucket_exists": os.path.isdir(self.root)}
+
+    def ensure_bucket(self):
+        os.makedirs(self.root, exist_ok=True)
+        return self.check()
+
+
+BACKENDS = {"supabase": SupabaseStorage, "local": LocalStorage}
+
+if STORAGE_BACKEND not in BACKENDS:
+    raise ValueError(f"STORAGE_BACKEND must be one of {', '.join(BACKENDS)}, not {STORAGE_BACKEND!r}")
+
+# Cheap to construct: neither backend does I/O until it is used
+storage = BACKENDS[STORAGE_BACKEND]()
+
+
+def upload_file(path, stream, content_type):
+    """Upload a (possibly spooled) file to the bucket and return its public URL"""
+    body = open_upload(stream)
+    try:
+        storage.upload(path, body, content_type)
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    return storage.public_url(path)
+
+
+# Bucket folder per media type. Ad posts and advertisements share ad/;
+# objects stored before that may still sit under Ad/
+MEDIA_FOLDERS = {"video": "video", "image": "image", "ad": "ad"}
+
+
+def media_key(media_type, base_filename):
+    """Object key for a file name in its media type's folder"""
+    folder = MEDIA_FOLDERS.get(media_type)
+    return f"{folder}/{base_filename}" if folder else base_filename
+
+
+def media_path(media_type, ext, name=None):
+    """Fresh object key for a new media file, e.g. video/video_<uuid>_<ts>.mp4"""
+    return media_key(media_type, f"{name or media_type}_{uuid4().hex}_{int(time.time())}.{ext}")
@@ -0,0 +1,133 @@
+"""
+Bounded-memory handling of multipart uploads
+"""
+import hashlib
+import io
+import os
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Largest request body accepted at all; checked against Content-Length
+# before any of the body is read
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 512 * 1024 * 1024))
+# Largest single file inside a multipart body
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", UPLOAD_MAX_BYTES))
+# Files are buffered in memory up to this size, then spooled to disk
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", 1024 * 1024))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+
+class SpooledUpload(io.IOBase):
+    """Write-once buffer for an uploaded file that hashes and measures it as it arrives.
+
+    Data stays in memory until `threshold` bytes, then moves to a temporary
+    file, so holding an upload costs at most `threshold` bytes of RAM.
+    Writing past `max_size` aborts the request with 413.
+    """
+
+    def __init__(self, threshold=UPLOAD_SPOOL_THRESHOLD, max_size=UPLOAD_MAX_FILE_BYTES, spool_dir=UPLOAD_SPOOL_DIR):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.spool_dir = spool_dir
+        self.size = 0
+        self.disk_path = None
+        self._file = io.BytesIO()
+        self._hash = hashlib.sha256()
+
+    @property
+    def sha256(self):
+        """Hex SHA-256 of everything written so far"""
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            raise RequestEntityTooLarge(f"File exceeds the {self.max_size} byte upload limit")
+        self._hash.update(data)
+        if self.disk_path is None and self.size > self.threshold:
+            self._rollover()
+        return self._file.write(data)
+
+    def _rollover(self):
+        spooled = tempfile.NamedTemporaryFile(prefix="upload_", dir=self.spool_dir)
+        spooled.write(self._file.getbuffer())
+        self._file = spooled
+        self.disk_path = spooled.name
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readinto(self, buffer):
+        return self._file.readinto(buffer)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+class CappedStream:
+    """Read-only wrapper that aborts with 413 once more than `max_size` bytes are read.
+
+    For raw request bodies, where Content-Length may be missing (chunked
+    transfer) and cannot be trusted to bound what arrives.
+    """
+
+    def __init__(self, stream, max_size):
+        self.stream = stream
+        self.max_size = max_size
+        self.size = 0
+
+    def read(self, size=-1):
+        # Never ask for more than one byte past the limit
+        allowed = self.max_size - self.size + 1
+        block = self.stream.read(allowed if size is None or size < 0 else min(size, allowed))
+        self.size += len(block)
+        if self.size > self.max_size:
+            raise RequestEntityTooLarge(f"Body exceeds {self.max_size} bytes")
+        return block
+
+
+class UploadRequest(Request):
+    """Request class that parses multipart files into SpooledUpload buffers"""
+
+    max_content_length = UPLOAD_MAX_BYTES
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledUpload()
+
+
+def open_upload(stream):
+    """Rewind an uploaded file and return something storage clients can send without buffering.
+
+    Spooled-to-disk uploads are reopened as a fresh file handle, which HTTP
+    clients stream in chunks; small in-memory uploads are returned as bytes.
+    """
+    stream.flush()
+    stream.seek(0)
+    disk_path = getattr(stream, "disk_path", None)
+    if disk_path:
+        return open(disk_path, "rb")
+    return stream.read()
+
@@ -0,0 +1,297 @@
+"""
+Bulk user import from CSV or NDJSON.
+
+Rows are read from the request stream as they arrive and processed in
+batches of IMPORT_BATCH_SIZE. For each batch:
+- passwords are hashed on a pool of IMPORT_HASH_WORKERS threads (bcrypt
+  releases the GIL, so they run in parallel);
+- the batch is COPYed into a temporary staging table;
+- one INSERT ... SELECT ... ON CONFLICT moves the rows that clash with no
+  existing email or username into users, reporting the ones that do.
+
+So a batch costs three round trips instead of three per user.
+
+Rows may carry a bcrypt `password_hash` (e.g. exported from another system)
+instead of a `password`; those skip hashing entirely. Passwords are hashed
+at IMPORT_HASH_ROUNDS, which may be set below PASSWORD_HASH_ROUNDS to speed
+up large imports: users are upgraded to the normal cost by rehash-on-login.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_bcrypt import Bcrypt
+
+from utils.availability import availability
+from utils.db import get_unscoped_connection, return_db_connection
+from utils.passwords import PASSWORD_HASH_ROUNDS
+
+logger = logging.getLogger("users")
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 1000))
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", 100000))
+IMPORT_HASH_WORKERS = int(os.getenv("IMPORT_HASH_WORKERS", os.cpu_count() or 1))
+# bcrypt cost for imported passwords; rehash-on-login raises it later
+IMPORT_HASH_ROUNDS = int(os.getenv("IMPORT_HASH_ROUNDS", PASSWORD_HASH_ROUNDS))
+
+ROLES = ("customer", "admin")
+REQUIRED_FIELDS = ("full_name", "email", "username")
+STAGING_COLUMNS = ("line", "full_name", "username", "email", "password_hash", "role")
+
+_bcrypt = Bcrypt()
+# One import at a time: each one already uses every hashing core
+_import_lock = threading.Lock()
+
+
+class ImportRejected(Exception):
+    """The input as a whole cannot be imported (unknown format, bad CSV header)"""
+
+
+class ImportBusy(ImportRejected):
+    """Another import is already running"""
+
+
+def read_rows(lines, fmt):
+    """Yield (line number, dict) for each record of a CSV or NDJSON byte stream.
+
+    Records that cannot be parsed are yielded as (line number, error message).
+    """
+    if fmt == "csv":
+        text = (line.decode("utf-8-sig") for line in lines)
+        reader = csv.DictReader(text)
+        missing = [field for field in REQUIRED_FIELDS if field not in (reader.fieldnames or [])]
+        if missing:
+            raise ImportRejected(f"CSV header is missing: {', '.join(missing)}")
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == "ndjson":
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield number, f"Invalid JSON: {str(e)}"
+                continue
+            if not isinstance(record, dict):
+                yield number, "Each line must be a JSON object"
+                continue
+            yield number, record
+    else:
+        raise ImportRejected("Format must be csv or ndjson")
+
+
+def validate(record, seen_emails, seen_usernames):
+    """Normalized row for a record, or an error message"""
+    if isinstance(record, str):
+        return record
+    row = {field: str(record.get(field) or "").strip() for field in REQUIRED_FIELDS}
+    missing = [field for field in REQUIRED_FIELDS if not row[field]]
+    if missing:
+        return f"Missing {', '.join(missing)}"
+    if "@" not in row["email"]:
+        return "Invalid email"
+
+    row["role"] = str(record.get("role") or "customer").strip()
+    if row["role"] not in ROLES:
+        return f"role must be one of {', '.join(ROLES)}"
+
+    password_hash = str(record.get("password_hash") or "")
+    password = str(record.get("password") or "")
+    if password_hash:
+        if not password_hash.startswith("$2"):
+            return "password_hash must be a bcrypt hash"
+        row["password_hash"] = password_hash
+    elif password:
+        row["password"] = password
+    else:
+        return "Missing password"
+
+    # Duplicates within the file: the first occurrence wins
+    if row["email"] in seen_emails:
+        return "Duplicate email in import"
+    if row["username"] in seen_usernames:
+        return "Duplicate username in import"
+    seen_emails.add(row["email"])
+    seen_usernames.add(row["username"])
+    return row
+
+
+def _hash(password):
+    return _bcrypt.generate_password_hash(password, IMPORT_HASH_ROUNDS).decode("utf-8")
+
+
+def _copy_buffer(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    for row in rows:
+        writer.writerow([row[column] for column in STAGING_COLUMNS])
+    out.seek(0)
+    return out
+
+
+def load_batch(cur, rows):
+    """COPY a batch into staging (emptied on commit) and insert the rows that do not clash.
+
+    Returns {line: (status, user id or error)} for every row in the batch.
+    """
+    cur.copy_expert(
+        f"COPY user_import_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+        _copy_buffer(rows)
+    )
+    cur.execute("""
+        WITH checked AS MATERIALIZED (
+            SELECT s.*,
+                   EXISTS (SELECT 1 FROM users u WHERE u.email = s.email) AS email_taken,
+                   EXISTS (SELECT 1 FROM users u WHERE u.username = s.username) AS username_taken
+            FROM user_import_staging s
+        ), inserted AS (
+            INSERT INTO users (full_name, username, email, password_hash, role)
+            SELECT full_name, username, email, password_hash, role
+            FROM checked
+            WHERE NOT email_taken AND NOT username_taken
+            ON CONFLICT DO NOTHING
+            RETURNING id, email
+        )
+        SELECT c.line, c.email_taken, c.username_taken, i.id
+        FROM checked c
+        LEFT JOIN inserted i ON i.email = c.email
+    """)
+    results = {}
+    for line, email_taken, username_taken, user_id in cur.fetchall():
+        if user_id is not None:
+            results[line] = ("created", user_id)
+        elif email_taken:
+            results[line] = ("conflict", "Email already exists")
+        elif username_taken:
+            results[line] = ("conflict", "Username already exists")
+        else:
+            # Lost a race with a concurrent signup
+            results[line] = ("conflict", "Email or username already exists")
+    return results
+
+
+def run_import(lines, fmt):
+    """Start an import; returns (reports, release).
+
+    `reports` yields one dict per input row and then {"summary": ...}.
+    `release` frees the import slot and must be called when the response
+    closes, since a generator that never started cannot clean up itself.
+    Raises ImportRejected before anything is yielded if another import is
+    running or the input cannot be read at all.
+    """
+    if not _import_lock.acquire(blocking=False):
+        raise ImportBusy("Another import is already running")
+    released = []
+
+    def release():
+        if not released:
+            released.append(True)
+            _import_lock.release()
+
+    try:
+        records = read_rows(lines, fmt)
+        first = next(records, None)
+    except Exception:
+        release()
+        raise
+    return _import(first, records, release), release
+
+
+def _import(first, records, release):
+    counts = {"created": 0, "conflict": 0, "invalid": 0, "failed": 0}
+    started = time.time()
+    hashing_seconds = 0.0
+    conn = get_unscoped_connection()
+    executor = ThreadPoolExecutor(max_workers=IMPORT_HASH_WORKERS, thread_name_prefix="import-hash")
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS user_import_staging (
+                line INTEGER, full_name TEXT, username TEXT, email TEXT, password_hash TEXT, role TEXT
+            ) ON COMMIT DELETE ROWS
+        """)
+        conn.commit()
+
+        seen_emails, seen_usernames = set(), set()
+        batch = []
+        total = 0
+
+        def flush():
+            nonlocal hashing_seconds
+            hash_started = time.time()
+            to_hash = [row for row in batch if "password" in row]
+            for row, hashed in zip(to_hash, executor.map(_hash, [row.pop("password") for row in to_hash])):
+                row["password_hash"] = hashed
+            hashing_seconds += time.time() - hash_started
+
+            try:
+                results = load_batch(cur, batch)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.warning("User import batch failed: %s", e)
+                results = {row["line"]: ("failed", "Database error") for row in batch}
+
+            created = [row for row in batch if results[row["line"]][0] == "created"]
+            availability.add_many((row["email"], row["username"]) for row in created)
+            reports = []
+            for row in batch:
+                status, detail = results[row["line"]]
+                counts[status] = counts.get(status, 0) + 1
+                report = {"line": row["line"], "email": row["email"], "status": status}
+                report["id" if status == "created" else "error"] = detail
+                reports.append(report)
+            batch.clear()
+            return reports
+
+        def all_records():
+            if first is not None:
+                yield first
+            yield from records
+
+        for line, record in all_records():
+            total += 1
+            if total > IMPORT_MAX_ROWS:
+                yield {"line": line, "status": "invalid", "error": f"Import is limited to {IMPORT_MAX_ROWS} rows"}
+                counts["invalid"] += 1
+                break
+            row = validate(record, seen_emails, seen_usernames)
+            if isinstance(row, str):
+                counts["invalid"] += 1
+                yield {"line": line, "status": "invalid", "error": row}
+                continue
+            row["line"] = line
+            batch.append(row)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                yield from flush()
+        if batch:
+            yield from flush()
+        cur.close()
+
+        elapsed = time.time() - started
+        processed = sum(counts.values())
+        yield {"summary": {
+            **counts,
+            "rows": processed,
+            "seconds": round(elapsed, 3),
+            "hashing_seconds": round(hashing_seconds, 3),
+            "rows_per_sec": round(processed / elapsed, 1) if elapsed else None
+        }}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            conn.rollback()
+            # Do not leave the staging table on a pooled connection
+            with conn.cursor() as cleanup:
+                cleanup.execute("DROP TABLE IF EXISTS user_import_staging")
+            conn.commit()
+        except Exception:
+            pass
+        return_db_connection(conn)
+        release()
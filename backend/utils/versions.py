@@ -0,0 +1,144 @@
+"""
+Per-table version stamps and ETag handling for conditional GETs.
+
+Every write to posts or advertisements bumps that table's stamp, and every
+counter flush (utils/counters.py) bumps "counters". ETags are
+derived from the stamps (plus the request path and query), so a client
+revalidating an unchanged listing gets a 304 without Postgres being
+queried. Stamps live in small files under VERSION_DIR, shared by every
+worker on the host, or in Redis when REDIS_URL is set so several hosts
+agree.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from functools import wraps
+from uuid import uuid4
+
+from flask import g, make_response, request
+
+logger = logging.getLogger("versions")
+
+VERSION_DIR = os.getenv("VERSION_DIR") or os.path.join(tempfile.gettempdir(), "bigteam-versions")
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_PREFIX = "bigteam:version:"
+
+TABLES = ("posts", "ads", "users", "counters")
+
+
+class FileStamps:
+    """Stamps stored one file per table; each bump writes a fresh unique token"""
+
+    def __init__(self, root=VERSION_DIR):
+        self.root = root
+
+    def get(self, tables):
+        stamps = []
+        for table in tables:
+            try:
+                with open(os.path.join(self.root, table)) as fh:
+                    stamps.append(fh.read().strip() or self.bump(table))
+            except FileNotFoundError:
+                stamps.append(self.bump(table))
+        return stamps
+
+    def bump(self, table):
+        os.makedirs(self.root, exist_ok=True)
+        token = f"{time.time_ns():x}.{os.getpid():x}.{uuid4().hex[:8]}"
+        path = os.path.join(self.root, table)
+        tmp = f"{path}.{uuid4().hex}.tmp"
+        with open(tmp, "w") as fh:
+            fh.write(token)
+        os.replace(tmp, path)
+        return token
+
+
+class RedisStamps:
+    """Stamps stored as Redis counters, seeded from the clock so a lost key never repeats a value"""
+
+    def __init__(self, url=REDIS_URL):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, tables):
+        keys = [REDIS_PREFIX + table for table in tables]
+        values = self.client.mget(keys)
+        for i, value in enumerate(values):
+            if value is None:
+                self.client.set(keys[i], time.time_ns(), nx=True)
+                values[i] = self.client.get(keys[i])
+        return [value.decode() if isinstance(value, bytes) else str(value) for value in values]
+
+    def bump(self, table):
+        key = REDIS_PREFIX + table
+        if not self.client.exists(key):
+            self.client.set(key, time.time_ns(), nx=True)
+        return str(self.client.incr(key))
+
+
+stamps = RedisStamps() if REDIS_URL else FileStamps()
+
+
+def bump(*tables):
+    """Mark tables as changed; call after the write has committed"""
+    for table in tables:
+        try:
+            stamps.bump(table)
+        except Exception as e:
+            logger.warning("Failed to bump %s version: %s", table, e)
+
+
+def current(tables):
+    """Current stamps for the tables, or None if they cannot be read"""
+    try:
+        return stamps.get(tables)
+    except Exception as e:
+        logger.warning("Failed to read table versions: %s", e)
+        return None
+
+
+def uncacheable():
+    """Keep the current response from being given an ETag (e.g. a fallback after an error)"""
+    g._uncacheable = True
+
+
+def conditional(*tables, cache_control="no-cache", extra=None, not_modified=None):
+    """Serve a GET view with a strong ETag built from the tables' version stamps.
+
+    A matching If-None-Match is answered with 304 before the view runs.
+    `extra` may return additional state the response depends on that
+    the stamps do not cover (e.g. which ads are live right now).
+    `not_modified(etag)` runs before a 304 is sent, for side effects a
+    request has whether or not the body is resent (e.g. counting views);
+    if it returns False the view runs and the full response is sent.
+    The view can read the ETag it will be served with as g.etag.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = current(tables)
+            etag = None
+            if versions is not None:
+                parts = [*versions, request.path, *sorted(request.args.items(multi=True))]
+                if extra is not None:
+                    parts.append(extra())
+                etag = hashlib.sha1(repr(parts).encode()).hexdigest()[:24]
+                if request.if_none_match.contains(etag) and (not_modified is None or not_modified(etag) is not False):
+                    response = make_response("", 304)
+                    response.set_etag(etag)
+                    response.headers["Cache-Control"] = cache_control
+                    return response
+
+            g.etag = etag
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or g.pop("_uncacheable", False):
+                response.headers["Cache-Control"] = "no-store"
+                return response
+            if etag:
+                response.set_etag(etag)
+            response.headers["Cache-Control"] = cache_control
+            return response
+        return wrapper
+    return decorator
@@ -17,6 +17,7 @@ import {
 } from 'lucide-react'
 import { Post } from '../../../types/post'
 import api from '../../../services/api'
+import { uploadService, RESUMABLE_THRESHOLD } from '../../../services/uploadService'
 
 interface MediaUploadProps {
   onUploadComplete: (post: Post) => void
@@ -217,25 +218,39 @@ const MediaUpload: React.FC<MediaUploadProps> = ({ onUploadComplete, onCancel })
         i === index ? { ...f, status: 'uploading', progress: 0 } : f
       ))
 
-      const response = await api.post('/upload', formData, {
-        headers: { 'Content-Type': 'multipart/form-data' },
-        onUploadProgress: (progressEvent) => {
-          const progress = progressEvent.total
-            ? Math.min(95, Math.round((progressEvent.loaded * 100) / progressEvent.total))
-            : 0
-
-          // Simulate more realistic progress - slower at the beginning and end
-          const adjustedProgress = progress < 20
-            ? progress * 0.5  // Slower start
-            : progress < 80
-            ? 10 + (progress - 20) * 1.2  // Normal speed in middle
-            : 80 + (progress - 80) * 0.75  // Slower near end, max 95% until response
-
-          setFiles(prev => prev.map((f, i) =>
-            i === index ? { ...f, progress: Math.round(adjustedProgress), status: 'uploading' } : f
-          ))
-        }
-      })
+      const response = fileWithPreview.file.size > RESUMABLE_THRESHOLD
+        ? await uploadService.resumableUpload(
+            fileWithPreview.file,
+            {
+              title: title || fileWithPreview.file.name,
+              content,
+              media_type: fileWithPreview.type,
+              created_by: localStorage.getItem('userId') || '1',
+            },
+            fileWithPreview.type === 'video' ? fileWithPreview.thumbnailBlob ?? null : null,
+            (percent) => setFiles(prev => prev.map((f, i) =>
+              i === index ? { ...f, progress: Math.min(95, percent), status: 'uploading' } : f
+            ))
+          )
+        : await api.post('/upload', formData, {
+            headers: { 'Content-Type': 'multipart/form-data' },
+            onUploadProgress: (progressEvent) => {
+              const progress = progressEvent.total
+                ? Math.min(95, Math.round((progressEvent.loaded * 100) / progressEvent.total))
+                : 0
+
+              // Simulate more realistic progress - slower at the beginning and end
+              const adjustedProgress = progress < 20
+                ? progress * 0.5  // Slower start
+                : progress < 80
+                ? 10 + (progress - 20) * 1.2  // Normal speed in middle
+                : 80 + (progress - 80) * 0.75  // Slower near end, max 95% until response
+
+              setFiles(prev => prev.map((f, i) =>
+                i === index ? { ...f, progress: Math.round(adjustedProgress), status: 'uploading' } : f
+              ))
+            }
+          })
 
       setFiles(prev => prev.map((f, i) =>
         i === index ? { ...f, status: 'complete', progress: 100 } : f
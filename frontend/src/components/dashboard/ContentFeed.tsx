@@ -34,7 +34,7 @@ const ContentFeed: React.FC = () => {
   const [currentIndex, setCurrentIndex] = useState(0)
   const [loading, setLoading] = useState(true)
   const [loadingMore, setLoadingMore] = useState(false)
-  const [page, setPage] = useState(1)
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
   const [hasMore, setHasMore] = useState(true)
   const [isPlaying, setIsPlaying] = useState(true)
   const [isMuted, setIsMuted] = useState(false) // Changed to false for better UX
@@ -89,18 +89,18 @@ const ContentFeed: React.FC = () => {
 
     try {
       const response = await api.get('/api/feed', {
-        params: { page: loadMore ? page + 1 : 1, limit: 5 } // Reduced for faster loading
+        params: { cursor: loadMore ? nextCursor ?? '' : '', limit: 5 } // Reduced for faster loading
       })
 
-      const { feed, has_more } = response.data
+      const { feed, has_more, next_cursor } = response.data
 
       if (loadMore) {
         setFeedData(prev => [...prev, ...feed])
-        setPage(prev => prev + 1)
       } else {
         setFeedData(feed)
       }
-      setHasMore(has_more)
+      setNextCursor(next_cursor)
+      setHasMore(has_more && !!next_cursor)
     } catch (error) {
       console.error('Failed to fetch feed:', error)
     } finally {
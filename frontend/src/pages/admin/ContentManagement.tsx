@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useCallback, useRef } from 'react'
 import { motion, AnimatePresence } from 'framer-motion'
 import {
   Grid3X3,
@@ -13,74 +13,91 @@ import {
 import MediaUpload from '../../components/dashboard/Content/MediaUpload'
 import MediaPreview from '../../components/dashboard/Content/MediaPreview'
 import ContentList from '../../components/dashboard/Content/ContentList'
-import { Post } from '../../types/post'
+import { Post, PostQuery, PostSort, PostStats } from '../../types/post'
 import { postService } from '../../services/postService'
 import { useData } from '../../contexts/DataContext'
 
+// Posts fetched per page; filtering and sorting happen on the server
+const PAGE_SIZE = 24
+
 const ContentManagement: React.FC = () => {
-  const { posts, postsLoading, postsError, fetchPosts, addPost, updatePost: updatePostInContext, deletePost: deletePostFromContext } = useData()
+  const { addPost, updatePost: updatePostInContext, deletePost: deletePostFromContext } = useData()
 
   const [activeTab, setActiveTab] = useState<'all' | 'videos' | 'images'>('all')
   const [viewMode, setViewMode] = useState<'grid' | 'list'>('grid')
   const [showUploadModal, setShowUploadModal] = useState(false)
   const [selectedPost, setSelectedPost] = useState<Post | null>(null)
-  const [filteredPosts, setFilteredPosts] = useState<Post[]>([])
   const [filterStatus, setFilterStatus] = useState<'all' | 'published' | 'draft'>('all')
-  const [sortBy, setSortBy] = useState<'newest' | 'oldest' | 'most-viewed' | 'most-liked'>('newest')
+  const [sortBy, setSortBy] = useState<PostSort>('newest')
+
+  const [posts, setPosts] = useState<Post[]>([])
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  const [postsLoading, setPostsLoading] = useState(false)
+  const [postsError, setPostsError] = useState<string | null>(null)
+  const [serverStats, setServerStats] = useState<PostStats | null>(null)
+  const requestRef = useRef(0)
 
   // Stats for dashboard
   const stats = {
-    totalPosts: posts.length,
-    publishedPosts: posts.filter(p => p.is_published).length,
-    totalViews: posts.reduce((acc, post) => acc + post.views_count, 0),
-    totalEngagement: posts.reduce((acc, post) => acc + post.likes_count + post.shares_count, 0)
+    totalPosts: serverStats?.total_posts ?? 0,
+    publishedPosts: serverStats?.published_posts ?? 0,
+    totalViews: serverStats?.total_views ?? 0,
+    totalEngagement: serverStats?.total_engagement ?? 0
   }
 
-  // Load posts on component mount - will use cached data if available
-  useEffect(() => {
-    fetchPosts()
+  const fetchStats = useCallback(async () => {
+    try {
+      const response = await postService.getPostStats()
+      setServerStats(response.data)
+    } catch (err) {
+      console.error('Error loading post stats:', err)
+    }
   }, [])
 
-  useEffect(() => {
-    // Filter and sort posts
-    let filtered = posts
+  // Load the first page (or the next one) for the current filters
+  const fetchPosts = useCallback(async (loadMore: boolean = false) => {
+    const query: PostQuery = { sort: sortBy, limit: PAGE_SIZE }
+    if (activeTab === 'videos') query.media_type = 'video'
+    if (activeTab === 'images') query.media_type = 'image'
+    if (filterStatus === 'published') query.is_published = 'true'
+    if (filterStatus === 'draft') query.is_published = 'false'
+    if (loadMore && nextCursor) query.cursor = nextCursor
 
-    // Filter by media type
-    if (activeTab === 'videos') {
-      filtered = filtered.filter(post => post.media_type === 'video')
-    } else if (activeTab === 'images') {
-      filtered = filtered.filter(post => post.media_type === 'image')
+    // Ignore responses for filters the user has already moved away from
+    const requestId = ++requestRef.current
+    setPostsLoading(true)
+    setPostsError(null)
+    try {
+      const response = await postService.queryPosts(query)
+      if (requestId !== requestRef.current) return
+      setPosts(prev => loadMore ? [...prev, ...response.data.posts] : response.data.posts)
+      setNextCursor(response.data.next_cursor)
+    } catch (error: any) {
+      if (requestId !== requestRef.current) return
+      setPostsError(error.response?.data?.error || 'Failed to fetch posts')
+    } finally {
+      if (requestId === requestRef.current) setPostsLoading(false)
     }
+  }, [activeTab, filterStatus, sortBy, nextCursor])
 
-    // Filter by publish status
-    if (filterStatus === 'published') {
-      filtered = filtered.filter(post => post.is_published)
-    } else if (filterStatus === 'draft') {
-      filtered = filtered.filter(post => !post.is_published)
-    }
+  const refresh = () => {
+    fetchPosts()
+    fetchStats()
+  }
 
-    // Sort posts
-    filtered = [...filtered].sort((a, b) => {
-      switch (sortBy) {
-        case 'oldest':
-          return new Date(a.created_at).getTime() - new Date(b.created_at).getTime()
-        case 'most-viewed':
-          return b.views_count - a.views_count
-        case 'most-liked':
-          return b.likes_count - a.likes_count
-        case 'newest':
-        default:
-          return new Date(b.created_at).getTime() - new Date(a.created_at).getTime()
-      }
-    })
+  useEffect(() => {
+    fetchStats()
+  }, [fetchStats])
 
-    setFilteredPosts(filtered)
-  }, [posts, activeTab, filterStatus, sortBy])
+  useEffect(() => {
+    fetchPosts()
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [activeTab, filterStatus, sortBy])
 
   const handleUploadComplete = (newPost: Post) => {
     addPost(newPost) // Add to global context
     setShowUploadModal(false)
-    // Don't fetch again - we already have the new post
+    refresh()
   }
 
   const handleTogglePublish = async (postId: string) => {
@@ -90,6 +107,8 @@ const ContentManagement: React.FC = () => {
     try {
       await postService.updatePost(postId, { is_published: !post.is_published })
       updatePostInContext(postId, { is_published: !post.is_published })
+      setPosts(prev => prev.map(p => p.id === postId ? { ...p, is_published: !post.is_published } : p))
+      fetchStats()
     } catch (err) {
       console.error('Error updating post:', err)
     }
@@ -99,15 +118,17 @@ const ContentManagement: React.FC = () => {
     try {
       await postService.deletePost(postId)
       deletePostFromContext(postId)
+      setPosts(prev => prev.filter(p => p.id !== postId))
+      fetchStats()
     } catch (err) {
       console.error('Error deleting post:', err)
     }
   }
 
   const tabs = [
-    { id: 'all', label: 'All Content', icon: Grid3X3, count: posts.length },
-    { id: 'videos', label: 'Videos', icon: Video, count: posts.filter(p => p.media_type === 'video').length },
-    { id: 'images', label: 'Images', icon: Image, count: posts.filter(p => p.media_type === 'image').length }
+    { id: 'all', label: 'All Content', icon: Grid3X3, count: serverStats?.total_posts ?? 0 },
+    { id: 'videos', label: 'Videos', icon: Video, count: serverStats?.videos ?? 0 },
+    { id: 'images', label: 'Images', icon: Image, count: serverStats?.images ?? 0 }
   ]
 
   return (
@@ -126,7 +147,7 @@ const ContentManagement: React.FC = () => {
             </div>
             <div className="flex gap-2">
               <button
-                onClick={() => fetchPosts(true)}
+                onClick={refresh}
                 disabled={postsLoading}
                 className="inline-flex items-center gap-2 px-4 py-2 border border-light-300 dark:border-dark-600 rounded-lg hover:bg-light-50 dark:hover:bg-dark-700 transition-all duration-300 disabled:opacity-50"
               >
@@ -291,9 +312,7 @@ const ContentManagement: React.FC = () => {
               </div>
             </div>
             <button
-              onClick={() => {
-                fetchPosts(true)
-              }}
+              onClick={refresh}
               className="text-sm font-medium text-red-600 dark:text-red-400 hover:text-red-500 dark:hover:text-red-300"
             >
               Retry
@@ -305,13 +324,24 @@ const ContentManagement: React.FC = () => {
       {/* Content Area */}
       <div className="px-4 sm:px-6 lg:px-8 py-6">
         <ContentList
-          posts={filteredPosts}
+          posts={posts}
           viewMode={viewMode}
           onTogglePublish={handleTogglePublish}
           onDelete={handleDeletePost}
           onEdit={(post) => setSelectedPost(post)}
-          isLoading={postsLoading}
+          isLoading={postsLoading && posts.length === 0}
         />
+        {nextCursor && (
+          <div className="flex justify-center mt-6">
+            <button
+              onClick={() => fetchPosts(true)}
+              disabled={postsLoading}
+              className="px-4 py-2 border border-light-300 dark:border-dark-600 rounded-lg text-sm hover:bg-light-50 dark:hover:bg-dark-700 transition-all duration-300 disabled:opacity-50"
+            >
+              {postsLoading ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
       </div>
 
       {/* Upload Modal */}
@@ -355,6 +385,7 @@ const ContentManagement: React.FC = () => {
           onClose={() => setSelectedPost(null)}
           onSave={(updatedPost) => {
             updatePostInContext(updatedPost.id, updatedPost)
+            setPosts(prev => prev.map(p => p.id === updatedPost.id ? { ...p, ...updatedPost } : p))
             setSelectedPost(null)
           }}
         />
@@ -1,38 +1,70 @@
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useCallback, useRef } from 'react'
 import { motion } from 'framer-motion'
 import { Users, UserPlus, Search, Filter, ChevronDown } from 'lucide-react'
 import { userService, CreateUserPayload } from '../../services/userService'
-import { User } from '../../types/user'
+import { User, UserQuery } from '../../types/user'
 import CreateUserForm from '../../components/dashboard/Users/CreateUserForm'
 import UsersTable from '../../components/dashboard/Users/UsersTable'
 
 type TabType = 'create' | 'view'
+type RoleFilter = 'customer' | 'admin' | 'all'
+type StatusFilter = 'all' | 'active' | 'inactive'
+
+// Users fetched per page; search and filters run on the server
+const PAGE_SIZE = 25
+// Wait for typing to pause before searching
+const SEARCH_DEBOUNCE_MS = 250
 
 const UserManagement: React.FC = () => {
   const [activeTab, setActiveTab] = useState<TabType>('view')
   const [users, setUsers] = useState<User[]>([])
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  const [total, setTotal] = useState<{ count: number; estimate: boolean } | null>(null)
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState<string | null>(null)
   const [success, setSuccess] = useState<string | null>(null)
   const [searchTerm, setSearchTerm] = useState('')
-  const [filterRole, setFilterRole] = useState<'all' | 'customer'>('all')
+  const [debouncedSearch, setDebouncedSearch] = useState('')
+  const [filterRole, setFilterRole] = useState<RoleFilter>('customer')
+  const [filterStatus, setFilterStatus] = useState<StatusFilter>('all')
+  const requestRef = useRef(0)
 
   useEffect(() => {
-    fetchUsers()
-  }, [])
+    const timer = setTimeout(() => setDebouncedSearch(searchTerm.trim()), SEARCH_DEBOUNCE_MS)
+    return () => clearTimeout(timer)
+  }, [searchTerm])
+
+  // Load the first page (or the next one) for the current search and filters
+  const fetchUsers = useCallback(async (loadMore: boolean = false) => {
+    const query: UserQuery = { role: filterRole, limit: PAGE_SIZE }
+    if (debouncedSearch) query.q = debouncedSearch
+    if (filterStatus !== 'all') query.is_active = filterStatus === 'active' ? 'true' : 'false'
+    if (loadMore && nextCursor) query.cursor = nextCursor
 
-  const fetchUsers = async () => {
+    // Ignore responses for searches the user has already moved away from
+    const requestId = ++requestRef.current
     setLoading(true)
     try {
-      const response = await userService.getAllUsers()
-      setUsers(response.data || [])
+      const response = await userService.queryUsers(query)
+      if (requestId !== requestRef.current) return
+      setUsers(prev => loadMore ? [...prev, ...response.data.users] : response.data.users)
+      setNextCursor(response.data.next_cursor)
+      if (response.data.total !== undefined) {
+        setTotal({ count: response.data.total, estimate: !!response.data.total_is_estimate })
+      }
     } catch (err) {
+      if (requestId !== requestRef.current) return
       setError('Failed to fetch users')
       console.error('Error fetching users:', err)
     } finally {
-      setLoading(false)
+      if (requestId === requestRef.current) setLoading(false)
     }
-  }
+  }, [debouncedSearch, filterRole, filterStatus, nextCursor])
+
+  useEffect(() => {
+    fetchUsers()
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [debouncedSearch, filterRole, filterStatus])
 
   const handleCreateUser = async (userData: CreateUserPayload) => {
     setLoading(true)
@@ -60,17 +92,6 @@ const UserManagement: React.FC = () => {
     }
   }
 
-  const filteredUsers = users.filter(user => {
-    const matchesSearch =
-      user.full_name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-      user.email.toLowerCase().includes(searchTerm.toLowerCase()) ||
-      (user.username?.toLowerCase().includes(searchTerm.toLowerCase()) ?? false)
-
-    const matchesRole = filterRole === 'all' || user.role === filterRole
-
-    return matchesSearch && matchesRole
-  })
-
   const tabAnimation = {
     hidden: { opacity: 0, y: 20 },
     visible: { opacity: 1, y: 0 },
@@ -176,23 +197,54 @@ const UserManagement: React.FC = () => {
                   <Filter className="absolute left-3 top-1/2 -translate-y-1/2 w-4 h-4 text-dark-500" />
                   <select
                     value={filterRole}
-                    onChange={(e) => setFilterRole(e.target.value as 'all' | 'customer')}
+                    onChange={(e) => setFilterRole(e.target.value as RoleFilter)}
                     className="w-full pl-10 pr-8 py-2 bg-light-50 dark:bg-dark-800 border border-light-300 dark:border-dark-600 rounded-lg appearance-none focus:outline-none focus:ring-2 focus:ring-accent-bitcoin cursor-pointer"
                   >
                     <option value="all">All Users</option>
                     <option value="customer">Customer</option>
+                    <option value="admin">Admin</option>
+                  </select>
+                  <ChevronDown className="absolute right-3 top-1/2 -translate-y-1/2 w-4 h-4 text-dark-500 pointer-events-none" />
+                </div>
+
+                <div className="relative min-w-[150px]">
+                  <select
+                    value={filterStatus}
+                    onChange={(e) => setFilterStatus(e.target.value as StatusFilter)}
+                    className="w-full px-4 pr-8 py-2 bg-light-50 dark:bg-dark-800 border border-light-300 dark:border-dark-600 rounded-lg appearance-none focus:outline-none focus:ring-2 focus:ring-accent-bitcoin cursor-pointer"
+                  >
+                    <option value="all">Any Status</option>
+                    <option value="active">Active</option>
+                    <option value="inactive">Inactive</option>
                   </select>
                   <ChevronDown className="absolute right-3 top-1/2 -translate-y-1/2 w-4 h-4 text-dark-500 pointer-events-none" />
                 </div>
               </div>
+              {total && (
+                <p className="text-sm text-dark-600 dark:text-dark-400 mt-3">
+                  {total.estimate ? 'About ' : ''}{total.count.toLocaleString()} users
+                </p>
+              )}
             </motion.div>
 
             {/* Users Table */}
             <UsersTable
-              users={filteredUsers}
+              users={users}
               loading={loading}
-              onRefresh={fetchUsers}
+              onRefresh={() => fetchUsers()}
             />
+
+            {nextCursor && (
+              <div className="flex justify-center">
+                <button
+                  onClick={() => fetchUsers(true)}
+                  disabled={loading}
+                  className="px-6 py-2 rounded-lg bg-light-100 dark:bg-dark-800 hover:bg-light-200 dark:hover:bg-dark-700 transition-all disabled:opacity-50"
+                >
+                  {loading ? 'Loading...' : 'Load more'}
+                </button>
+              </div>
+            )}
           </div>
         ) : (
           <CreateUserForm
@@ -1,6 +1,6 @@
 import axios from 'axios'
 
-const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://localhost:5000'
+export const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://localhost:5000'
 
 const api = axios.create({
   baseURL: API_BASE_URL,
@@ -17,9 +17,36 @@ api.interceptors.request.use((config) => {
   return config
 })
 
+// Concurrent 401s share one refresh request
+let refreshing: Promise<string> | null = null
+
+const refreshAccessToken = () => {
+  if (!refreshing) {
+    refreshing = import('./authService')
+      .then(({ authService }) => authService.refreshToken())
+      .then((tokens) => tokens.access_token)
+      .finally(() => {
+        refreshing = null
+      })
+  }
+  return refreshing
+}
+
 api.interceptors.response.use(
   (response) => response,
   async (error) => {
+    const original = error.config
+    if (error.response?.status === 401 && original && !original._retried && localStorage.getItem('refresh_token')) {
+      // The access token has probably expired: renew it once and retry
+      original._retried = true
+      try {
+        const token = await refreshAccessToken()
+        original.headers.Authorization = `Bearer ${token}`
+        return api(original)
+      } catch {
+        // Fall through to logging out
+      }
+    }
     if (error.response?.status === 401) {
       localStorage.removeItem('access_token')
       localStorage.removeItem('refresh_token')
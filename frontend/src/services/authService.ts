@@ -1,28 +1,49 @@
-import api from './api'
+import axios from 'axios'
+import api, { API_BASE_URL } from './api'
+
+export interface TokenPair {
+  access_token: string
+  refresh_token: string
+  token_type: 'Bearer'
+  expires_in: number
+}
+
+export const storeTokens = (tokens: TokenPair) => {
+  localStorage.setItem('access_token', tokens.access_token)
+  localStorage.setItem('refresh_token', tokens.refresh_token)
+}
 
 export const authService = {
   login: async (credentials: { email: string; password: string }) => {
     const response = await api.post('/auth/login', credentials)
-    // Backend doesn't return tokens yet, just user data
-    // Will need JWT implementation in backend later
     if (response.data.user) {
-      // Store user data temporarily
       localStorage.setItem('user', JSON.stringify(response.data.user))
+      localStorage.setItem('userId', response.data.user.id)
+    }
+    if (response.data.access_token) {
+      storeTokens(response.data)
     }
     return response
   },
 
   logout: async () => {
-    // Backend doesn't have logout endpoint yet
-    // Just clear local storage for now
+    // Tokens are stateless; forgetting them is enough
     localStorage.removeItem('user')
+    localStorage.removeItem('userId')
     localStorage.removeItem('access_token')
     localStorage.removeItem('refresh_token')
   },
 
   refreshToken: async () => {
-    // Backend doesn't have refresh token endpoint yet
-    // Will need JWT implementation in backend later
-    return Promise.reject(new Error('Refresh token not implemented'))
+    const refreshToken = localStorage.getItem('refresh_token')
+    if (!refreshToken) {
+      throw new Error('Not logged in')
+    }
+    // Plain axios so a failed refresh does not re-enter the 401 handler
+    const response = await axios.post<TokenPair>(`${API_BASE_URL}/auth/refresh`, {
+      refresh_token: refreshToken,
+    })
+    storeTokens(response.data)
+    return response.data
   },
-}
\ No newline at end of file
+}
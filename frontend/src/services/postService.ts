@@ -1,9 +1,16 @@
 import api from './api'
-import { Post } from '../types/post'
+import { Post, PostQuery, PostPage, PostStats, PostSearchQuery, PostSearchPage } from '../types/post'
 
 export const postService = {
   getAllPosts: () => api.get<Post[]>('/api/posts'),
 
+  queryPosts: (query: PostQuery) => api.get<PostPage>('/api/posts', { params: query }),
+
+  searchPosts: (query: PostSearchQuery) =>
+    api.get<PostSearchPage>('/api/posts/search', { params: query }),
+
+  getPostStats: () => api.get<PostStats>('/api/posts/stats'),
+
   getPost: (id: string) => api.get<Post>(`/api/posts/${id}`),
 
   createPost: (data: FormData) =>
@@ -14,6 +21,13 @@ export const postService = {
   updatePost: (id: string, data: Partial<Post>) =>
     api.put<Post>(`/api/admin/posts/${id}`, data),
 
+  // Publish, unpublish or delete many posts in one request
+  batchPosts: (action: 'publish' | 'unpublish' | 'delete', ids: string[]) =>
+    api.post<{ action: string; updated?: number; deleted?: number; not_found?: string[] }>(
+      '/api/posts/batch',
+      { action, ids }
+    ),
+
   deletePost: (id: string) =>
     api.delete(`/api/admin/posts/${id}`),
 
@@ -0,0 +1,100 @@
+import api from './api'
+
+// Files above this size go through the resumable chunked upload API
+export const RESUMABLE_THRESHOLD = 8 * 1024 * 1024
+
+const MAX_CHUNK_ATTEMPTS = 5
+
+interface ResumableFields {
+  title: string
+  content: string
+  media_type: string
+  created_by: string
+}
+
+interface UploadStatus {
+  upload_id: string
+  chunk_size: number
+  total_chunks: number
+  missing_chunks: number[]
+  status: string
+}
+
+const sessionKey = (file: File) => `upload:${file.name}:${file.size}:${file.lastModified}`
+
+const sha256Base64 = async (data: ArrayBuffer) => {
+  const digest = new Uint8Array(await crypto.subtle.digest('SHA-256', data))
+  return btoa(String.fromCharCode(...digest))
+}
+
+const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms))
+
+const openSession = async (file: File, fields: ResumableFields): Promise<UploadStatus> => {
+  // Pick up where a previous attempt for the same file left off
+  const existing = localStorage.getItem(sessionKey(file))
+  if (existing) {
+    try {
+      const { data } = await api.get<UploadStatus>(`/api/uploads/${existing}`)
+      if (data.status === 'open') return data
+    } catch {
+      // Expired or unknown session: start a new one
+    }
+  }
+
+  const { data } = await api.post('/api/uploads', {
+    ...fields,
+    filename: file.name,
+    size: file.size,
+    content_type: file.type,
+  })
+  localStorage.setItem(sessionKey(file), data.upload_id)
+  return {
+    ...data,
+    missing_chunks: Array.from({ length: data.total_chunks }, (_, i) => i),
+    status: 'open',
+  }
+}
+
+export const uploadService = {
+  resumableUpload: async (
+    file: File,
+    fields: ResumableFields,
+    thumbnail: Blob | null,
+    onProgress: (percent: number) => void
+  ) => {
+    const session = await openSession(file, fields)
+    const { upload_id, chunk_size, total_chunks } = session
+    let done = total_chunks - session.missing_chunks.length
+    onProgress(Math.round((done * 100) / total_chunks))
+
+    for (const index of session.missing_chunks) {
+      const chunk = await file.slice(index * chunk_size, (index + 1) * chunk_size).arrayBuffer()
+      const checksum = await sha256Base64(chunk)
+
+      for (let attempt = 1; ; attempt++) {
+        try {
+          await api.patch(`/api/uploads/${upload_id}/chunks/${index}`, chunk, {
+            headers: {
+              'Content-Type': 'application/octet-stream',
+              'Upload-Checksum': `sha256 ${checksum}`,
+            },
+          })
+          break
+        } catch (error) {
+          if (attempt >= MAX_CHUNK_ATTEMPTS) throw error
+          await sleep(500 * 2 ** attempt)
+        }
+      }
+      done += 1
+      onProgress(Math.round((done * 100) / total_chunks))
+    }
+
+    const formData = new FormData()
+    if (thumbnail) formData.append('thumbnail', thumbnail, 'thumbnail.jpg')
+    const response = await api.post(`/api/uploads/${upload_id}/finalize`, formData, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+    })
+    localStorage.removeItem(sessionKey(file))
+    return response
+  },
+}
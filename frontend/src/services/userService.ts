@@ -1,5 +1,5 @@
 import api from './api'
-import { User } from '../types/user'
+import { User, UserQuery, UserPage } from '../types/user'
 
 export interface CreateUserPayload {
   full_name: string
@@ -17,11 +17,25 @@ export const userService = {
     return response
   },
 
+  // One page of users, filtered and searched on the server
+  queryUsers: (query: UserQuery) => api.get<UserPage>('/auth/admin/users', { params: query }),
+
   getUser: (id: string) => api.get<User>(`/admin/users/${id}`),
 
   // Using the actual backend register endpoint for user creation
   createUser: (data: CreateUserPayload) => api.post('/auth/register', data),
 
+  // Bulk import from a .csv or .ndjson file; the response is an NDJSON report
+  // with one line per row followed by a {"summary": ...} line
+  importUsers: (file: File) => {
+    const formData = new FormData()
+    formData.append('file', file)
+    return api.post<string>('/auth/admin/users/import', formData, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+      responseType: 'text',
+    })
+  },
+
   updateUser: (id: string, data: Partial<User>) => api.put<User>(`/admin/users/${id}`, data),
 
   deleteUser: (id: string) => api.delete(`/admin/users/${id}`),
@@ -41,4 +55,13 @@ export const userService = {
     const response = await api.post<{ exists: boolean }>('/auth/check-username', { username })
     return response.data.exists
   },
+
+  // Check many candidates in one request, e.g. when suggesting usernames
+  checkAvailability: async (candidates: { emails?: string[]; usernames?: string[] }) => {
+    const response = await api.post<{
+      emails?: Record<string, boolean>
+      usernames?: Record<string, boolean>
+    }>('/auth/check-availability', candidates)
+    return response.data
+  },
 }
\ No newline at end of file
@@ -12,4 +12,53 @@ export interface Post {
   likes_count: number
   shares_count: number
   views_count: number
-}
\ No newline at end of file
+}
+export type PostSort = 'newest' | 'oldest' | 'most-viewed' | 'most-liked'
+
+export interface PostQuery {
+  media_type?: 'video' | 'image'
+  is_published?: 'true' | 'false'
+  created_by?: string
+  created_after?: string
+  created_before?: string
+  sort?: PostSort
+  limit?: number
+  cursor?: string
+}
+
+export interface PostPage {
+  posts: Post[]
+  limit: number
+  sort: PostSort
+  has_more: boolean
+  next_cursor: string | null
+  total?: number
+  total_is_estimate?: boolean
+}
+
+export type SearchMode = 'auto' | 'fulltext' | 'fuzzy'
+
+export interface PostSearchQuery extends Omit<PostQuery, 'sort'> {
+  q: string
+  mode?: SearchMode
+}
+
+export interface PostSearchResult extends Post {
+  rank: number
+}
+
+export interface PostSearchPage {
+  results: PostSearchResult[]
+  mode: Exclude<SearchMode, 'auto'>
+  has_more: boolean
+  next_cursor: string | null
+}
+
+export interface PostStats {
+  total_posts: number
+  published_posts: number
+  videos: number
+  images: number
+  total_views: number
+  total_engagement: number
+}
@@ -8,4 +8,20 @@ export interface User {
   created_at?: string
   updated_at?: string
   profile_picture?: string
-}
\ No newline at end of file
+}
+export interface UserQuery {
+  q?: string
+  role?: 'customer' | 'admin' | 'all'
+  is_active?: 'true' | 'false'
+  limit?: number
+  cursor?: string
+}
+
+export interface UserPage {
+  users: User[]
+  limit: number
+  has_more: boolean
+  next_cursor: string | null
+  total?: number
+  total_is_estimate?: boolean
+}